@@ -0,0 +1,84 @@
+# Timings of the NumPy code and of the Numba kernels (kernel_tools) for the functions that use them, on synthetic
+# fields of the size of a canyon run.
+#
+# Usage, with canyon_tools installed (pip install -e .):
+#   python benchmarks/kernel_benchmark.py                      # 19x90x360x360 float32, as the runs
+#   python benchmarks/kernel_benchmark.py --shape 5 45 180 180 --repeat 5
+#
+# The first Numba call of every kernel (compilation, or loading Numba's cache) is not timed. Set NUMBA_NUM_THREADS=1
+# to compare with a single core.
+
+import argparse
+
+import contextlib
+
+import io
+
+import time
+
+import numpy as np
+
+import canyon_tools.kernel_tools as kt
+
+import canyon_tools.metrics_tools as mtt
+
+import canyon_tools.shelfbreak_tools as sbt
+
+
+def _syntheticRun(nt,nz,ny,nx,seed=0):
+    '''Shelf and slope grid and a tracer that increases with depth, with noise.'''
+    rng = np.random.default_rng(seed)
+    drF = np.full(nz,5.0)
+    depth = np.where(np.arange(ny) < ny//2,nz*5.0,nz*5.0/3) # deep ocean, then shelf at one third of the depth
+    bottom = np.cumsum(drF)
+    hFacC = np.clip((depth[None,:,None]-(bottom-drF)[:,None,None])/drF[:,None,None],0,1)*np.ones((1,1,nx))
+    rA = np.full((ny,nx),1.0e6)
+    Tr = (np.arange(nz)[None,:,None,None]+rng.normal(size=(nt,nz,ny,nx))).astype(np.float32)
+    return Tr, hFacC, rA, drF
+
+
+def _best(func,repeat):
+    '''Shortest of repeat timings of func, in seconds.'''
+    times = []
+    for rr in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()): # calc_HCW prints the tracer limit at every call
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter()-start)
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the NumPy code and the Numba kernels of kernel_tools.')
+    parser.add_argument('--shape',nargs=4,type=int,default=[19,90,360,360],metavar=('NT','NZ','NY','NX'))
+    parser.add_argument('--repeat',type=int,default=3,help='timings of every case, the shortest is reported')
+    args = parser.parse_args(argv)
+
+    nt, nz, ny, nx = args.shape
+    Tr, hFacC, rA, drF = _syntheticRun(nt,nz,ny,nx)
+    MaskC = hFacC == 0
+    nzlim, yin, zfin = nz//3, ny//2, nz//3+1
+    trlim = float(Tr[0,nzlim,0,0])
+    cells = mtt._wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(None))
+    cases = [('calc_HCW',lambda: mtt.calc_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=nzlim,yin=yin,xin=0,xfin=nx,zfin=zfin,
+                                                 xi=0,yi=0,trlim=trlim)),
+             ('_highConcVolume',lambda: mtt._highConcVolume(Tr,cells,trlim)),
+             ('maskHC',lambda: mtt.maskHC(trlim,Tr,0,nx,0,ny,0,nz,0,nt)),
+             ('findShelfBreak',lambda: sbt.findShelfBreak(zfin-1,hFacC))]
+
+    print('shape %s, %s' % ('x'.join(str(size) for size in args.shape),Tr.dtype))
+    print('%-16s %11s %11s' % ('','NumPy (ms)','Numba (ms)'))
+    for name, func in cases:
+        kt.USE_NUMBA = False
+        numpyTime = _best(func,args.repeat)
+        kt.USE_NUMBA = True
+        if not kt.available():
+            numbaTime = float('nan')
+        else:
+            _best(func,1) # compile, or load from Numba's cache
+            numbaTime = _best(func,args.repeat)
+        print('%-16s %11.3f %11.3f' % (name,1000*numpyTime,1000*numbaTime))
+
+
+if __name__ == '__main__':
+    main()
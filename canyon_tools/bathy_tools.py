@@ -296,3 +296,67 @@ def make_flat_shelf(total_fluid_depth,cR,W,Wsb,L,p,x,x_wall,y,y_base,y_bc,y_sb,y
    
   return topography
 
+
+def hFacFromTopo(topography,drF,hFacMin=1.0,hFacMinDr=0.0,periodicX=True,periodicY=False):
+  """Open fractions of the cells hFacC, hFacW and hFacS that MITgcm computes from a topography, without running the model.
+  The rules are those of ini_masks_etc.F: the fraction of every cell above the bottom, rounded to 0 or hFacMnSz when it is
+  smaller than hFacMnSz = max(hFacMin, min(hFacMinDr/drF, 1)), and hFacW, hFacS are the smaller hFacC of the two cells
+  next to the face. All levels are computed at once.
+  input:
+              topography = bottom height (negative, m) as returned by make_arbitrary_topo_smooth etc., shape (nx,ny)
+              drF = thickness of the vertical levels (nz), as delR in the data file
+              hFacMin, hFacMinDr = as in the data file (MITgcm defaults are 1.0 and 0.0)
+              periodicX, periodicY = periodic domain in x and y. Otherwise the faces on the boundary are closed walls.
+  output:
+              hFacC (nz,ny,nx), hFacW (nz,ny,nx+1), hFacS (nz,ny+1,nx), in the order of the gridGlob.nc variables"""
+  R_low = np.transpose(np.asarray(topography,dtype=float))
+  drF = np.asarray(drF,dtype=float)
+  rF = -np.concatenate(([0],np.cumsum(drF)))
+  
+  hFacC = np.maximum(rF[1:,None,None],R_low[None,:,:])
+  np.subtract(np.minimum(rF[:-1],0)[:,None,None],hFacC,out=hFacC)
+  hFacC /= drF[:,None,None]
+  np.clip(hFacC,0,1,out=hFacC)
+  
+  hFacMnSz = np.maximum(hFacMin,np.minimum(hFacMinDr/drF,1))[:,None,None]
+  hFacC = np.where(hFacC < hFacMnSz,np.where(hFacC < 0.5*hFacMnSz,0,hFacMnSz),hFacC)
+  
+  nz, ny, nx = hFacC.shape
+  hFacW = np.zeros((nz,ny,nx+1))
+  hFacW[:,:,1:-1] = np.minimum(hFacC[:,:,1:],hFacC[:,:,:-1])
+  if periodicX:
+    hFacW[:,:,0] = np.minimum(hFacC[:,:,0],hFacC[:,:,-1])
+    hFacW[:,:,-1] = hFacW[:,:,0]
+  hFacS = np.zeros((nz,ny+1,nx))
+  hFacS[:,1:-1,:] = np.minimum(hFacC[:,1:,:],hFacC[:,:-1,:])
+  if periodicY:
+    hFacS[:,0,:] = np.minimum(hFacC[:,0,:],hFacC[:,-1,:])
+    hFacS[:,-1,:] = hFacS[:,0,:]
+  
+  return hFacC, hFacW, hFacS
+
+
+def topoGeometry(topography,drF,dx,dy,zlev=29,yin=227,zfin=29,hFacMin=1.0,hFacMinDr=0.0,periodicX=True,periodicY=False):
+  """Geometry diagnostics of a topography before running MITgcm: shelf volume and shelf break indices, as
+  calc_ShelfVolume and findShelfBreak give them for the grid of the run. Loop over a list of topographies to screen a
+  sweep of canyon geometries.
+  input:
+              topography, drF, hFacMin, hFacMinDr, periodicX, periodicY = as in hFacFromTopo
+              dx, dy = cell widths in x (nx) and y (ny), as delX and delY in the data file, or scalars
+              zlev = vertical level of the shelf break (findShelfBreak)
+              yin, zfin = across-shore index of the shelf break and shelf break index + 1 (calc_ShelfVolume)
+  output:
+              ShelfVolume, SBx, SBy = as calc_ShelfVolume and findShelfBreak
+              hFacC, rA = grid of the topography (nz,ny,nx) and (ny,nx), for other metrics"""
+  import canyon_tools.metrics_tools as mtt # only here, so that making topographies does not import the metrics
+  import canyon_tools.shelfbreak_tools as sbt
+  
+  hFacC, hFacW, hFacS = hFacFromTopo(topography,drF,hFacMin=hFacMin,hFacMinDr=hFacMinDr,periodicX=periodicX,
+                                     periodicY=periodicY)
+  ny, nx = hFacC.shape[1:]
+  rA = (np.zeros(ny)+dy)[:,None]*(np.zeros(nx)+dx)[None,:]
+  
+  ShelfVolume = mtt.calc_ShelfVolume(rA,hFacC,np.asarray(drF,dtype=float),yin=yin,zfin=zfin)
+  SBx, SBy = sbt.findShelfBreak(zlev,hFacC)
+  
+  return ShelfVolume, SBx, SBy, hFacC, rA
@@ -0,0 +1,253 @@
+# CacheTools - Derived fields (unstaggered fluxes, density, expanded masks) computed once and kept in chunked,
+# compressed netCDF files next to the run, so later sessions read them instead of reading and computing them again.
+#
+# A cached field is identified by its name, the identity of its source files (path, modification time and size) and
+# its parameters. If a source file changes, the old cache file is not used any more and is evicted eventually. The
+# cache folder is kept under a size limit, removing the least recently used files first.
+#
+# Usage:
+#   VTRAC, UTRAC = cachedTRAC('run01/FluxTR01Glob.nc','VTRAC01','UTRAC01')  # computed the first time only
+#   UTRAC[10,:29,227:,:]                                                     # reads only the chunks of the slice
+
+import contextlib
+
+import hashlib
+
+import json
+
+import os
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+import canyon_tools.readout_tools as rout
+
+# Default size limit of a cache folder, in bytes
+MAXBYTES = 20*1024**3
+
+CACHEDIR = 'derived_cache'
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+class CachedField:
+    '''Read-only view of a field in a cache file. Indexing reads only the chunks of the requested cells, e.g.
+    UTRAC[10,:29,227:,:] reads 29 levels of one time record. Opening the file for every read keeps no file handles
+    between reads, so CachedFields can be pickled and used by several processes.'''
+
+    def __init__(self,path,name):
+        self.path = path
+        self.name = name
+        CacheIn = Dataset(path)
+        var = CacheIn.variables[name]
+        self.shape = var.shape
+        self.ndim = len(var.shape)
+        self.boolean = 'boolean' in var.ncattrs()
+        self.dtype = np.dtype(bool) if self.boolean else var.dtype
+        CacheIn.close()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self,key):
+        CacheIn = Dataset(self.path)
+        try:
+            fld = CacheIn.variables[self.name][key]
+        finally:
+            CacheIn.close()
+        return np.ma.getdata(fld).astype(bool) if self.boolean else fld
+
+    def compute(self):
+        '''Whole field.'''
+        return self[...]
+
+    def __array__(self,dtype=None,copy=None):
+        fld = np.asarray(self.compute())
+        return fld if dtype is None else fld.astype(dtype)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def sourceKey(sources):
+    '''Identity of the source files: list of (absolute path, modification time in ns, size).'''
+    key = []
+    for source in sources:
+        info = os.stat(source)
+        key.append((os.path.abspath(source),info.st_mtime_ns,info.st_size))
+    return key
+
+
+def cachePath(name,sources,params=None,cacheDir=None):
+    '''Path of the cache file of field name computed from the files sources with params (dictionary, optional).
+    The default cacheDir is the folder CACHEDIR next to the first source file.'''
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.dirname(os.path.abspath(sources[0])),CACHEDIR)
+    text = json.dumps([name,sourceKey(sources),params or {}],sort_keys=True,default=str)
+    return os.path.join(cacheDir,'%s_%s.nc' % (name,hashlib.sha1(text.encode()).hexdigest()[:16]))
+
+
+def _chunks(shape):
+    '''Chunks of one horizontal level of one time record (or one level), so that slices in time and depth read only
+    what they need and a whole record is still a few reads.'''
+    return [1]*(len(shape)-2)+list(shape[-2:]) if len(shape) > 2 else list(shape)
+
+
+def _write(path,names,records,complevel,lock=None,static=False):
+    '''Write the records (iterator of tuples of arrays, one per variable in names, one tuple per time record) to path.
+    The file is written with another name and renamed at the end, so an interrupted write leaves no cache file, and
+    neither does a write without records (ValueError).
+    lock   : lock held around every netCDF call (not while records computes the next record), for records read by
+             other threads, e.g. stream_tools.NCLOCK. Optional.
+    static : if True, records is one tuple of arrays, written without the time dimension (e.g. a mask).'''
+    if lock is None:
+        lock = contextlib.nullcontext()
+    tmpPath = path+'.tmp%d' % os.getpid()
+    with lock:
+        CacheOut = Dataset(tmpPath,'w')
+    try:
+        outs = None
+        for tt, flds in enumerate([records] if static else records):
+            with lock:
+                if outs is None:
+                    timeDims = () if static else ('T',)
+                    if not static:
+                        CacheOut.createDimension('T',None)
+                    outs = []
+                    for name, fld in zip(names,flds):
+                        dims = timeDims
+                        for nn, size in enumerate(np.shape(fld)):
+                            dims = dims+('%s_%d' % (name,nn),)
+                            CacheOut.createDimension(dims[-1],size)
+                        boolean = np.asarray(fld).dtype == bool
+                        outs.append(CacheOut.createVariable(name,'u1' if boolean else np.asarray(fld).dtype,dims,
+                                                            zlib=True,complevel=complevel,shuffle=True,
+                                                            chunksizes=_chunks((1,)*len(timeDims)+np.shape(fld))))
+                        if boolean:
+                            outs[-1].boolean = 1 # stored as 0/1 bytes, read back as bool
+                for out, fld in zip(outs,flds):
+                    fld = np.asarray(fld,dtype='u1') if out.dtype == np.uint8 else fld
+                    if static:
+                        out[...] = fld
+                    else:
+                        out[tt] = fld
+        if outs is None:
+            raise ValueError('%s: no records to write' % os.path.basename(path))
+        with lock:
+            CacheOut.close()
+    except BaseException:
+        with lock:
+            CacheOut.close()
+        os.remove(tmpPath)
+        raise
+    os.replace(tmpPath,path)
+
+
+def evict(cacheDir,maxBytes=MAXBYTES,keep=()):
+    '''Remove the least recently used cache files of cacheDir until its size is at most maxBytes. Files in keep are
+    not removed. Returns the list of removed files.'''
+    if not os.path.isdir(cacheDir):
+        return []
+    files = []
+    for fname in os.listdir(cacheDir):
+        path = os.path.join(cacheDir,fname)
+        if fname.endswith('.nc') and os.path.isfile(path):
+            info = os.stat(path)
+            files.append((info.st_mtime,info.st_size,path))
+    total = sum(size for mtime, size, path in files)
+    removed = []
+    for mtime, size, path in sorted(files):
+        if total <= maxBytes:
+            break
+        if path in keep:
+            continue
+        os.remove(path)
+        removed.append(path)
+        total = total-size
+    return removed
+
+
+def cachedFields(name,sources,names,compute,params=None,cacheDir=None,maxBytes=MAXBYTES,complevel=4,static=False):
+    '''Cached derived fields. The first call computes them and writes them to the cache, later calls (also in other
+    sessions) only open the cache file.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    name      : string with the name of the cache entry, e.g. 'TRAC01'
+    sources   : list of files the fields are computed from, e.g. ['run01/FluxTR01Glob.nc']
+    names     : list of the names of the fields, e.g. ['VTRAC','UTRAC']
+    compute   : function without arguments that returns an iterator of tuples of arrays, one array per name and one
+                tuple per time record (so fields are computed and written one record at a time). ValueError, and no
+                cache file, if it returns no records.
+    params    : dictionary with the parameters of the fields, part of the cache key
+    cacheDir  : folder of the cache files, default CACHEDIR next to the first source file
+    maxBytes  : size limit of cacheDir. Least recently used files are removed after writing a new one.
+    complevel : zlib compression level
+    static    : if True, the fields have no time dimension and compute returns one tuple of arrays, one per name
+
+    OUTPUT
+    fields : tuple of CachedField, one per name, with shapes (nt,...), or the shapes of the arrays if static
+    '''
+    if static:
+        params = dict(params or {},static=True)
+    path = cachePath(name,sources,params=params,cacheDir=cacheDir)
+    if os.path.exists(path):
+        os.utime(path) # most recently used
+    else:
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        _write(path,names,compute(),complevel,static=static)
+        evict(os.path.dirname(path),maxBytes=maxBytes,keep=(path,))
+    return tuple(CachedField(path,fieldname) for fieldname in names)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def cachedTRAC(fluxFile,keyV,keyU,cacheDir=None,maxBytes=MAXBYTES):
+    '''Cached VTRAC and UTRAC unstaggered to cell centers, as returned by get_TRAC (nt,nz,ny,nx).
+    fluxFile   : string with /path/to/FluxTR01Glob.nc
+    keyV, keyU : names of the meridional and zonal flux variables, e.g. 'VTRAC01', 'UTRAC01'
+    OUTPUT : (VTRAC, UTRAC) as CachedField'''
+    def compute():
+        FluxOut = Dataset(fluxFile)
+        try:
+            VT = rout.Unstaggered(FluxOut.variables[keyV],axis=-2)
+            UT = rout.Unstaggered(FluxOut.variables[keyU],axis=-1)
+            for tt in range(VT.shape[0]):
+                yield (VT[tt],UT[tt])
+        finally:
+            FluxOut.close()
+    return cachedFields('TRAC',[fluxFile],['VTRAC','UTRAC'],compute,params={'keyV':keyV,'keyU':keyU},
+                        cacheDir=cacheDir,maxBytes=maxBytes)
+
+
+def cachedSigma(stateFile,RhoRef,keyT='Temp',keyS='S',At=2.0E-4,Bs=7.4E-4,cacheDir=None,maxBytes=MAXBYTES):
+    '''Cached density anomaly as calc_sigmaHor of every time record of stateFile (nt,nz,ny,nx).
+    RhoRef : reference density, scalar or profile (nz) on the model levels
+    OUTPUT : sigma as CachedField'''
+    RhoRef = np.asarray(RhoRef,dtype=float)
+    if RhoRef.ndim == 1:
+        RhoRef = RhoRef[:,None,None]
+    def compute():
+        StateOut = Dataset(stateFile)
+        try:
+            for tt in range(StateOut.variables[keyT].shape[0]):
+                T = StateOut.variables[keyT][tt]
+                S = StateOut.variables[keyS][tt]
+                yield (rout.calc_sigmaHor(RhoRef,T,S,At=At,Bs=Bs),)
+        finally:
+            StateOut.close()
+    params = {'keyT':keyT,'keyS':keyS,'At':At,'Bs':Bs,
+              'RhoRef':hashlib.sha1(np.ascontiguousarray(RhoRef).tobytes()).hexdigest()}
+    return cachedFields('sigma',[stateFile],['sigma'],compute,params=params,cacheDir=cacheDir,maxBytes=maxBytes)[0]
+
+
+def cachedMask(GridFile,CellType='HFacC',nt=None,cacheDir=None,maxBytes=MAXBYTES):
+    '''Cached land mask of getMask (True on land), stored as 1 byte per cell. Repeated records compress to almost
+    nothing, so a mask expanded to nt time records (e.g. to mask a 4D field) costs little disk and is read per chunk.
+    OUTPUT : mask as CachedField (boolean), (nz,ny,nx) without time dimension, or (nt,nz,ny,nx) if nt is given'''
+    def mask():
+        return rout.getField(GridFile,CellType) == 0 # as getMask, without the masked array
+    if nt is None:
+        return cachedFields('mask',[GridFile],['Mask'],lambda: (mask(),),params={'CellType':CellType},static=True,
+                            cacheDir=cacheDir,maxBytes=maxBytes)[0]
+    def compute():
+        Mask = mask()
+        yield from ((Mask,) for tt in range(nt))
+    return cachedFields('mask',[GridFile],['Mask'],compute,params={'CellType':CellType,'nt':nt},cacheDir=cacheDir,
+                        maxBytes=maxBytes)[0]
@@ -0,0 +1,190 @@
+# CoarseTools - Volume-weighted coarse graining of MITgcm output and a multi-resolution pyramid of it for quick looks.
+#
+# Only the horizontal dimensions are coarsened. Vertical levels are kept, so z indices like zfin and nzlim mean the same
+# on every level; horizontal indices are divided by the factor (see scaleIndices).
+#
+# Coarse grid: rA is the sum of the block areas and hFacC is the block wet volume divided by rA*drF, so that
+# hFacC*drF*rA (the cell volume used by all metrics) is the exact wet volume of the block on every level. Tracers are
+# volume-weighted block averages, so tracer mass is the same on every level.
+#
+# Usage:
+#   buildPyramid(GridFile, ptracersFile, ['Tr1'], 'run01/pyramid.nc')
+#   VolHC = quickHCW('run01/pyramid.nc', 4, 'Tr1')  # calc_HCW with 4x4 coarser cells
+
+import os
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+import canyon_tools.metrics_tools as mtt
+
+# Horizontal index arguments of the metrics_tools functions, scaled by scaleIndices
+HORIZONTAL = ('yin','xin','xfin','xi','yi','xo','xf','xh1','xh2','yh1','yh2')
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _blockSum(fld,factor):
+    '''Sum of factor x factor blocks of the last two dimensions. Partial blocks at the ends are summed too.'''
+    fld = np.asarray(fld)
+    ny, nx = fld.shape[-2:]
+    nyc, nxc = -(-ny//factor), -(-nx//factor)
+    if ny % factor or nx % factor:
+        pad = [(0,0)]*(fld.ndim-2)+[(0,nyc*factor-ny),(0,nxc*factor-nx)]
+        fld = np.pad(fld,pad)
+    return fld.reshape(fld.shape[:-2]+(nyc,factor,nxc,factor)).sum(axis=(-3,-1))
+
+
+def coarsenGrid(rA,hFacC,drF,factor):
+    '''Coarse grid by factor. Returns (rA, hFacC, drF) of the coarse grid; see the top of this file.'''
+    rA = np.ma.getdata(rA)
+    hFacC = np.ma.getdata(hFacC)
+    rAc = _blockSum(rA,factor)
+    hFacCc = _blockSum(hFacC*rA,factor)/rAc
+    return (rAc,hFacCc,np.asarray(drF))
+
+
+def coarsenTracer(Tr,rA,hFacC,factor):
+    '''Volume-weighted block average of a tracer (...,nz,ny,nx) by factor, with the fine grid rA and hFacC.
+    Land blocks (no wet volume) are 0. Tracer mass, sum(Tr*hFacC*drF*rA), is the same as on the fine grid.'''
+    Vol = np.ma.getdata(hFacC)*np.ma.getdata(rA) # drF is the same in a block, so it cancels
+    VolC = _blockSum(Vol,factor)
+    TrVol = _blockSum(np.ma.filled(Tr,0)*Vol,factor)
+    return np.where(VolC > 0,TrVol/np.where(VolC > 0,VolC,1),0)
+
+
+def coarsenFlux(Flux,factor,axis):
+    '''Block sums of transports (e.g. UTRAC or U*hFacW*dyG*drF, not velocities) through the faces of the coarse cells.
+    Flux   : transport at the faces (...,nz,ny,nx+1) for axis='x', (...,nz,ny+1,nx) for axis='y' or (...,nz,ny,nx) for
+             axis='z'. Faces with x (or y) index multiple of factor are the coarse cell faces.
+    OUTPUT : transport through the coarse faces, (...,nz,nyc,nxc+1), (...,nz,nyc+1,nxc) or (...,nz,nyc,nxc)'''
+    Flux = np.ma.filled(Flux,0)
+    if axis == 'x':
+        return _blockSumAxis(Flux[...,::factor],factor,-2)
+    if axis == 'y':
+        return _blockSumAxis(Flux[...,::factor,:],factor,-1)
+    return _blockSum(Flux,factor)
+
+
+def _blockSumAxis(fld,factor,axis):
+    '''Sum of blocks of factor elements along one axis. A partial block at the end is summed too.'''
+    fld = np.moveaxis(np.asarray(fld),axis,-1)
+    n = fld.shape[-1]
+    nc = -(-n//factor)
+    if n % factor:
+        fld = np.pad(fld,[(0,0)]*(fld.ndim-1)+[(0,nc*factor-n)])
+    return np.moveaxis(fld.reshape(fld.shape[:-1]+(nc,factor)).sum(axis=-1),-1,axis)
+
+
+def scaleIndices(factor,**indices):
+    '''Horizontal indices of a pyramid level, e.g. scaleIndices(4,yin=227,xin=120,zfin=29) = {'yin':56,'xin':30,'zfin':29}.
+    Only the names in HORIZONTAL are scaled.'''
+    return {name:(val//factor if name in HORIZONTAL else val) for name, val in indices.items()}
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _levelGroup(PyrOut,factor,grid):
+    '''Group 'f<factor>' of the pyramid file, created with the coarse grid if it does not exist.'''
+    name = 'f%d' % factor
+    if name in PyrOut.groups:
+        return PyrOut.groups[name]
+    rA, hFacC, drF = grid
+    grp = PyrOut.createGroup(name)
+    grp.factor = factor
+    grp.createDimension('T',None)
+    grp.createDimension('Z',hFacC.shape[0])
+    grp.createDimension('Y',hFacC.shape[1])
+    grp.createDimension('X',hFacC.shape[2])
+    grp.createVariable('rA','f8',('Y','X'))[:] = rA
+    grp.createVariable('HFacC','f8',('Z','Y','X'),zlib=True)[:] = hFacC
+    grp.createVariable('drF','f8',('Z',))[:] = drF
+    return grp
+
+
+def buildPyramid(GridFile,ncFile,fieldnames,pyramidFile,factors=(2,4,8)):
+    '''Coarse-grained copies of fields of a run at several factors, cached in one netCDF file (one group per factor).
+    Every level is computed from the previous one, reading one time record of the full field at a time. Call it again
+    with another ncFile to add fields from it; fields already in the file are not computed again.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    GridFile    : string with /path/to/gridGlob.nc
+    ncFile      : string with /path/to/ptracersGlob.nc (or stateGlob.nc) with the fields
+    fieldnames  : list of tracer names, e.g. ['Tr1','Tr2'] (volume-weighted averages, so scalars only)
+    pyramidFile : string with /path/to/pyramid file, e.g. 'run01/pyramid.nc'
+    factors     : coarsening factors
+
+    OUTPUT
+    pyramidFile
+    '''
+    GridOut = Dataset(GridFile)
+    rA = np.ma.getdata(GridOut.variables['rA'][:])
+    hFacC = np.ma.getdata(GridOut.variables['HFacC'][:])
+    drF = np.ma.getdata(GridOut.variables['drF'][:])
+    GridOut.close()
+
+    factors = sorted(factors)
+    grids = []
+    previous, grid = 1, (rA,hFacC,drF)
+    for factor in factors:
+        step = factor//previous if factor % previous == 0 else factor
+        source = grid if step != factor else (rA,hFacC,drF)
+        grids.append((step,source,coarsenGrid(source[0],source[1],source[2],step)))
+        previous, grid = factor, grids[-1][2]
+
+    FileOut = Dataset(ncFile)
+    PyrOut = Dataset(pyramidFile,'a' if os.path.exists(pyramidFile) else 'w')
+    for fieldname in fieldnames:
+        var = FileOut.variables[fieldname]
+        nt = var.shape[0]
+        grps = [_levelGroup(PyrOut,factor,grids[nn][2]) for nn, factor in enumerate(factors)]
+        if all(fieldname in grp.variables for grp in grps):
+            continue
+        outs = []
+        for grp in grps:
+            if fieldname in grp.variables:
+                outs.append(grp.variables[fieldname])
+            else:
+                outs.append(grp.createVariable(fieldname,'f4',('T','Z','Y','X'),zlib=True))
+        for tt in range(nt):
+            fine = var[tt]
+            fld = fine
+            for nn, (step, source, coarse) in enumerate(grids):
+                if step == factors[nn]: # level computed from the full resolution field
+                    fld = fine
+                fld = coarsenTracer(fld,source[0],source[1],step)
+                outs[nn][tt] = fld
+    PyrOut.close()
+    FileOut.close()
+    return pyramidFile
+
+
+def getLevel(pyramidFile,factor,fieldnames=()):
+    '''Read one level of a pyramid. Returns a dictionary with the coarse grid 'rA', 'hFacC', 'drF', the land mask 'MaskC'
+    (as getMask) and the fields in fieldnames (nt,nz,nyc,nxc).'''
+    PyrOut = Dataset(pyramidFile)
+    grp = PyrOut.groups['f%d' % factor]
+    level = {'rA':grp.variables['rA'][:].data, 'hFacC':grp.variables['HFacC'][:].data, 'drF':grp.variables['drF'][:].data}
+    level['MaskC'] = level['hFacC'] == 0
+    for fieldname in fieldnames:
+        level[fieldname] = grp.variables[fieldname][:]
+    PyrOut.close()
+    return level
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def quickHCW(pyramidFile,factor,trName,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,yi=50,trlim=None):
+    '''calc_HCW on a pyramid level. Arguments are the full resolution indices, as in calc_HCW; they are scaled here.
+    Give trlim from the full resolution run for a threshold that does not depend on the level.
+    OUTPUT : approximate volume of high concentration water at every time output'''
+    lev = getLevel(pyramidFile,factor,[trName])
+    ind = scaleIndices(factor,nzlim=nzlim,yin=yin,xin=xin,xfin=xfin,zfin=zfin,xi=xi,yi=yi)
+    return mtt.calc_HCW(lev[trName],lev['MaskC'],lev['rA'],lev['hFacC'],lev['drF'],trlim=trlim,**ind)
+
+
+def quickTrMass(pyramidFile,factor,trName,yin=227,zfin=29):
+    '''calc_TrMassonShelf on a pyramid level. Arguments are the full resolution indices, as in calc_TrMassonShelf.
+    The mass is exact when yin is a multiple of factor.
+    OUTPUT : mass of tracer on shelf at every time output'''
+    lev = getLevel(pyramidFile,factor,[trName])
+    ind = scaleIndices(factor,yin=yin,zfin=zfin)
+    return mtt.calc_TrMassonShelf(lev[trName],lev['MaskC'],lev['rA'],lev['hFacC'],lev['drF'],**ind)
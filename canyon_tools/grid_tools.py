@@ -0,0 +1,91 @@
+# GridTools - Map physical coordinates, depths and polygons to MITgcm grid indices.
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _nearest(axis,values):
+    '''Index of the element of the sorted (ascending) axis nearest to each of values.'''
+    mid = (axis[1:]+axis[:-1])/2
+    return np.searchsorted(mid,np.asarray(values,dtype=float))
+
+
+def _insidePolygon(px,py,x,y):
+    '''True for the points (x,y) inside the polygon with vertices (px,py) (even-odd rule). x and y can have any shape.'''
+    px = np.asarray(px,dtype=float)
+    py = np.asarray(py,dtype=float)
+    inside = np.zeros(np.shape(x),dtype=bool)
+    for n in range(len(px)):
+        x1, y1 = px[n-1], py[n-1]
+        x2, y2 = px[n], py[n]
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            xcross = x1 + (y-y1)*(x2-x1)/(y2-y1)
+        inside ^= crosses & (x < xcross)
+    return inside
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+class GridIndex:
+    '''Spatial index of an MITgcm grid, built once from XC, YC and RC. On rectilinear grids (uniform or stretched) the
+    sorted x and y axes are searched with binary search; on curvilinear grids a KD-tree (scipy) of the cell centers
+    is used. All methods take arrays of points and return arrays of indices, so resolution changes only need new
+    coordinates, not new hard-coded indices like yin=227 or xh1=120.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    XC, YC : x and y coordinates of cell centers (ny,nx)
+    RC     : z coordinate of cell centers (nz), negative downwards. Optional, needed only for depthToIndex.
+    '''
+
+    def __init__(self,XC,YC,RC=None):
+        self.XC = np.asarray(XC,dtype=float)
+        self.YC = np.asarray(YC,dtype=float)
+        self.rectilinear = (np.allclose(self.XC,self.XC[:1,:]) and np.allclose(self.YC,self.YC[:,:1]) and
+                            np.all(np.diff(self.XC[0,:]) > 0) and np.all(np.diff(self.YC[:,0]) > 0))
+        if self.rectilinear:
+            self.x = self.XC[0,:]
+            self.y = self.YC[:,0]
+        else:
+            from scipy.spatial import cKDTree
+            self.tree = cKDTree(np.column_stack([self.XC.ravel(),self.YC.ravel()]))
+        if RC is not None:
+            self.depth = -np.ravel(np.asarray(RC,dtype=float))
+
+    def xyToIndex(self,xs,ys):
+        '''Indices (ii,jj) of the cells with centers nearest to the points (xs,ys).'''
+        if self.rectilinear:
+            return (_nearest(self.x,xs),_nearest(self.y,ys))
+        dist, flat = self.tree.query(np.column_stack([np.ravel(xs),np.ravel(ys)]))
+        jj, ii = np.unravel_index(flat,self.XC.shape)
+        return (ii.reshape(np.shape(xs)),jj.reshape(np.shape(ys)))
+
+    def depthToIndex(self,depths):
+        '''Indices kk of the levels with centers nearest to depths (m, positive downwards, e.g. 150 for the shelf break).'''
+        return _nearest(self.depth,depths)
+
+    def box(self,x1,x2,y1,y2):
+        '''Index bounds (i1,i2,j1,j2) of the cells with centers nearest to the corners (x1,y1) and (x2,y2), e.g. the
+        canyon box (xh1,xh2,yh1,yh2) of howMuchWaterShwHole.'''
+        ii, jj = self.xyToIndex([x1,x2],[y1,y2])
+        return (int(ii[0]),int(ii[1]),int(jj[0]),int(jj[1]))
+
+    def polygonMask(self,px,py):
+        '''Boolean array (ny,nx), True for cells whose centers are inside the polygon with vertices (px,py).'''
+        return _insidePolygon(px,py,self.XC,self.YC)
+
+    def polygonToIndex(self,px,py):
+        '''Indices (ii,jj) of the cells whose centers are inside the polygon with vertices (px,py).'''
+        jj, ii = np.nonzero(self.polygonMask(px,py))
+        return (ii,jj)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def getGridIndex(GridFile):
+    '''Build a GridIndex from XC, YC and RC in the MITgcm grid file.
+    GridFile : string with /path/to/gridGlob.nc'''
+    GridOut = Dataset(GridFile)
+    index = GridIndex(GridOut.variables['XC'][:],GridOut.variables['YC'][:],GridOut.variables['RC'][:])
+    GridOut.close()
+    return index
@@ -0,0 +1,157 @@
+# IncrementalTools - Update metrics of runs that are still appending output, computing only the new time records.
+
+import hashlib
+
+import json
+
+import os
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+import canyon_tools.metrics_tools as mtt
+
+import canyon_tools.readout_tools as rout
+
+import canyon_tools.shelfbreak_tools as sbt
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def loadState(stateFile):
+    '''Load the incremental state of a run. Returns a dictionary with, for every metric, the entries metric+'_last'
+    (number of time records processed), metric (accumulated results), metric+'_params' (source and parameters the
+    results were computed with) and metric+'_check' (checksum of the last record processed). Empty dictionary if
+    stateFile does not exist.
+    stateFile : string with /path/to/state file (.npz), usually one per run, e.g. 'run01/metrics_state.npz'
+    '''
+    if not os.path.exists(stateFile):
+        return {}
+    with np.load(stateFile) as StateIn:
+        return dict(StateIn)
+
+
+def saveState(stateFile,state):
+    '''Write the incremental state of a run. The file is replaced atomically, so a monitoring job that is killed
+    half-way never leaves a corrupt state behind.'''
+    tmpFile = stateFile+'.tmp.npz'
+    np.savez(tmpFile,**state)
+    os.replace(tmpFile,stateFile)
+
+
+def _fingerprint(*arrays):
+    '''Checksum of grid arrays and land masks (boolean mask, PackedMask or WetIndex; None is skipped), so that results
+    computed on another grid are not reused.'''
+    digest = hashlib.sha1()
+    for arr in arrays:
+        if arr is None:
+            continue
+        if hasattr(arr,'unpack') or np.asarray(arr).dtype == bool:
+            arr = np.packbits(rout.landMask(arr))
+        arr = np.ascontiguousarray(np.ma.getdata(arr))
+        digest.update(str((arr.shape,arr.dtype.str)).encode())
+        digest.update(arr.tobytes())
+    return digest.hexdigest()
+
+
+def _checksum(record):
+    '''Checksum of one time record, to tell whether the records already processed are still those on the file.'''
+    return hashlib.sha1(np.ascontiguousarray(np.ma.filled(record,0)).tobytes()).hexdigest()
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def updateMetric(stateFile,metric,ncFile,fieldname,func,params=None):
+    '''Incremental metric - Apply func only to the time records of ncFile[fieldname] appended since the last update
+    of this metric and append the results to those stored in stateFile. The stored results are computed again from
+    the first record if they were computed with other params or another source, or if the source file was replaced
+    or truncated (fewer records than processed, or a different last processed record).
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    stateFile : string with /path/to/state file of the run (.npz)
+    metric    : string with the metric name, e.g. 'HCW'
+    ncFile    : string with /path/to/stateGlob.nc, ptracersGlob.nc, etc. that is still growing
+    fieldname : string with the variable name as written on the netCDF file
+    func      : function of a block of time records (n,...) as read from ncFile returning an array (n,...).
+                It must not depend on records outside the block.
+    params    : dictionary with the parameters of func (indices, thresholds, a fingerprint of the grid, etc.), optional.
+                Must be JSON-serializable or have a repr that identifies them. The update* functions below include a
+                checksum of their grid arrays and mask.
+
+    OUTPUT
+    values : array with the results for all time records processed so far (nt,...), empty if there are none
+    '''
+    state = loadState(stateFile)
+    source = json.dumps({'ncFile':os.path.abspath(ncFile),'fieldname':fieldname,'params':params or {}},
+                        sort_keys=True,default=repr)
+    last = int(state.get(metric+'_last',0))
+    if last > 0 and str(state.get(metric+'_params','')) != source:
+        last = 0 # other parameters or source
+
+    FileOut = Dataset(ncFile)
+    try:
+        var = FileOut.variables[fieldname]
+        nt = var.shape[0]
+        if last > 0 and (nt < last or _checksum(var[last-1]) != str(state.get(metric+'_check',''))):
+            last = 0 # replaced or truncated source
+        if nt > last:
+            new = np.ma.filled(np.ma.asarray(func(var[last:nt])).astype(float),np.nan)
+            check = _checksum(var[nt-1])
+    finally:
+        FileOut.close()
+
+    if nt <= last:
+        return state[metric] if metric in state else np.empty(0)
+
+    if last > 0:
+        values = np.concatenate([state[metric],new],axis=0)
+    else:
+        values = new
+    state[metric] = values
+    state[metric+'_last'] = nt
+    state[metric+'_params'] = source
+    state[metric+'_check'] = check
+    saveState(stateFile,state)
+
+    return values
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def updateHCW(stateFile,ptracersFile,trName,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,yi=50,
+              metric='HCW'):
+    '''Incremental calc_HCW. The threshold concentration is always taken from the first time output of ptracersFile,
+    so the results are the same as running calc_HCW on the whole file.
+    trName : string with tracer name, e.g. 'Tr1'. Other arguments as in calc_HCW.
+    OUTPUT : HCW volume for all time records processed so far
+    '''
+    PtracersOut = Dataset(ptracersFile)
+    trlim = PtracersOut.variables[trName][0,nzlim,yi,xi]
+    PtracersOut.close()
+
+    func = lambda Tr: mtt.calc_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=nzlim,yin=yin,xin=xin,xfin=xfin,zfin=zfin,xi=xi,yi=yi,
+                                   trlim=trlim)
+    params = {'nzlim':nzlim,'yin':yin,'xin':xin,'xfin':xfin,'zfin':zfin,'xi':xi,'yi':yi,'trlim':float(trlim),
+              'grid':_fingerprint(MaskC,rA,hFacC,drF)}
+    return updateMetric(stateFile,metric,ptracersFile,trName,func,params=params)
+
+
+def updateTrMassonShelf(stateFile,ptracersFile,trName,MaskC,rA,hFacC,drF,yin=227,zfin=29,metric='TrMass'):
+    '''Incremental calc_TrMassonShelf. trName : string with tracer name, e.g. 'Tr1'. Other arguments as in
+    calc_TrMassonShelf.
+    OUTPUT : mass of tracer on shelf for all time records processed so far
+    '''
+    func = lambda Tr: mtt.calc_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=yin,zfin=zfin)
+    return updateMetric(stateFile,metric,ptracersFile,trName,func,
+                        params={'yin':yin,'zfin':zfin,'grid':_fingerprint(MaskC,rA,hFacC,drF)})
+
+
+def updateSBTransport(stateFile,ncFile,fluxName,hfac,dr,dx,zlev,Mask,metric='SBTransport'):
+    '''Incremental cross-shelf-break transport, total transport from SBTransport.
+    ncFile   : string with /path/to/file with the meridional flux (e.g. stateGlob.nc)
+    fluxName : string with the name of the meridional flux variable (e.g. 'V')
+    Other arguments as in SBTransport.
+    OUTPUT : transport across the shelf break for all time records processed so far
+    '''
+    wall = sbt.SBWallArea(hfac,dr,dx,zlev)
+    func = lambda Flux: sbt.SBTransport(Flux,hfac,dr,dx,zlev,Mask=Mask,wall=wall)[0]
+    return updateMetric(stateFile,metric,ncFile,fluxName,func,
+                        params={'zlev':zlev,'grid':_fingerprint(Mask,hfac,dr,dx)})
@@ -0,0 +1,145 @@
+# KernelTools - Optional Numba kernels for the column scans and threshold volumes in metrics_tools and shelfbreak_tools.
+#
+# Numba is imported and the kernels are compiled the first time one is used. If Numba is not installed, or USE_NUMBA is
+# set to False, the functions here return None and the callers use their NumPy code.
+#
+# Numba's thread pool does not survive fork(): a process forked (e.g. a multiprocessing worker) after its parent ran a
+# parallel kernel uses serial versions of the kernels, which are compiled there on first use. The OpenMP (or workqueue)
+# threading layer is preferred to TBB, unless one is chosen with NUMBA_THREADING_LAYER.
+
+import os
+
+import numpy as np
+
+USE_NUMBA = True
+
+numba = None # imported by _compile
+
+_kernels = {}
+
+_state = {'threads':False, 'serial':False, 'numba':None} # numba: None until _compile imports it, then True or False
+
+def _afterFork():
+    if _state['threads']:
+        _state['serial'] = True
+
+if hasattr(os,'register_at_fork'):
+    os.register_at_fork(after_in_child=_afterFork)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Kernel sources, compiled by _compile. They are module-level functions so that Numba's on-disk cache (cache=True) can
+# find them again in later sessions; numba.prange is resolved when they are compiled.
+
+def _firstBelow(level,limit):
+    # index of the first cell along y with level < limit in every column, 0 if none (as np.argmax)
+    ny, nx = level.shape
+    first = np.zeros(nx,dtype=np.int64)
+    for i in numba.prange(nx):
+        for j in range(ny):
+            if level[j,i] < limit:
+                first[i] = j
+                break
+    return first
+
+
+def _thresholdVolume(Tr,flat,CellVol,trlim,greater):
+    # sum of CellVol over the cells flat of Tr (nt,ncells) with Tr >= trlim (Tr <= trlim if greater) at every time.
+    # Branch-free sum: the comparison is random for tracer fields, so an if in the loop is much slower.
+    nt = Tr.shape[0]
+    vol = np.zeros(nt)
+    for t in numba.prange(nt):
+        row = Tr[t]
+        acc = 0.0
+        if greater:
+            for n in range(flat.shape[0]):
+                acc += CellVol[n]*(row[flat[n]] <= trlim)
+        else:
+            for n in range(flat.shape[0]):
+                acc += CellVol[n]*(row[flat[n]] >= trlim)
+        vol[t] = acc
+    return vol
+
+
+def _lessThan(sl,target):
+    # boolean array, True where sl < target
+    nt, nz, ny, nx = sl.shape
+    out = np.empty((nt,nz,ny,nx),dtype=np.bool_)
+    for t in numba.prange(nt):
+        for k in range(nz):
+            for j in range(ny):
+                for i in range(nx):
+                    out[t,k,j,i] = sl[t,k,j,i] < target
+    return out
+
+
+def _compile():
+    '''Compile the kernels once. Returns the dictionary of kernels, empty if Numba is not available. The parallel
+    kernels are cached on disk by Numba; the serial ones (used after fork) are compiled in memory.'''
+    global numba
+    if _state['numba'] is not None:
+        return _kernels
+    try:
+        import numba
+    except ImportError:
+        _state['numba'] = False
+        return _kernels
+    if 'NUMBA_THREADING_LAYER' not in os.environ and 'NUMBA_THREADING_LAYER_PRIORITY' not in os.environ:
+        # TBB makes forked processes hang at exit; forked processes only run the serial kernels, so OpenMP is safe
+        numba.config.THREADING_LAYER_PRIORITY = ['omp','workqueue','tbb']
+
+    for func in (_firstBelow,_thresholdVolume,_lessThan):
+        name = func.__name__[1:]
+        _kernels[name] = numba.njit(parallel=True,cache=True)(func)
+        _kernels[name+'Serial'] = numba.njit(func)
+    _state['numba'] = True
+    return _kernels
+
+
+def available():
+    '''True if Numba is installed, so that the kernels can be used (whatever USE_NUMBA is).'''
+    _compile()
+    return _state['numba']
+
+
+def _kernel(name):
+    '''Compiled kernel name, or None if Numba is off or not installed.'''
+    if not USE_NUMBA:
+        return None
+    if _state['serial']:
+        return _compile().get(name+'Serial')
+    _state['threads'] = True
+    return _compile().get(name)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def firstBelow(level,limit):
+    '''y index of the first cell of every column of level (ny,nx) with value < limit, 0 if there is none.
+    Same as np.argmax(level < limit, axis=0). Returns None if Numba is not available.'''
+    kernel = _kernel('firstBelow')
+    if kernel is None:
+        return None
+    return kernel(np.ascontiguousarray(np.ma.getdata(level)),limit)
+
+
+def thresholdVolume(Tr,kk,jj,ii,CellVol,trlim,greater=False):
+    '''Volume of the cells (kk,jj,ii) with volumes CellVol where Tr >= trlim (<= trlim if greater) at every time
+    output of Tr (nt,nz,ny,nx), in one pass and without temporaries. The mask of Tr is ignored, as in
+    metrics_tools._highConcVolume. Returns None if Numba is not available.'''
+    kernel = _kernel('thresholdVolume')
+    if kernel is None or np.ndim(Tr) != 4:
+        return None
+    data = np.ma.getdata(Tr)
+    flat = np.ravel_multi_index((kk,jj,ii),data.shape[1:])
+    return kernel(data.reshape(data.shape[0],-1),flat,np.asarray(CellVol,dtype=float),float(trlim),bool(greater))
+
+
+def lessThan(sl,target):
+    '''Boolean array, True where the 4D array sl < target (masked cells of sl are True, as np.ma.masked_less).
+    Returns None if Numba is not available.'''
+    kernel = _kernel('lessThan')
+    if kernel is None or np.ndim(sl) != 4:
+        return None
+    out = kernel(np.ma.getdata(sl),target)
+    if np.ma.is_masked(sl):
+        out |= np.ma.getmaskarray(sl)
+    return out
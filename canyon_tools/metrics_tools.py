@@ -5,31 +5,35 @@ from netCDF4 import Dataset
 
 import numpy as np
 
-import pylab as pl
-
-import scipy.io
-
-import scipy as spy
-
-import xarray as xr
+import canyon_tools.kernel_tools as kt
 
 import canyon_tools.readout_tools as rout 
  
 
 #---------------------------------------------------------------------------------------------------------------------------
-def getDatasets(expPath, runName):
+def getDatasets(expPath, runName, lazy=False, chunks=None):
   '''Specify the experiment and run from which to analyse state and ptracers output.
    expName : (string) Path to experiment folder. E.g. '/ocean/kramosmu/MITgcm/TracerExperiments/BARKLEY', etc.
    runName : (string) Folder name of the run. E.g. 'run01', 'run10', etc
+   lazy    : (bool) If True, GridOut, StateOut and PtracersOut are chunked xarray Datasets (dask, local scheduler)
+             instead of netCDF4 Datasets. Nothing is loaded until .compute() is called on a result.
+   chunks  : (dict) dask chunks for state and ptracers when lazy=True. Default is one time output per chunk, {'T':1}.
   '''
   Grid = "%s/%s/gridGlob.nc" %(expPath,runName)
-  GridOut = Dataset(Grid)
-
   State =  "%s/%s/stateGlob.nc" %(expPath,runName)
-  StateOut = Dataset(State)
-
   Ptracers =  "%s/%s/ptracersGlob.nc" %(expPath,runName)
-  PtracersOut = Dataset(Ptracers)
+
+  if lazy:
+    import xarray as xr
+    if chunks is None:
+      chunks = {'T':1}
+    GridOut = xr.open_dataset(Grid, chunks={})
+    StateOut = xr.open_dataset(State, chunks=chunks)
+    PtracersOut = xr.open_dataset(Ptracers, chunks=chunks)
+  else:
+    GridOut = Dataset(Grid)
+    StateOut = Dataset(State)
+    PtracersOut = Dataset(Ptracers)
     
   return (Grid, GridOut, State,StateOut,Ptracers, PtracersOut)
 
@@ -37,6 +41,90 @@ def getDatasets(expPath, runName):
 #---------------------------------------------------------------------------------------------------------------------------
 
 
+def _lazyCellVol(rA,hFacC,drF,zfin,ys,xs):
+  '''Volume of cells [:zfin,ys,xs]. Grid fields are small, so they are always loaded as numpy arrays.'''
+  return np.asarray(hFacC[:zfin,ys,xs])*np.asarray(drF[:zfin])[:,None,None]*np.asarray(rA[ys,xs])
+
+
+def _lazyWet(MaskC,Tr,zfin,ys,xs):
+  '''Wet cells (not MaskC) in [:zfin,ys,xs] as a numpy boolean array.'''
+  return ~rout.landMask(MaskC,Tr.shape[1:])[:zfin,ys,xs]
+
+
+def _lazyTrlim(Tr,nzlim,yi,xi):
+  '''Threshold concentration at Tr[0,nzlim,yi,xi]. Only this value is computed.'''
+  return float(rout.asDask(Tr)[0,nzlim,yi,xi].compute())
+
+
+def _lazyHighConcVolume(Tr,MaskC,CellVol,trlim,zfin,ys,xs,greater=False):
+  '''Task graph for the volume of wet cells in Tr[:,:zfin,ys,xs] with concentration >= trlim 
+  (<= trlim if greater=True) at every time output.'''
+  import dask.array as da
+  
+  TrBox = rout.asDask(Tr)[:,:zfin,ys,xs]
+  wet = _lazyWet(MaskC,Tr,zfin,ys,xs)
+  if greater:
+    high = TrBox <= trlim
+  else:
+    high = TrBox >= trlim
+  return da.where(high & wet, CellVol, 0).sum(axis=(1,2,3))
+
+
+def _lazyTracerMass(Tr,MaskC,CellVol,zfin,ys,xs):
+  '''Task graph for the mass of tracer (m^3*[C]*l/m^3) in wet cells of Tr[:,:zfin,ys,xs] at every time output.'''
+  import dask.array as da
+  
+  TrBox = rout.asDask(Tr)[:,:zfin,ys,xs]
+  wet = _lazyWet(MaskC,Tr,zfin,ys,xs)
+  return da.where(wet, TrBox*CellVol*1000.0, 0).sum(axis=(1,2,3))
+
+
+#---------------------------------------------------------------------------------------------------------------------------
+
+
+def _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,ys,xs):
+  '''Indices (kk,jj,ii) and volumes of the wet cells in [:zfin,ys,xs]. MaskC can be a boolean land mask, a PackedMask 
+  or a WetIndex (see readout_tools); land cells are never visited.'''
+  kk,jj,ii = rout.wetCells(MaskC,(slice(None,zfin),ys,xs),np.shape(Tr)[1:])
+  CellVol = np.asarray(hFacC)[kk,jj,ii]*np.asarray(drF)[kk]*np.asarray(rA)[jj,ii]
+  return (kk,jj,ii,CellVol)
+
+
+def wetVolume(MaskC,rA,hFacC,drF,zfin,ys=slice(None),xs=slice(None)):
+  '''Wet cells of the box [:zfin,ys,xs] and their volumes, (kk,jj,ii,CellVol). Give it as cells to calc_HCW,
+  calc_InvHCW, calc_TrMassonShelf or howMuchWaterShwHole when calling them for one block of time records at a time, so
+  that the wet cells are found once. MaskC, rA, hFacC and drF as in calc_HCW.'''
+  return _wetVolume(MaskC,np.empty((0,)+np.shape(hFacC)),rA,hFacC,drF,zfin,ys,xs)
+
+
+def _highConcVolume(Tr,cells,trlim,greater=False):
+  '''Volume of the wet cells (from _wetVolume) with concentration >= trlim (<= trlim if greater=True) at every time output.'''
+  kk,jj,ii,CellVol = cells
+  vol = kt.thresholdVolume(Tr,kk,jj,ii,CellVol,trlim,greater) # Numba kernel, if available
+  if vol is not None:
+    return vol
+  TrWet = np.ma.getdata(Tr[:,kk,jj,ii])
+  if greater:
+    high = TrWet <= trlim
+  else:
+    high = TrWet >= trlim
+  return np.dot(high,CellVol)
+
+
+def _tracerMass(Tr,cells):
+  '''Mass of tracer (m^3*[C]*l/m^3) in the wet cells (from _wetVolume) at every time output.'''
+  kk,jj,ii,CellVol = cells
+  return np.dot(np.ma.filled(Tr[:,kk,jj,ii],0),CellVol)*1000.0 # 1 m^3 = 1000 l
+
+
+def _trlim(Tr,nzlim,yi,xi):
+  '''Threshold concentration at Tr[0,nzlim,yi,xi]'''
+  return Tr[0,nzlim,yi,xi]
+
+
+#---------------------------------------------------------------------------------------------------------------------------
+
+
 def getProfile(Tr,yi,xi,nz0=0,nzf=90):
   '''Slice tracer profile at x,y = xi,yi form depth index k=nz0 to k=nzf. Default values are nz0=0 (surface)
   and nzf = 89, bottom. Tr is a time slice (3D) of the tracer field'''
@@ -44,16 +132,24 @@ def getProfile(Tr,yi,xi,nz0=0,nzf=90):
   return IniProf
 
 
+def getProfiles(Tr,yi,xi,nz0=0,nzf=90):
+  '''Slice tracer profiles at many stations x,y = xi[n],yi[n] in one vectorized gather. yi and xi are integer arrays
+  of the same length (e.g. from GridIndex.xyToIndex in grid_tools). Tr is a numpy array, either a time slice (3D) or 
+  all time outputs (4D). Returns an array (nz,nstations) or (nt,nz,nstations).'''
+  Profiles = Tr[...,nz0:nzf,np.asarray(yi),np.asarray(xi)]
+  return Profiles
+
+
 #---------------------------------------------------------------------------------------------------------------------------
 
 
 def maskExpand(mask,Tr):
   '''Expand the dimensions of mask to fit those of Tr. mask should have one dimension less than Tr (time axis). 
-  It adds a dimension before the first one.'''
+  It adds a dimension before the first one. The result is a read-only boolean view of mask.'''
     
-  mask_expand = np.expand_dims(mask,0)
+  mask_expand = np.expand_dims(rout.landMask(mask,np.shape(Tr)[1:]),0)
     
-  mask_expand = mask_expand + np.zeros(Tr.shape)
+  mask_expand = np.broadcast_to(mask_expand,np.shape(Tr)) # boolean view, no copy per time output
     
   return mask_expand
 
@@ -65,7 +161,7 @@ def howMuchWaterX(Tr,MaskC,nzlim,rA,hFacC,drF,yin,zfin,xi,yi):
   '''
   INPUT----------------------------------------------------------------------------------------------------------------
     Tr    : Array with concentration values for a tracer. Until this function is more general, this should be size 19x90x360x360
-    MaskC : Land mask for tracer
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
     nzlim : The nz index under which to look for water properties
     rA    : Area of cell faces at C points (360x360)
     fFacC : Fraction of open cell (90x360x360)
@@ -77,52 +173,40 @@ def howMuchWaterX(Tr,MaskC,nzlim,rA,hFacC,drF,yin,zfin,xi,yi):
     
     OUTPUT----------------------------------------------------------------------------------------------------------------
     VolWaterHighConc =  Array with the volume of water over the shelf [:,:30,227:,:] at every time output.
-    Total_Tracer =  Array with the mass of tracer (m^3*[C]*l/m^3) at each x-position over the shelf [:,:30,227:,:] at 
-                    every time output. Total mass of tracer at xx on the shelf.
+    Total_Tracer =  Array with the mass of tracer (m^3*[C]*l/m^3) over the shelf [:,:30,227:,:] at every time output.
+                    For the mass at each x-position use calc_TrMassDistribution.
                                                 
   -----------------------------------------------------------------------------------------------------------------------
   '''
+  if rout.isLazy(Tr):
+    trlim = _lazyTrlim(Tr,nzlim,yi,xi)
+    print('tracer limit concentration is: ',trlim)
+    CellVol = _lazyCellVol(rA,hFacC,drF,zfin,slice(yin,None),slice(None))
+    return (_lazyHighConcVolume(Tr,MaskC,CellVol,trlim,zfin,slice(yin,None),slice(None)),
+            _lazyTracerMass(Tr,MaskC,CellVol,zfin,slice(yin,None),slice(None)))
   
-  maskExp = maskExpand(MaskC,Tr)
-
-  TrMask=np.ma.array(Tr,mask=maskExp)   
-    
-  trlim = TrMask[0,nzlim,yi,xi]
+  
+  trlim = _trlim(Tr,nzlim,yi,xi)
     
   print('tracer limit concentration is: ',trlim)
     
-  WaterX = 0
-    
-  # mask cells with tracer concentration < trlim on shelf
-  HighConc_Masked = np.ma.masked_less(TrMask[:,:zfin,yin:,:], trlim) 
-  HighConc_Mask = HighConc_Masked.mask
-    
-  #Get volume of water of cells with relatively high concentration
-  rA_exp = np.expand_dims(rA[yin:,:],0)
-  drF_exp = np.expand_dims(np.expand_dims(drF[:zfin],1),1)
-  rA_exp = rA_exp + np.zeros(hFacC[:zfin,yin:,:].shape)
-  drF_exp = drF_exp + np.zeros(hFacC[:zfin,yin:,:].shape)
-    
-  ShelfVolume = hFacC[:zfin,yin:,:]*drF_exp*rA_exp
-  ShelfVolume_exp = np.expand_dims(ShelfVolume,0)
-  ShelfVolume_exp = ShelfVolume_exp + np.zeros(HighConc_Mask.shape)
-    
-  HighConc_CellVol = np.ma.masked_array(ShelfVolume_exp,mask = HighConc_Mask) 
-  VolWaterHighConc = np.ma.sum(np.ma.sum(np.ma.sum(HighConc_CellVol,axis = 1),axis=1),axis=1)
+  cells = _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(None))
+  
+  # volume of cells with concentration >= trlim on shelf
+  VolWaterHighConc = _highConcVolume(Tr,cells,trlim)
     
-   #Get total mass of tracer on shelf
-  Total_Tracer = np.ma.sum(np.ma.sum(np.ma.sum(ShelfVolume_exp*TrMask[:,:zfin,yin:,:]*1000.0,axis = 1),axis=1),axis=1) 
-   # 1 m^3 = 1000 l
+  #Get total mass of tracer on shelf
+  Total_Tracer = _tracerMass(Tr,cells)
     
   return (VolWaterHighConc, Total_Tracer)
  
 
  # ------------------------------------------------------------------------------------------------------------------------
-def calc_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,yi=50):
+def calc_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,yi=50,trlim=None,cells=None):
   '''
   INPUT----------------------------------------------------------------------------------------------------------------
     Tr    : Array with concentration values for a tracer. Until this function is more general, this should be size 19x90x360x360
-    MaskC : Land mask for tracer
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
     nzlim : The nz index under which to look for water properties
     rA    : Area of cell faces at C points (360x360)
     fFacC : Fraction of open cell (90x360x360)
@@ -133,6 +217,8 @@ def calc_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=
     zfin  : shelf break index + 1 
     xi    : initial profile x index
     yi    : initial profile y index
+    trlim : threshold concentration. Default is Tr[0,nzlim,yi,xi]; give it when Tr does not start at the first time output.
+    cells : wet cells of the box, wetVolume(MaskC,rA,hFacC,drF,zfin,slice(yin,None),slice(xin,xfin)), optional.
       
     All dimensions should match.
    
@@ -141,46 +227,35 @@ def calc_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=
     in the initial volume defined by the dimensions of Tr at every time output.
   -----------------------------------------------------------------------------------------------------------------------
   '''
-  maskExp = maskExpand(MaskC,Tr)
-
-  TrMask=np.ma.array(Tr,mask=maskExp)   
-    
-  trlim1 = TrMask[0,nzlim,yi,xi]
-  trlim2 = TrMask[0,nzlim+1,yi,xi] 
+  if rout.isLazy(Tr):
+    if trlim is None:
+      trlim = _lazyTrlim(Tr,nzlim,yi,xi)
+    print('tracer limit concentration is: ',trlim)
+    CellVol = _lazyCellVol(rA,hFacC,drF,zfin,slice(yin,None),slice(xin,xfin))
+    return _lazyHighConcVolume(Tr,MaskC,CellVol,trlim,zfin,slice(yin,None),slice(xin,xfin))
   
-  trlim = trlim1  
+  if trlim is None:
+    trlim = _trlim(Tr,nzlim,yi,xi)
   
   print('tracer limit concentration is: ',trlim)
     
-  WaterX = 0
-    
-  # mask cells with tracer concentration < trlim on shelf
-  HighConc_Masked = np.ma.masked_less(TrMask[:,:zfin,yin:,xin:xfin], trlim) 
-  HighConc_Mask = HighConc_Masked.mask
-    
-  #Get volume of water of cells with relatively high concentration
-  rA_exp = np.expand_dims(rA[yin:,xin:xfin],0)
-  drF_exp = np.expand_dims(np.expand_dims(drF[:zfin],1),1)
-  rA_exp = rA_exp + np.zeros(hFacC[:zfin,yin:,xin:xfin].shape)
-  drF_exp = drF_exp + np.zeros(hFacC[:zfin,yin:,xin:xfin].shape)
-    
-  ShelfVolume = hFacC[:zfin,yin:,xin:xfin]*drF_exp*rA_exp
-  ShelfVolume_exp = np.expand_dims(ShelfVolume,0)
-  ShelfVolume_exp = ShelfVolume_exp + np.zeros(HighConc_Mask.shape)
-    
-  HighConc_CellVol = np.ma.masked_array(ShelfVolume_exp,mask = HighConc_Mask) 
-  VolWaterHighConc = np.zeros(np.shape(Tr)[0])+np.ma.sum(np.ma.sum(np.ma.sum(HighConc_CellVol,axis = 1),axis=1),axis=1)
+  if cells is None:
+    cells = _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(xin,xfin))
+  
+  # volume of cells with concentration >= trlim on shelf
+  VolWaterHighConc = np.zeros(np.shape(Tr)[0])+_highConcVolume(Tr,cells,trlim)
     
   return (VolWaterHighConc)
  
  # ---------------------------------------------------------------------------------------------------------------------------
 
 # ------------------------------------------------------------------------------------------------------------------------
-def calc_InvHCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,yi=50):
+def calc_InvHCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,yi=50,trlim=None,
+                cells=None):
   '''
   INPUT----------------------------------------------------------------------------------------------------------------
     Tr    : Array with concentration values for a tracer. Until this function is more general, this should be size 19x90x360x360
-    MaskC : Land mask for tracer
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
     nzlim : The nz index under which to look for water properties
     rA    : Area of cell faces at C points (360x360)
     fFacC : Fraction of open cell (90x360x360)
@@ -191,6 +266,8 @@ def calc_InvHCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,
     zfin  : shelf break index + 1 
     xi    : initial profile x index
     yi    : initial profile y index
+    trlim : threshold concentration. Default is Tr[0,nzlim,yi,xi]; give it when Tr does not start at the first time output.
+    cells : wet cells of the box, wetVolume(MaskC,rA,hFacC,drF,zfin,slice(yin,None),slice(xin,xfin)), optional.
       
     All dimensions should match.
    
@@ -200,50 +277,39 @@ def calc_InvHCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,
     like oxygen.
   -----------------------------------------------------------------------------------------------------------------------
   '''
-  maskExp = maskExpand(MaskC,Tr)
-
-  TrMask=np.ma.array(Tr,mask=maskExp)   
-    
-  trlim1 = TrMask[0,nzlim,yi,xi]
-  trlim2 = TrMask[0,nzlim+1,yi,xi] 
+  if rout.isLazy(Tr):
+    if trlim is None:
+      trlim = _lazyTrlim(Tr,nzlim,yi,xi)
+    print('tracer limit concentration is: ',trlim)
+    CellVol = _lazyCellVol(rA,hFacC,drF,zfin,slice(yin,None),slice(xin,xfin))
+    return _lazyHighConcVolume(Tr,MaskC,CellVol,trlim,zfin,slice(yin,None),slice(xin,xfin),greater=True)
   
-  trlim = trlim1  
+  if trlim is None:
+    trlim = _trlim(Tr,nzlim,yi,xi)
   
   print('tracer limit concentration is: ',trlim)
     
-  WaterX = 0
-    
-  # mask cells with tracer concentration > trlim on shelf
-  HighConc_Masked = np.ma.masked_greater(TrMask[:,:zfin,yin:,xin:xfin], trlim) 
-  HighConc_Mask = HighConc_Masked.mask
-    
-  #Get volume of water of cells with relatively high concentration
-  rA_exp = np.expand_dims(rA[yin:,xin:xfin],0)
-  drF_exp = np.expand_dims(np.expand_dims(drF[:zfin],1),1)
-  rA_exp = rA_exp + np.zeros(hFacC[:zfin,yin:,xin:xfin].shape)
-  drF_exp = drF_exp + np.zeros(hFacC[:zfin,yin:,xin:xfin].shape)
-    
-  ShelfVolume = hFacC[:zfin,yin:,xin:xfin]*drF_exp*rA_exp
-  ShelfVolume_exp = np.expand_dims(ShelfVolume,0)
-  ShelfVolume_exp = ShelfVolume_exp + np.zeros(HighConc_Mask.shape)
-    
-  HighConc_CellVol = np.ma.masked_array(ShelfVolume_exp,mask = HighConc_Mask) 
-  VolWaterHighConc = np.zeros(np.shape(Tr)[0])+np.ma.sum(np.ma.sum(np.ma.sum(HighConc_CellVol,axis = 1),axis=1),axis=1)
+  if cells is None:
+    cells = _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(xin,xfin))
+  
+  # volume of cells with concentration <= trlim on shelf
+  VolWaterHighConc = np.zeros(np.shape(Tr)[0])+_highConcVolume(Tr,cells,trlim,greater=True)
     
   return (VolWaterHighConc)
  
  # ---------------------------------------------------------------------------------------------------------------------------
   # ------------------------------------------------------------------------------------------------------------------------
-def calc_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=227,zfin=29):
+def calc_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=227,zfin=29,cells=None):
   '''
   INPUT----------------------------------------------------------------------------------------------------------------
     Tr    : Array with concentration values for a tracer. Until this function is more general, this should be size 19x90x360x360
-    MaskC : Land mask for tracer
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
     rA    : Area of cell faces at C points (360x360)
     fFacC : Fraction of open cell (90x360x360)
     drF   : Distance between cell faces (90)
     yin   : across-shore index of shelf break
     zfin  : shelf break index + 1 
+    cells : wet cells of the shelf, wetVolume(MaskC,rA,hFacC,drF,zfin,slice(yin,None)), optional.
     
    All dimensions should match.
    
@@ -251,22 +317,16 @@ def calc_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=227,zfin=29):
     Total_Tracer =  np array with the mass of tracer on shelf at every time output.
   -----------------------------------------------------------------------------------------------------------------------
   '''
-  maskExp = maskExpand(MaskC,Tr)
-
-  TrMask=np.ma.array(Tr,mask=maskExp)   
-    
-  rA_exp = np.expand_dims(rA[yin:,:],0)
-  drF_exp = np.expand_dims(np.expand_dims(drF[:zfin],1),1)
-  rA_exp = rA_exp + np.zeros(hFacC[:zfin,yin:,:].shape)
-  drF_exp = drF_exp + np.zeros(hFacC[:zfin,yin:,:].shape)
-    
-  ShelfVolume = hFacC[:zfin,yin:,:]*drF_exp*rA_exp
-  ShelfVolume_exp = np.expand_dims(ShelfVolume,0)
-  ShelfVolume_exp = ShelfVolume_exp + np.zeros(HighConc_Mask.shape)
+  if rout.isLazy(Tr):
+    CellVol = _lazyCellVol(rA,hFacC,drF,zfin,slice(yin,None),slice(None))
+    return _lazyTracerMass(Tr,MaskC,CellVol,zfin,slice(yin,None),slice(None))
+  
+  if cells is None:
+    cells = _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(None))
     
    #Get total mass of tracer on shelf
-  Total_Tracer = np.ma.sum(np.ma.sum(np.ma.sum(ShelfVolume_exp*TrMask[:,:zfin,yin:,:]*1000.0,axis = 1),axis=1),axis=1) 
-   # 1 m^3 = 1000 l 
+  Total_Tracer = _tracerMass(Tr,cells)
+   
   return (Total_Tracer)
  
  
@@ -287,6 +347,9 @@ def calc_ShelfVolume(rA,hFacC,drF,yin=227,zfin=29):
     ShelfVolume =  Volume of shelf
   -----------------------------------------------------------------------------------------------------------------------
   '''
+  if rout.isLazy(hFacC):
+    return np.sum(_lazyCellVol(rA,hFacC,drF,zfin,slice(yin,None),slice(None)))
+  
     
   rA_exp = np.expand_dims(rA[yin:,:],0)
   drF_exp = np.expand_dims(np.expand_dims(drF[:zfin],1),1)
@@ -303,7 +366,7 @@ def howMuchWaterCV(Tr,MaskC,nzlim,rA,hFacC,drF,yin,zfin,xi,yi,xo,xf):
   '''
   INPUT----------------------------------------------------------------------------------------------------------------
     Tr    : Array with concentration values for a tracer. Until this function is more general, this should be size 19x90x360x360
-    MaskC : Land mask for tracer
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
     nzlim : The nz index under which to look for water properties
     rA    : Area of cell faces at C points (360x360)
     fFacC : Fraction of open cell (90x360x360)
@@ -320,47 +383,36 @@ def howMuchWaterCV(Tr,MaskC,nzlim,rA,hFacC,drF,yin,zfin,xi,yi,xo,xf):
                                                 
   -----------------------------------------------------------------------------------------------------------------------
   '''
-  maskExp = maskExpand(MaskC,Tr)
-
-  TrMask=np.ma.array(Tr,mask=maskExp)   
-    
-  trlim = TrMask[0,nzlim,yi,xi]
+  if rout.isLazy(Tr):
+    trlim = _lazyTrlim(Tr,nzlim,yi,xi)
+    print('tracer limit concentration is: ',trlim)
+    CellVol = _lazyCellVol(rA,hFacC,drF,zfin,slice(yin,None),slice(xo,xf))
+    return (_lazyHighConcVolume(Tr,MaskC,CellVol,trlim,zfin,slice(yin,None),slice(xo,xf)),
+            _lazyTracerMass(Tr,MaskC,CellVol,zfin,slice(yin,None),slice(xo,xf)))
+  
+  trlim = _trlim(Tr,nzlim,yi,xi)
     
   print('tracer limit concentration is: ',trlim)
     
-  WaterX = 0
-    
-  # mask cells with tracer concentration < trlim on shelf
-  HighConc_Masked = np.ma.masked_less(TrMask[:,:zfin,yin:,xo:xf], trlim) 
-  HighConc_Mask = HighConc_Masked.mask
-    
-  #Get volume of water of cells with relatively high concentration
-  rA_exp = np.expand_dims(rA[yin:,xo:xf],0)
-  drF_exp = np.expand_dims(np.expand_dims(drF[:zfin],1),1)
-  rA_exp = rA_exp + np.zeros(hFacC[:zfin,yin:,xo:xf].shape)
-  drF_exp = drF_exp + np.zeros(hFacC[:zfin,yin:,xo:xf].shape)
-    
-  ShelfVolume = hFacC[:zfin,yin:,xo:xf]*drF_exp*rA_exp
-  ShelfVolume_exp = np.expand_dims(ShelfVolume,0)
-  ShelfVolume_exp = ShelfVolume_exp + np.zeros(HighConc_Mask.shape)
-    
-  HighConc_CellVol = np.ma.masked_array(ShelfVolume_exp,mask = HighConc_Mask) 
-  VolWaterHighConc = np.ma.sum(np.ma.sum(np.ma.sum(HighConc_CellVol,axis = 1),axis=1),axis=1)
+  cells = _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(xo,xf))
+  
+  # volume of cells with concentration >= trlim on shelf
+  VolWaterHighConc = _highConcVolume(Tr,cells,trlim)
     
    #Get total mass of tracer on shelf
-  Total_Tracer = np.ma.sum(np.ma.sum(np.ma.sum(ShelfVolume_exp*TrMask[:,:zfin,yin:,xo:xf]*1000.0,axis = 1),axis=1),axis=1) 
-   # 1 m^3 = 1000 l
+  Total_Tracer = _tracerMass(Tr,cells)
     
   return (VolWaterHighConc, Total_Tracer)
   
   
   
 #---------------------------------------------------------------------------------------------------------------------------
-def howMuchWaterShwHole(Tr,MaskC,nzlim,rA,hFacC,drF,yin,zfin,xi,yi,xh1=120,xh2=240,yh1=227,yh2=267):
+def howMuchWaterShwHole(Tr,MaskC,nzlim,rA,hFacC,drF,yin,zfin,xi,yi,xh1=120,xh2=240,yh1=227,yh2=267,trlim=None,
+                        cells=None):
   '''
     INPUT----------------------------------------------------------------------------------------------------------------
     Tr    : Array with concentration values for a tracer. Until this function is more general, this should be size 19x90x360x360
-    MaskC : Land mask for tracer
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
     nzlim : The nz index under which to look for water properties
     rA    : Area of cell faces at C points (360x360)
     fFacC : Fraction of open cell (90x360x360)
@@ -373,6 +425,9 @@ def howMuchWaterShwHole(Tr,MaskC,nzlim,rA,hFacC,drF,yin,zfin,xi,yi,xh1=120,xh2=2
     xh2=240 : 2nd x index of hole
     yh1=227 : 1st y index of hole
     yh2=267 : 2nd y index of hole
+    trlim : threshold concentration. Default is Tr[0,nzlim,yi,xi]; give it when Tr does not start at the first time output.
+    cells : (shelf, hole) wet cells, wetVolume(MaskC,rA,hFacC,drF,zfin,slice(yin,None)) and
+            wetVolume(MaskC,rA,hFacC,drF,zfin,slice(yh1,yh2),slice(xh1,xh2)), optional.
     
     OUTPUT----------------------------------------------------------------------------------------------------------------
     VolWaterHighConc =  Array with the volume of water over the shelf [:,:30,227:,:] at every time output.
@@ -383,63 +438,321 @@ def howMuchWaterShwHole(Tr,MaskC,nzlim,rA,hFacC,drF,yin,zfin,xi,yi,xh1=120,xh2=2
                                                
     -----------------------------------------------------------------------------------------------------------------------
   '''
-  maskExp = maskExpand(MaskC,Tr)
-
-  TrMask=np.ma.array(Tr,mask=maskExp)   
-    
-  trlim = TrMask[0,nzlim,yi,xi]
+  if rout.isLazy(Tr):
+    if trlim is None:
+      trlim = _lazyTrlim(Tr,nzlim,yi,xi)
+    print('tracer limit concentration is: ',trlim)
+    shelf = (slice(yin,None),slice(None))
+    hole = (slice(yh1,yh2),slice(xh1,xh2))
+    CellVol = _lazyCellVol(rA,hFacC,drF,zfin,*shelf)
+    CellVolHole = _lazyCellVol(rA,hFacC,drF,zfin,*hole)
+    VolWaterHighConcHole = _lazyHighConcVolume(Tr,MaskC,CellVolHole,trlim,zfin,*hole)
+    Total_Tracer_Hole = _lazyTracerMass(Tr,MaskC,CellVolHole,zfin,*hole)
+    return (_lazyHighConcVolume(Tr,MaskC,CellVol,trlim,zfin,*shelf)-VolWaterHighConcHole,
+            _lazyTracerMass(Tr,MaskC,CellVol,zfin,*shelf)-Total_Tracer_Hole,
+            VolWaterHighConcHole,Total_Tracer_Hole)
+  
+  if trlim is None:
+    trlim = _trlim(Tr,nzlim,yi,xi)
     
   print('tracer limit concentration is: ',trlim)
     
+  if cells is None:
+    cells = (_wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(None)),
+             _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yh1,yh2),slice(xh1,xh2)))
+  cells, cellsHole = cells
   
-  # mask cells with tracer concentration < trlim on control volume
-  HighConc_Masked = np.ma.masked_less(TrMask[:,:zfin,yin:,:], trlim) 
-  HighConc_Mask = HighConc_Masked.mask
-    
-  HighConcHole_Masked = np.ma.masked_less(TrMask[:,:zfin,yh1:yh2,xh1:xh2], trlim) 
-  HighConcHole_Mask = HighConcHole_Masked.mask
-  
-  
-  #Get volume of water of cells with relatively high concentration
-  rA_exp = np.expand_dims(rA[yin:,:],0)
-  rA_exp_hole = np.expand_dims(rA[yh1:yh2,xh1:xh2],0)
+  # volume of cells with concentration >= trlim on control volume
+  VolWaterHighConc = _highConcVolume(Tr,cells,trlim)
+  VolWaterHighConcHole = _highConcVolume(Tr,cellsHole,trlim)
   
-  rA_exp = rA_exp + np.zeros(hFacC[:zfin,yin:,:].shape)
-  rA_exp_hole = rA_exp_hole + np.zeros(hFacC[:zfin,yh1:yh2,xh1:xh2].shape)
- 
-  drF_exp = np.expand_dims(np.expand_dims(drF[:zfin],1),1)
-  drF_exp_hole = np.expand_dims(np.expand_dims(drF[:zfin],1),1)
+  VolWaterHighConcShelfwHole = VolWaterHighConc-VolWaterHighConcHole
   
-  drF_exp = drF_exp + np.zeros(hFacC[:zfin,yin:,:].shape)
-  drF_exp_hole = drF_exp_hole +np.zeros(hFacC[:zfin,yh1:yh2,xh1:xh2].shape)
+  #Get total mass of tracer on shelf
+  Total_Tracer = _tracerMass(Tr,cells)
+  Total_Tracer_Hole = _tracerMass(Tr,cellsHole)
   
-   
-  ShelfVolume = hFacC[:zfin,yin:,:]*drF_exp*rA_exp
-  ShelfVolume_exp = np.expand_dims(ShelfVolume,0)
-  ShelfVolume_exp = ShelfVolume_exp + np.zeros(HighConc_Mask.shape)
+  Total_Tracer_ShelfwHole = Total_Tracer-Total_Tracer_Hole
     
-  HoleVolume = hFacC[:zfin,yh1:yh2,xh1:xh2]*drF_exp_hole*rA_exp_hole
-  HoleVolume_exp = np.expand_dims(HoleVolume,0)
-  HoleVolume_exp = HoleVolume_exp + np.zeros(HighConcHole_Mask.shape)
-  
+  return (VolWaterHighConcShelfwHole, Total_Tracer_ShelfwHole,VolWaterHighConcHole,Total_Tracer_Hole)
+
+
+#----------------------------------------------------------------------------------------------------------------------------
+
+def _boxVolume(MaskC,rA,hFacC,drF,zfin,ys,xs,shape):
+  '''Volumes of the cells [:zfin,ys,xs] (nz,ny,nx), zero on land. Only 3D, the time dimension is never broadcast.'''
+  box = (slice(None,zfin),ys,xs)
+  CellVol = np.asarray(hFacC)[box]*np.asarray(drF)[:zfin,None,None]*np.asarray(rA)[ys,xs]
+  CellVol[rout.landMask(MaskC,shape)[box]] = 0
+  return CellVol
+
+
+def _contract(Tr,CellVol,zfin,ys,xs,keep,trlim=None,greater=False):
+  '''Sum over the axes of [:zfin,ys,xs] not in keep ('ji', 'i' or 'j') of Tr*CellVol, or of CellVol where Tr >= trlim
+  (<= trlim if greater), at every time output, in one contraction (einsum) of the whole box.'''
+  TrBox = Tr[:,:zfin,ys,xs]
+  if trlim is None:
+    fld = np.ma.filled(TrBox,0)
+  elif greater:
+    fld = np.ma.getdata(TrBox) <= trlim
+  else:
+    fld = np.ma.getdata(TrBox) >= trlim
+  return np.einsum('tkji,kji->t'+keep,fld,CellVol)
+
+
+def _keepAxis(axis):
+  '''Axis kept by the distributions: 'x' (alongshore) or 'y' (cross-shore).'''
+  if axis not in ('x','y'):
+    raise ValueError("axis must be 'x' or 'y', not %r" % (axis,))
+  return 'i' if axis == 'x' else 'j'
+
+
+def calc_InventoryMap(Tr,MaskC,rA,hFacC,drF,zfin=None):
+  '''
+  INPUT----------------------------------------------------------------------------------------------------------------
+    Tr    : Array with concentration values for a tracer (nt,nz,ny,nx)
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
+    rA    : Area of cell faces at C points (ny,nx)
+    hFacC : Fraction of open cell (nz,ny,nx)
+    drF   : Distance between cell faces (nz)
+    zfin  : integrate from the surface down to level zfin-1. Default is the whole water column.
+    
+   OUTPUT----------------------------------------------------------------------------------------------------------------
+    Inventory = masked array (nt,ny,nx) with the depth-integrated tracer per unit area (m*[C]*l/m^3) of every water 
+                column at every time output. Land columns are masked.
+  -----------------------------------------------------------------------------------------------------------------------
+  '''
+  CellVol = _boxVolume(MaskC,np.ones(np.shape(rA)),hFacC,drF,zfin,slice(None),slice(None),np.shape(Tr)[1:])
+  Inventory = _contract(Tr,CellVol,zfin,slice(None),slice(None),'ji')*1000.0 # 1 m^3 = 1000 l
+  return np.ma.masked_array(Inventory,mask=np.broadcast_to(np.sum(CellVol,axis=0) == 0,Inventory.shape))
+
+
+def calc_HCWDistribution(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,zfin=29,xi=180,yi=50,axis='x',trlim=None):
+  '''
+  INPUT----------------------------------------------------------------------------------------------------------------
+    Tr    : Array with concentration values for a tracer (nt,nz,ny,nx)
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
+    rA, hFacC, drF, nzlim, yin, zfin, xi, yi, trlim : as in calc_HCW
+    axis  : 'x' for the alongshore distribution, 'y' for the cross-shore distribution
+    
+   OUTPUT----------------------------------------------------------------------------------------------------------------
+    VolWaterHighConc = array with the volume of water with concentration equal or higher than trlim over the shelf 
+                       [:zfin,yin:,:] at each x position (nt,nx) (axis='x') or each y position (nt,ny-yin) (axis='y').
+                       The sum over x is howMuchWaterX.
+  -----------------------------------------------------------------------------------------------------------------------
+  '''
+  if trlim is None:
+    trlim = _trlim(Tr,nzlim,yi,xi)
   
-  HighConc_CellVol = np.ma.masked_array(ShelfVolume_exp,mask = HighConc_Mask) 
-  HighConc_CellVol_Hole = np.ma.masked_array(HoleVolume_exp,mask = HighConcHole_Mask) 
+  print('tracer limit concentration is: ',trlim)
   
-  VolWaterHighConc = np.ma.sum(np.ma.sum(np.ma.sum(HighConc_CellVol,axis = 1),axis=1),axis=1)
-  VolWaterHighConcHole = np.ma.sum(np.ma.sum(np.ma.sum(HighConc_CellVol_Hole,axis = 1),axis=1),axis=1)
+  CellVol = _boxVolume(MaskC,rA,hFacC,drF,zfin,slice(yin,None),slice(None),np.shape(Tr)[1:])
+  return _contract(Tr,CellVol,zfin,slice(yin,None),slice(None),_keepAxis(axis),trlim=trlim)
+
+
+def calc_TrMassDistribution(Tr,MaskC,rA,hFacC,drF,yin=227,zfin=29,axis='x'):
+  '''
+  INPUT----------------------------------------------------------------------------------------------------------------
+    Tr    : Array with concentration values for a tracer (nt,nz,ny,nx)
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
+    rA, hFacC, drF, yin, zfin : as in calc_TrMassonShelf
+    axis  : 'x' for the alongshore distribution, 'y' for the cross-shore distribution
+    
+   OUTPUT----------------------------------------------------------------------------------------------------------------
+    Total_Tracer = array with the mass of tracer (m^3*[C]*l/m^3) over the shelf [:zfin,yin:,:] at each x position (nt,nx)
+                   (axis='x') or each y position (nt,ny-yin) (axis='y'). The sum over x is calc_TrMassonShelf.
+  -----------------------------------------------------------------------------------------------------------------------
+  '''
+  CellVol = _boxVolume(MaskC,rA,hFacC,drF,zfin,slice(yin,None),slice(None),np.shape(Tr)[1:])
+  return _contract(Tr,CellVol,zfin,slice(yin,None),slice(None),_keepAxis(axis))*1000.0 # 1 m^3 = 1000 l
+
+
+def calc_IsosurfaceDepth(Tr,MaskC,RC,nzlim=29,xi=180,yi=50,trlim=None,greater=False):
+  '''
+  INPUT----------------------------------------------------------------------------------------------------------------
+    Tr      : Array with concentration values for a tracer (nt,nz,ny,nx), or density (e.g. calc_sigmaHor)
+    MaskC   : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
+    RC      : Depth of cell centers (nz), negative as in gridGlob.nc
+    nzlim, xi, yi, trlim : threshold, as in calc_HCW. Default is Tr[0,nzlim,yi,xi].
+    greater : find where Tr falls to trlim or below instead (decreasing profiles like oxygen, as calc_InvHCW)
+    
+   OUTPUT----------------------------------------------------------------------------------------------------------------
+    IsoDepth = masked array (nt,ny,nx) with the depth (same sign as RC) of the shallowest crossing of trlim in every 
+               water column, linearly interpolated between the cell centers above and below it. Columns where the
+               surface cell is already past trlim get RC[0]. Land columns and columns where Tr never reaches trlim 
+               are masked. IsoDepth-RC[nzlim] is how much the isosurface has risen.
+  -----------------------------------------------------------------------------------------------------------------------
+  '''
+  if trlim is None:
+    trlim = _trlim(Tr,nzlim,yi,xi)
   
-  VolWaterHighConcShelfwHole = VolWaterHighConc-VolWaterHighConcHole
+  print('tracer limit concentration is: ',trlim)
   
-  #Get total mass of tracer on shelf
-  Total_Tracer = np.ma.sum(np.ma.sum(np.ma.sum(ShelfVolume_exp*TrMask[:,:zfin,yin:,:]*1000.0,axis = 1),axis=1),axis=1) 
-  Total_Tracer_Hole = np.ma.sum(np.ma.sum(np.ma.sum(HoleVolume_exp*TrMask[:,:zfin,yh1:yh2,xh1:xh2]*1000.0,axis = 1),axis=1),axis=1) 
+  RC = np.asarray(RC)
+  wet = ~rout.landMask(MaskC,np.shape(Tr)[1:])
+  fld = np.ma.getdata(Tr[...])
+  past = (fld <= trlim) if greater else (fld >= trlim)
+  past &= wet[None]
+  kk = np.argmax(past,axis=1)[:,None,:,:] # first level past trlim, from the surface down, at every time output
+  ka = np.maximum(kk-1,0)
+  above = np.take_along_axis(fld,ka,axis=1)[:,0]
+  below = np.take_along_axis(fld,kk,axis=1)[:,0]
+  with np.errstate(divide='ignore',invalid='ignore'):
+    frac = np.where((kk[:,0] > 0) & (below != above),(trlim-above)/(below-above),1.0)
+  depth = RC[ka[:,0]]+frac*(RC[kk[:,0]]-RC[ka[:,0]])
+  IsoDepth = np.ma.masked_array(depth,mask=~np.take_along_axis(past,kk,axis=1)[:,0])
+  return IsoDepth
+
+
+#----------------------------------------------------------------------------------------------------------------------------
+
+def _strataOrder(ncells,stratum,strided,rng):
+  '''Visiting order of the wet cells (ordered by level, y and x, as from _wetVolume) for the approximate metrics. Cells
+  are split in strata of stratum consecutive cells, i.e. compact pieces of a level. Returns the stratum of every cell and
+  its rank in the visiting order of its stratum: random, or strided (evenly spaced from a random offset, with the
+  spacing halved every time the sample doubles). The cells of a sample are always part of the larger samples.'''
+  cell = np.arange(ncells)
+  strata = cell//stratum
+  pos = cell % stratum
+  if strided:
+    size = np.bincount(strata)[strata]
+    shifted = (pos+rng.integers(0,stratum,strata[-1]+1)[strata]) % size
+    nbits = max(int(stratum-1).bit_length(),1)
+    key = np.zeros(ncells,dtype=np.int64)
+    for bit in range(nbits): # bit-reversed position, a nested evenly spaced order
+      key |= ((shifted >> bit) & 1) << (nbits-1-bit)
+  else:
+    key = rng.random(ncells)
+  rank = np.empty(ncells,dtype=np.int64)
+  rank[np.lexsort((key,strata))] = pos
+  return (strata,rank)
+
+
+def _approxSum(Tr,cells,value,fractions,tstep,stratum,strided,z,seed):
+  '''Generator of stratified sample estimates of the sum of value(Tr)*CellVol over the wet cells (from _wetVolume) at
+  the time outputs 0::tstep, one for every sample fraction in fractions. Yields (times, estimate, bound, fraction); bound
+  is z standard errors and is 0 when fraction is 1. With Tr in memory every refinement only gathers the cells not
+  sampled before. Otherwise (e.g. a netCDF4 variable) every time output is read once, only the box around the sampled
+  cells, and all the refinements are computed from it before the first one is yielded.'''
+  kk,jj,ii,CellVol = cells
+  ncells = len(CellVol)
+  times = np.arange(0,np.shape(Tr)[0],tstep)
+  if ncells == 0:
+    for fraction in fractions:
+      yield (times,np.zeros(len(times)),np.zeros(len(times)),1.0)
+    return
+  strata, rank = _strataOrder(ncells,stratum,strided,np.random.default_rng(seed))
+  Nh = np.bincount(strata)
+  nhs = [np.minimum(Nh,np.maximum(2,np.ceil(fraction*Nh).astype(np.int64))) for fraction in fractions]
+
+  def estimate(S1,S2,nh):
+    mean = S1/nh
+    varh = np.maximum(S2-nh*mean**2,0)/np.maximum(nh-1,1)
+    var = np.sum(Nh**2*(1-nh/Nh)*varh/nh,axis=1)
+    return (times,np.sum(Nh*mean,axis=1),z*np.sqrt(var),nh.sum()/ncells)
+
+  if isinstance(Tr,np.ndarray):
+    S1 = np.zeros((len(times),len(Nh)))
+    S2 = np.zeros((len(times),len(Nh)))
+    nPrev = np.zeros(len(Nh),dtype=np.int64)
+    for nh in nhs:
+      new = np.flatnonzero((rank >= nPrev[strata]) & (rank < nh[strata]))
+      for nn, tt in enumerate(times):
+        y = value(Tr[tt][kk[new],jj[new],ii[new]])*CellVol[new]
+        S1[nn] += np.bincount(strata[new],weights=y,minlength=len(Nh))
+        S2[nn] += np.bincount(strata[new],weights=y*y,minlength=len(Nh))
+      nPrev = nh
+      yield estimate(S1,S2,nh)
+    return
+
+  # refinement in which every cell is first sampled (len(fractions) if never)
+  nf = len(fractions)
+  group = np.full(ncells,nf)
+  for ff in range(nf-1,-1,-1):
+    group[rank < nhs[ff][strata]] = ff
+  sampled = np.flatnonzero(group < nf)
+  box = tuple(slice(int(ind[sampled].min()),int(ind[sampled].max())+1) for ind in (kk,jj,ii))
+  local = (kk[sampled]-box[0].start,jj[sampled]-box[1].start,ii[sampled]-box[2].start)
+  key = group[sampled]*len(Nh)+strata[sampled]
+  S1 = np.zeros((len(times),nf*len(Nh)))
+  S2 = np.zeros((len(times),nf*len(Nh)))
+  for nn, tt in enumerate(times):
+    y = value(np.ma.asarray(Tr[(tt,)+box])[local])*CellVol[sampled]
+    S1[nn] = np.bincount(key,weights=y,minlength=nf*len(Nh))
+    S2[nn] = np.bincount(key,weights=y*y,minlength=len(S2[nn]))
+  S1 = np.cumsum(S1.reshape(len(times),nf,len(Nh)),axis=1) # a sample includes the cells of the smaller ones
+  S2 = np.cumsum(S2.reshape(len(times),nf,len(Nh)),axis=1)
+  for ff in range(nf):
+    yield estimate(S1[:,ff],S2[:,ff],nhs[ff])
+
+
+def refine_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,yi=50,trlim=None,
+               fractions=(0.01,0.04,0.16,0.64,1.0),tstep=1,stratum=256,strided=False,z=1.96,seed=None):
+  '''
+  INPUT----------------------------------------------------------------------------------------------------------------
+    Tr, MaskC, rA, hFacC, drF, nzlim, yin, xin, xfin, zfin, xi, yi, trlim : as in calc_HCW. Tr can also be a netCDF4
+               variable; only the time outputs 0::tstep are read, each of them once.
+    fractions: increasing fractions of the wet cells to sample. The last one is usually 1, the exact calc_HCW.
+    tstep    : use every tstep-th time output
+    stratum  : number of consecutive wet cells (ordered by level, y and x) in a stratum. At least 2 cells of every stratum
+               are sampled.
+    strided  : sample evenly spaced cells of every stratum instead of random cells
+    z        : the error bound is z standard errors of the estimate (1.96 for 95%)
+    seed     : seed of the random generator, for reproducible samples
+      
+   OUTPUT----------------------------------------------------------------------------------------------------------------
+    Generator that yields, for every fraction, (times, VolWaterHighConc, bound, fraction): indices of the time outputs
+    used, estimate of calc_HCW at those times, error bound of the estimate and fraction of wet cells actually sampled.
+    Every refinement adds cells to the previous sample, so with Tr in memory stopping when the bound is small enough
+    costs only the cells visited so far (a netCDF4 variable is read once for all the fractions). The bound accounts for the sampling of cells, not of time outputs.
+  -----------------------------------------------------------------------------------------------------------------------
+  '''
+  if trlim is None:
+    trlim = _trlim(Tr,nzlim,yi,xi)
   
-  Total_Tracer_ShelfwHole = Total_Tracer-Total_Tracer_Hole
+  print('tracer limit concentration is: ',trlim)
   
-  # 1 m^3 = 1000 l
+  cells = _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(xin,xfin))
+  return _approxSum(Tr,cells,lambda fld: np.ma.getdata(fld) >= trlim,fractions,tstep,stratum,strided,z,seed)
+
+
+def refine_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=227,zfin=29,fractions=(0.01,0.04,0.16,0.64,1.0),tstep=1,
+                         stratum=256,strided=False,z=1.96,seed=None):
+  '''
+  INPUT----------------------------------------------------------------------------------------------------------------
+    Tr, MaskC, rA, hFacC, drF, yin, zfin : as in calc_TrMassonShelf
+    fractions, tstep, stratum, strided, z, seed : as in refine_HCW
     
-  return (VolWaterHighConcShelfwHole, Total_Tracer_ShelfwHole,VolWaterHighConcHole,Total_Tracer_Hole)
+   OUTPUT----------------------------------------------------------------------------------------------------------------
+    Generator that yields, for every fraction, (times, Total_Tracer, bound, fraction) as in refine_HCW, with the
+    estimate of calc_TrMassonShelf.
+  -----------------------------------------------------------------------------------------------------------------------
+  '''
+  cells = _wetVolume(MaskC,Tr,rA,hFacC,drF,zfin,slice(yin,None),slice(None))
+  return _approxSum(Tr,cells,lambda fld: np.ma.filled(fld,0)*1000.0,fractions,tstep,stratum,strided,z,seed) # 1 m^3 = 1000 l
+
+
+def approx_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,yi=50,trlim=None,fraction=0.1,
+               tstep=1,stratum=256,strided=False,z=1.96,seed=None):
+  '''Approximate calc_HCW from a sample of fraction of the wet cells and of every tstep-th time output, for screening
+  many runs. Arguments as in refine_HCW.
+  OUTPUT : (times, VolWaterHighConc, bound) as in refine_HCW'''
+  for times, VolWaterHighConc, bound, sampled in refine_HCW(Tr,MaskC,rA,hFacC,drF,nzlim=nzlim,yin=yin,xin=xin,
+                                                            xfin=xfin,zfin=zfin,xi=xi,yi=yi,trlim=trlim,
+                                                            fractions=(fraction,),tstep=tstep,stratum=stratum,
+                                                            strided=strided,z=z,seed=seed):
+    return (times,VolWaterHighConc,bound)
+
+
+def approx_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=227,zfin=29,fraction=0.1,tstep=1,stratum=256,strided=False,z=1.96,
+                         seed=None):
+  '''Approximate calc_TrMassonShelf from a sample of fraction of the wet cells and of every tstep-th time output.
+  Arguments as in refine_TrMassonShelf.
+  OUTPUT : (times, Total_Tracer, bound) as in refine_HCW'''
+  for times, Total_Tracer, bound, sampled in refine_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=yin,zfin=zfin,
+                                                                  fractions=(fraction,),tstep=tstep,stratum=stratum,
+                                                                  strided=strided,z=z,seed=seed):
+    return (times,Total_Tracer,bound)
 
 
 #----------------------------------------------------------------------------------------------------------------------------
@@ -511,7 +824,7 @@ def slice_area(dx,dr,rA,hFacC,i1,i2,j1,j2,k1,k2):
 def Volume_Sh_and_Hole(MaskC,rA,hFacC,drF,yin,zfin,xh1=120,xh2=240,yh1=227,yh2=267):
   '''
     INPUT----------------------------------------------------------------------------------------------------------------
-    MaskC : Land mask for tracer
+    MaskC : Land mask for tracer (boolean mask, PackedMask or WetIndex from readout_tools)
      rA    : Area of cell faces at C points (360x360)
     fFacC : Fraction of open cell (90x360x360)
     drF   : Distance between cell faces (90)
@@ -526,6 +839,10 @@ def Volume_Sh_and_Hole(MaskC,rA,hFacC,drF,yin,zfin,xh1=120,xh2=240,yh1=227,yh2=2
     Canyon box volume and Shelf with hole volume                                           
     -----------------------------------------------------------------------------------------------------------------------
   '''
+  if rout.isLazy(hFacC):
+    Total_Vol_Hole = np.sum(_lazyCellVol(rA,hFacC,drF,zfin,slice(yh1,yh2),slice(xh1,xh2)))
+    return (np.sum(_lazyCellVol(rA,hFacC,drF,zfin,slice(yin,None),slice(None)))-Total_Vol_Hole,Total_Vol_Hole)
+  
    
   rA_exp = np.expand_dims(rA[yin:,:],0)
   rA_exp_hole = np.expand_dims(rA[yh1:yh2,xh1:xh2],0)
@@ -576,8 +893,15 @@ def maskHC(targetConc,tracer,i1,i2,j1,j2,k1,k2,t1,t2):
   else:
     sl = tracer[t1:t2,k1:k2,j1:j2,i1:i2]
   
-  slice_masked = np.ma.masked_less(sl, targetConc) 
-  slice_Mask = slice_masked.mask
+  slice_Mask = None
+  if np.ndim(tracer) == 4: # Numba kernel on the slice with the dropped axis put back, if available
+    axis = [ax for ax, same in zip([3,2,1,0],[i1==i2,j1==j2,k1==k2,t1==t2]) if same][:1]
+    slice_Mask = kt.lessThan(np.expand_dims(sl,axis) if axis else sl, targetConc)
+  if slice_Mask is not None:
+    slice_Mask = slice_Mask.reshape(np.shape(sl))
+  else:
+    slice_masked = np.ma.masked_less(sl, targetConc) 
+    slice_Mask = slice_masked.mask
   
   return slice_Mask
   
@@ -0,0 +1,244 @@
+# PipelineTools - Compute several metrics of a run reading every variable once.
+#
+# Usage from the command line:
+#   canyon-metrics /path/to/experiment/run01 --metrics HCW TrMass SBTransport --set nzlim=29 yin=227
+#   python -m canyon_tools.pipeline_tools /path/to/experiment/run01 --metrics HCW --store metrics.nc --experiment BARKLEY
+
+import argparse
+
+import contextlib
+
+import os
+
+import sys
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+import canyon_tools.metrics_tools as mtt
+
+import canyon_tools.readout_tools as rout
+
+import canyon_tools.section_tools as sct
+
+import canyon_tools.shelfbreak_tools as sbt
+
+import canyon_tools.stream_tools as stt
+
+# Default parameters, the same as the defaults of the metrics_tools functions
+DEFAULTS = {'tracer':'Tr1', 'nzlim':29, 'yin':227, 'xin':120, 'xfin':359, 'zfin':29, 'xi':180, 'yi':50,
+            'zlev':29, 'xh1':120, 'xh2':240, 'yh1':227, 'yh2':267,
+            'fluxFile':'FluxTR01Glob.nc', 'keyU':'UTRAC01', 'keyV':'VTRAC01', 'keyW':'WTRAC01', 'keySBFlux':'V'}
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Metrics. Each one declares the variables it needs, as (file, variable) pairs, and computes per-record results from a
+# block of time records of those variables. Files are 'state', 'ptracers' or 'flux'.
+
+def _needsTracer(p):
+    return [('ptracers',p['tracer'])]
+
+def _HCW(fields,grid,p):
+    Tr = fields[('ptracers',p['tracer'])]
+    return {'HCW':mtt.calc_HCW(Tr,grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],nzlim=p['nzlim'],yin=p['yin'],
+                               xin=p['xin'],xfin=p['xfin'],zfin=p['zfin'],xi=p['xi'],yi=p['yi'],trlim=p['trlim'],
+                               cells=grid['cellsHCW'])}
+
+def _TrMass(fields,grid,p):
+    Tr = fields[('ptracers',p['tracer'])]
+    return {'TrMass':mtt.calc_TrMassonShelf(Tr,grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],yin=p['yin'],
+                                            zfin=p['zfin'],cells=grid['cellsShelf'])}
+
+def _ShwHole(fields,grid,p):
+    Tr = fields[('ptracers',p['tracer'])]
+    HCW, TrMass, HCWHole, TrMassHole = mtt.howMuchWaterShwHole(Tr,grid['MaskC'],p['nzlim'],grid['rA'],grid['hFacC'],
+                                                               grid['drF'],p['yin'],p['zfin'],p['xi'],p['yi'],
+                                                               xh1=p['xh1'],xh2=p['xh2'],yh1=p['yh1'],yh2=p['yh2'],
+                                                               trlim=p['trlim'],
+                                                               cells=(grid['cellsShelf'],grid['cellsHole']))
+    return {'HCWShwHole':HCW, 'TrMassShwHole':TrMass, 'HCWHole':HCWHole, 'TrMassHole':TrMassHole}
+
+def _needsSB(p):
+    return [('state',p['keySBFlux'])]
+
+def _SBTransport(fields,grid,p):
+    Flux = fields[('state',p['keySBFlux'])]
+    Total, PerDepth, PerX = sbt.SBTransport(Flux,grid['hFacC'],grid['drF'],grid['dxF'],p['zlev'],Mask=grid['MaskC'],
+                                            wall=grid['SBWall'])
+    return {'SBTransport':Total}
+
+def _needsBudget(p):
+    return [('flux',p['keyU']),('flux',p['keyV']),('flux',p['keyW']),('ptracers',p['tracer'])]
+
+def _Budget(fields,grid,p):
+    box = grid['box'] # fluxes at the faces of the box, on the staggered grid
+    Flux, Net, Mass, dMdt = box.budget(fields[('flux',p['keyU'])],fields[('flux',p['keyV'])],fields[('flux',p['keyW'])],
+                                       fields[('ptracers',p['tracer'])],1.0)
+    return {'BoxNet':Net, 'BoxMass':Mass}
+
+METRICS = {'HCW':(_needsTracer,_HCW),
+           'TrMass':(_needsTracer,_TrMass),
+           'ShwHole':(_needsTracer,_ShwHole),
+           'SBTransport':(_needsSB,_SBTransport),
+           'Budget':(_needsBudget,_Budget)}
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def planRun(metrics,params=None):
+    '''Variables needed by a list of metrics. Returns a dictionary {file:[variables]} with every variable once.'''
+    p = dict(DEFAULTS,**(params or {}))
+    plan = {}
+    for metric in metrics:
+        if metric not in METRICS:
+            raise ValueError('unknown metric %s, choose from %s' % (metric,sorted(METRICS)))
+        for fileKey, varName in METRICS[metric][0](p):
+            if varName not in plan.setdefault(fileKey,[]):
+                plan[fileKey].append(varName)
+    return plan
+
+
+def _close(FileOut):
+    with stt.NCLOCK:
+        FileOut.close()
+
+
+def _files(runDir,p):
+    return {'grid':os.path.join(runDir,'gridGlob.nc'),
+            'state':os.path.join(runDir,'stateGlob.nc'),
+            'ptracers':os.path.join(runDir,'ptracersGlob.nc'),
+            'flux':os.path.join(runDir,p['fluxFile'])}
+
+
+def runParams(runDir,metrics,params=None):
+    '''Parameters runPipeline uses for metrics: DEFAULTS changed by params, plus the threshold concentration 'trlim'
+    of the first time output of the run (unless params gives it) when a metric reads the tracer. Use them to label
+    the results, e.g. in a metrics store.'''
+    p = dict(DEFAULTS,**(params or {}))
+    plan = planRun(metrics,p)
+    if 'ptracers' in plan and 'trlim' not in p:
+        with stt.NCLOCK:
+            PtracersOut = Dataset(_files(runDir,p)['ptracers'])
+            p['trlim'] = float(PtracersOut.variables[p['tracer']][0,p['nzlim'],p['yi'],p['xi']])
+            PtracersOut.close()
+    return p
+
+
+def runPipeline(runDir,metrics,params=None,nrec=1,depth=2):
+    '''Compute several metrics of one run. The required variables are planned first (planRun), then every variable is
+    read once, nrec time records at a time, and every block is fed to all the metrics that need it.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    runDir  : string with /path/to/run folder with gridGlob.nc, stateGlob.nc, ptracersGlob.nc and the flux file
+    metrics : list of metric names, keys of METRICS: 'HCW', 'TrMass', 'ShwHole', 'SBTransport', 'Budget'
+    params  : dictionary to change DEFAULTS (indices, tracer and flux names, and 'trlim' to use another threshold
+              concentration than that of the first time output)
+    nrec    : number of time records read at once. Memory use is nrec 3D fields per variable.
+    depth   : blocks read ahead in a background thread (see stream_tools.prefetch), 0 to read in the calling thread.
+              Memory use is then (depth+1)*nrec 3D fields per variable.
+
+    OUTPUT
+    results : dictionary {name:array (nt)}. 'Budget' gives 'BoxNet' and 'BoxMass' of the box xh1:xh2, yh1:yh2, 0:zfin
+              and 'BoxdMdt', the storage change per second.
+    '''
+    p = runParams(runDir,metrics,params)
+    files = _files(runDir,p)
+    plan = planRun(metrics,p)
+
+    grid = {}
+    GridOut = Dataset(files['grid'])
+    for name, ncName in [('hFacC','HFacC'),('rA','rA'),('drF','drF'),('dxF','dxF'),('dyF','dyF')]:
+        grid[name] = np.ma.getdata(GridOut.variables[ncName][:])
+    if 'Budget' in metrics:
+        for name, ncName in [('hFacW','HFacW'),('hFacS','HFacS'),('dxG','dxG'),('dyG','dyG')]:
+            grid[name] = np.ma.getdata(GridOut.variables[ncName][:])
+    GridOut.close()
+    grid['MaskC'] = rout.WetIndex(grid['hFacC'])
+    if 'HCW' in metrics: # wet cells of the boxes, found once for all the blocks
+        grid['cellsHCW'] = mtt.wetVolume(grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],p['zfin'],
+                                         slice(p['yin'],None),slice(p['xin'],p['xfin']))
+    if 'TrMass' in metrics or 'ShwHole' in metrics:
+        grid['cellsShelf'] = mtt.wetVolume(grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],p['zfin'],
+                                           slice(p['yin'],None))
+    if 'ShwHole' in metrics:
+        grid['cellsHole'] = mtt.wetVolume(grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],p['zfin'],
+                                          slice(p['yh1'],p['yh2']),slice(p['xh1'],p['xh2']))
+    if 'SBTransport' in metrics:
+        grid['SBWall'] = sbt.SBWallArea(grid['hFacC'],grid['drF'],grid['dxF'],p['zlev'])
+    if 'Budget' in metrics:
+        grid['box'] = sct.BoxBudget(p['xh1'],p['xh2'],p['yh1'],p['yh2'],0,p['zfin'],grid['dxG'],grid['dyG'],
+                                    grid['drF'],grid['rA'],grid['hFacC'],grid['hFacW'],grid['hFacS'])
+
+    with contextlib.ExitStack() as stack: # files closed (after the prefetch thread stops) also if a metric fails
+        FilesOut = {}
+        for fileKey in plan:
+            with stt.NCLOCK:
+                FilesOut[fileKey] = Dataset(files[fileKey])
+            stack.callback(_close,FilesOut[fileKey])
+        nt = min(FilesOut[fileKey].variables[varName].shape[0] for fileKey in plan for varName in plan[fileKey])
+
+        def blocks():
+            for t0 in range(0,nt,nrec):
+                t1 = min(t0+nrec,nt)
+                fields = {}
+                for fileKey in plan:
+                    for varName in plan[fileKey]:
+                        with stt.NCLOCK: # netCDF is not thread-safe, see stream_tools
+                            fields[(fileKey,varName)] = FilesOut[fileKey].variables[varName][t0:t1]
+                yield fields
+
+        records = stt.prefetch(blocks(),depth=depth) # the next block is read while the metrics run
+        stack.callback(records.close)
+        results = {}
+        for fields in records:
+            for metric in metrics:
+                for name, value in METRICS[metric][1](fields,grid,p).items():
+                    results.setdefault(name,[]).append(np.ma.filled(np.ma.asarray(value,dtype=float),np.nan))
+
+    results = {name:np.concatenate(value) for name, value in results.items()}
+    if 'Budget' in metrics:
+        PtracersOut = Dataset(files['ptracers'])
+        results['BoxdMdt'] = np.diff(results['BoxMass'])/np.diff(PtracersOut.variables['T'][:nt])
+        PtracersOut.close()
+    return results
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _value(text):
+    for kind in (int,float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def main(argv=None):
+    '''Command line entry point, see the top of this file.'''
+    parser = argparse.ArgumentParser(description='Compute canyon metrics of a run reading every variable once.')
+    parser.add_argument('runDir',help='run folder with gridGlob.nc, stateGlob.nc, ptracersGlob.nc')
+    parser.add_argument('--metrics',nargs='+',default=['HCW','TrMass'],choices=sorted(METRICS))
+    parser.add_argument('--set',nargs='*',default=[],metavar='NAME=VALUE',help='change parameters, e.g. nzlim=29')
+    parser.add_argument('--nrec',type=int,default=1,help='time records read at once')
+    parser.add_argument('--store',help='metrics store file (store_tools) to write the results to')
+    parser.add_argument('--experiment',help='experiment name in the store. Default is the parent folder name.')
+    args = parser.parse_args(argv)
+
+    params = dict(item.split('=',1) for item in args.set)
+    params = {name:_value(value) for name, value in params.items()}
+    with contextlib.redirect_stdout(sys.stderr): # messages of the metrics (e.g. the tracer limit) are not results
+        params = runParams(args.runDir,args.metrics,params) # the parameters actually used label the stored results
+        results = runPipeline(args.runDir,args.metrics,params=params,nrec=args.nrec)
+
+    runDir = os.path.abspath(args.runDir)
+    if args.store:
+        import canyon_tools.store_tools as sto
+        experiment = args.experiment or os.path.basename(os.path.dirname(runDir))
+        for name, values in results.items():
+            sto.writeMetrics(args.store,experiment,name,[os.path.basename(runDir)],[values],params=params)
+    else:
+        for name, values in results.items():
+            print(name,' '.join('%.6g' % val for val in values))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# PlotTools - Plots of shelf break wall fields. Kept apart from the numerical tools so that these do not need matplotlib.
+
+import matplotlib.pyplot as plt
+
+import numpy as np
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def contourfFluxSB(time,numCols,numRows,FluxPlot,z,x,units, nzmin,nzmax,kk,zlev):
+    ''' Contourf plot of flux across shelf break wall' 
+     -------------------------------------------------------------------------------------------------------------------
+     INPUT:  time - timeslice at what we want to plot (integer, usually between 0 and 18)
+            numCols, numRows - integers indicating, respectively, the number of columns and rows to arrange the subplots into.
+             Flux - array with across shelf break flux data (nz,nx)
+                z - 1D array with z-level depth data
+                x - alongshore coordinates (2D)
+            nzmin - integer indicating index of lower depth (z) to plot. Remember z goes form 0 to -2000 m. 
+            nzmax - integer indicating index of upper depth (z) to plot. Remember z goes form 0 to -2000 m. 
+            units - string with units for colorbar. E.g. units = '$molC\ m^{-1}\cdot m^3s^{-1}$' 
+               kk - Integer inidcating the number of subplot 
+             zlev - vertical level at which to get the shelf break indices
+    OUTPUT : Nice contourf subplot
+    ----------------------------------------------------------------------------------------------------------------------
+    '''
+    sizes = np.shape(FluxPlot)
+    nx = sizes[1]
+    
+    plt.subplot(numRows,numCols,kk)
+    ax = plt.gca()
+
+    ax.set_facecolor((205/255.0, 201/255.0, 201/255.0))
+    plt.contourf(x[1,4:360-5],z[nzmin:nzmax],FluxPlot[nzmin:nzmax,:],cmap = "RdYlBu_r")
+    
+
+    if abs(np.max(FluxPlot)) >= abs(np.min(FluxPlot)):
+        plt.clim([-np.max(FluxPlot),np.max(FluxPlot)])
+    else:
+        plt.clim([np.min(FluxPlot),-np.min(FluxPlot)])
+    
+    
+    plt.axvline(x=x[1,120],linestyle='-', color='0.75')
+    plt.axvline(x=x[1,240],linestyle='-', color='0.75')
+    
+    plt.xlabel('Along-shelfbreak index')
+        
+    plt.ylabel('m')
+
+    cb = plt.colorbar()
+
+    cb.set_label(units,position=(1, 0),rotation=0)
+
+    plt.title(" %1.1f days " % ((time/2.)+0.5))
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    
+def pcolorFluxSB(time,numCols,numRows,FluxPlot,z,x,units, nzmin,nzmax,kk,zlev):
+    ''' pcolor plot of flux across shelf break wall' 
+     -------------------------------------------------------------------------------------------------------------------
+    INPUT:  time - timeslice at what we want to plot (integer, usually between 0 and 18)
+            numCols, numRows - integers indicating, respectively, the number of columns and rows to arrange the subplots into.
+             Flux - array with across shelf break flux data (nz,nx)
+                z - 1D array with z-level depth data
+                x - alongshore coordinates (2D)
+            nzmin - integer indicating index of lower depth (z) to plot. Remember z goes form 0 to -2000 m. 
+            nzmax - integer indicating index of upper depth (z) to plot. Remember z goes form 0 to -2000 m. 
+            units - string with units for colorbar. E.g. units = '$molC\ m^{-1}\cdot m^3s^{-1}$' 
+               kk - Integer inidcating the number of subplot 
+             zlev - vertical level at which to get the shelf break indices
+    OUTPUT : Nice pcolor subplot
+    ----------------------------------------------------------------------------------------------------------------------
+    '''
+    sizes = np.shape(FluxPlot)
+    nx = sizes[1]
+    
+    plt.subplot(numRows,numCols,kk)
+    ax = plt.gca()
+
+    ax.set_facecolor((205/255.0, 201/255.0, 201/255.0))
+    plt.pcolor(x[1,4:360-5],z[nzmin:nzmax],FluxPlot[nzmin:nzmax,:],cmap = "RdYlBu_r")
+
+    if abs(np.max(FluxPlot)) >= abs(np.min(FluxPlot)):
+        plt.clim([-np.max(FluxPlot),np.max(FluxPlot)])
+    else:
+        plt.clim([np.min(FluxPlot),-np.min(FluxPlot)])
+    
+    plt.axvline(x=x[1,120],linestyle='-', color='0.75')
+    plt.axvline(x=x[1,240],linestyle='-', color='0.75')
+    
+   
+    plt.ylabel('m')
+
+    cb = plt.colorbar()
+
+    cb.set_label(units,position=(1, 0),rotation=0)
+
+    plt.title(" %1.1f days " % ((time/2.)+0.5))
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _renderFrames(job):
+    '''Render a contiguous block of frames in one figure. The figure, axes, colorbar and mesh are created once and only
+    the data and title change between frames. Uses the Agg canvas directly, so no display or pyplot state is needed.'''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    frames, times, xs, z, units, clim, lines, outPattern, figsize, dpi = job
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1,1,1)
+    ax.set_facecolor((205/255.0, 201/255.0, 201/255.0))
+    mesh = ax.pcolormesh(xs,z,frames[0],cmap = "RdYlBu_r",shading='nearest',vmin=clim[0],vmax=clim[1])
+    for xline in lines:
+        ax.axvline(x=xline,linestyle='-', color='0.75')
+    ax.set_xlabel('Along-shelfbreak distance')
+    ax.set_ylabel('m')
+    cb = fig.colorbar(mesh,ax=ax)
+    cb.set_label(units,position=(1, 0),rotation=0)
+    title = ax.set_title('')
+
+    files = []
+    for frame, time in zip(frames,times):
+        mesh.set_array(np.ma.ravel(frame))
+        title.set_text(" %1.1f days " % ((time/2.)+0.5))
+        fig.savefig(outPattern % time,dpi=dpi)
+        files.append(outPattern % time)
+    return files
+
+
+def renderFluxFrames(FluxFrames,z,xs,units,outPattern,nzmin=0,nzmax=None,times=None,clim=None,lines=(),nproc=1,
+                     figsize=(8,4),dpi=100):
+    '''Batch pcolor plots of flux across the shelf break wall, one image file per time output, e.g. to make an animation.
+    Frames are split in nproc contiguous blocks rendered in parallel; every process draws its figure once and then only
+    updates the data (set_array) and the title.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT:  FluxFrames - array with across shelf break flux data (nt,nz,nx), e.g. output of MerFluxSB stacked in time
+                     z - 1D array with z-level depth data (nz)
+                    xs - 1D array with alongshore coordinates of the shelf break points (nx)
+                 units - string with units for colorbar. E.g. units = '$molC\ m^{-1}\cdot m^3s^{-1}$'
+            outPattern - string with the file name of frame number time, e.g. 'frames/run01_flux_%03d.png'
+          nzmin, nzmax - indices of the depth range to plot. Default is all levels.
+                 times - time output index of every frame, used for titles and file names. Default is 0,1,2,...
+                  clim - color limits (min,max). Default is symmetric about zero and the same for all frames.
+                 lines - alongshore positions of vertical lines, e.g. (x[1,120],x[1,240]) for the canyon edges
+                 nproc - number of processes
+    OUTPUT : list with the names of the files written
+    ----------------------------------------------------------------------------------------------------------------------
+    '''
+    frames = np.ma.asarray(FluxFrames)[:,nzmin:nzmax,:]
+    if times is None:
+        times = np.arange(frames.shape[0])
+    if clim is None:
+        fmax = np.max(np.abs(frames))
+        clim = (-fmax,fmax)
+
+    blocks = np.array_split(np.arange(frames.shape[0]),max(1,min(nproc,frames.shape[0])))
+    jobs = [(frames[block],np.asarray(times)[block],np.asarray(xs),np.asarray(z)[nzmin:nzmax],units,clim,lines,
+             outPattern,figsize,dpi) for block in blocks if len(block) > 0]
+
+    if nproc > 1:
+        import multiprocessing
+        with multiprocessing.Pool(len(jobs)) as pool:
+            blockFiles = pool.map(_renderFrames,jobs)
+    else:
+        blockFiles = [_renderFrames(job) for job in jobs]
+    return [name for files in blockFiles for name in files]
@@ -2,7 +2,7 @@
 
 from netCDF4 import Dataset
 
-import matplotlib.pyplot as plt
+import sys
 
 import numpy as np
 
@@ -39,7 +39,7 @@ def getField(statefile, fieldname):
         
         print (' Check size of field ')
     
-def unstagger(ugrid, vgrid):
+def unstagger(ugrid, vgrid, out=None):
     """ Interpolate u and v component values to values at grid cell centres (from D.Latornell for NEMO output).
 
     The shapes of the returned arrays are 1 less than those of
@@ -51,19 +51,100 @@ def unstagger(ugrid, vgrid):
     :arg vgrid: v velocity component values with axes (..., y, x)
     :type vgrid: :py:class:`numpy.ndarray`
 
+    :arg out: optional (u, v) arrays with the output shapes to write the results in,
+              so no new arrays are allocated
+
     :returns u, v: u and v component values at grid cell centres
     :rtype: 2-tuple of :py:class:`numpy.ndarray`
     """
+    if out is not None:
+        return (Unstaggered(ugrid, axis=-1).compute(out=out[0]),
+                Unstaggered(vgrid, axis=-2).compute(out=out[1]))
     u = np.add(ugrid[..., :-1], ugrid[..., 1:]) / 2
     v = np.add(vgrid[..., :-1, :], vgrid[..., 1:, :]) / 2
     return u, v
 
 
-def getMask(GridFile, CellType):
+class Unstaggered:
+    ''' Lazy cell-centre view of a staggered field, (F[i]+F[i+1])/2 along axis, as in unstagger. Nothing is computed
+    until it is indexed, and then only for the requested cells, reading only the two neighbouring faces of each. E.g.
+        V = Unstaggered(StateOut.variables['V'], axis=-2)
+        V[5,:,227,120:240]   # one transect of one time output, reads V[5,:,227:229,120:240] only
+    field : staggered array (..., y, x), a numpy array or a netCDF4 Variable
+    axis  : staggered axis, -1 for x (u points) or -2 for y (v points)'''
+
+    def __init__(self, field, axis=-2):
+        self.field = field
+        self.axis = axis % len(np.shape(field))
+        shape = list(np.shape(field))
+        shape[self.axis] = shape[self.axis]-1
+        self.shape = tuple(shape)
+        self.ndim = len(shape)
+        self.dtype = field.dtype
+
+    def _key(self, key):
+        ''' Index tuple with one entry per dimension.'''
+        if not isinstance(key, tuple):
+            key = (key,)
+        ells = [nel for nel, item in enumerate(key) if item is Ellipsis]
+        if ells:
+            nel = ells[0]
+            key = key[:nel] + (slice(None),)*(self.ndim-len(key)+1) + key[nel+1:]
+        return key + (slice(None),)*(self.ndim-len(key))
+
+    def __getitem__(self, key):
+        key = list(self._key(key))
+        idx = key[self.axis]
+        n = self.shape[self.axis]
+        if isinstance(idx, slice) and idx.indices(n)[2] == 1 and \
+           all(isinstance(other, (slice, int, np.integer)) for other in key):
+            # one read of the faces start:stop+1, averaged with the next face
+            start, stop, step = idx.indices(n)
+            stop = max(stop, start)
+            key[self.axis] = slice(start, stop+1)
+            faces = self.field[tuple(key)]
+            ax = sum(1 for other in key[:self.axis] if isinstance(other, slice))
+            lo = [slice(None)]*np.ndim(faces)
+            hi = [slice(None)]*np.ndim(faces)
+            lo[ax] = slice(None, -1)
+            hi[ax] = slice(1, None)
+            return np.add(faces[tuple(lo)], faces[tuple(hi)]) / 2
+        if isinstance(idx, slice):
+            idx = np.arange(*idx.indices(n))
+        idx = np.asarray(idx) if np.ndim(idx) else int(idx)
+        if np.any(idx >= n) or np.any(idx < -n):
+            raise IndexError('index out of bounds for axis %d with size %d' % (self.axis, n))
+        idx = np.where(idx < 0, idx+n, idx) if np.ndim(idx) else (idx+n if idx < 0 else idx)
+        key[self.axis] = idx
+        lo = self.field[tuple(key)]
+        key[self.axis] = idx+1
+        return np.add(lo, self.field[tuple(key)]) / 2
+
+    def compute(self, out=None):
+        ''' Whole unstaggered field. If out (array with self.shape) is given, the result is written there without
+        temporary arrays (masks of masked input are not kept in out).'''
+        lo = [slice(None)]*self.ndim
+        hi = [slice(None)]*self.ndim
+        lo[self.axis] = slice(None, -1)
+        hi[self.axis] = slice(1, None)
+        field = self.field[...] if out is None else np.ma.getdata(self.field[...])
+        if out is None:
+            return np.add(field[tuple(lo)], field[tuple(hi)]) / 2
+        np.add(field[tuple(lo)], field[tuple(hi)], out=out)
+        np.multiply(out, 0.5, out=out)
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        fld = np.asarray(self.compute())
+        return fld if dtype is None else fld.astype(dtype)
+
+
+def getMask(GridFile, CellType, packed=False):
     ''' Get cell-center, u-cell or v-cell mask
      gridfile: string containing NC grid filename
      CellType: String with HFac field name. It can be 'HFacC' for cell-center, 'HFacW' for open-side cell
-     or 'HFacS' for other cell ?'''
+     or 'HFacS' for other cell ?
+     packed: If True, return a bit-packed PackedMask instead of a boolean array (1 bit per cell instead of 1 byte)'''
   
     hFac = getField(GridFile,CellType) 
 
@@ -71,8 +152,120 @@ def getMask(GridFile, CellType):
 
     MASKhFac = np.ma.getmask(hFacmasked)
     
+    if packed:
+        return PackedMask(np.ma.getmaskarray(hFacmasked))
+    
     return MASKhFac
 
+def getWetIndex(GridFile, CellType):
+    ''' Get the wet cells (runs of levels per column) of the cell-center, u-cell or v-cell grid as a WetIndex.
+     gridfile: string containing NC grid filename
+     CellType: String with HFac field name ('HFacC', 'HFacW' or 'HFacS')'''
+    
+    return WetIndex(getField(GridFile,CellType))
+
+class PackedMask:
+    ''' Bit-packed land mask (True on land), 1 bit per cell. It can be used in place of the boolean mask from getMask
+    in the metrics_tools and shelfbreak_tools functions.
+    :mask : boolean land mask (nz,ny,nx)'''
+    
+    def __init__(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        self.shape = mask.shape
+        self.bits = np.packbits(mask, axis=None)
+        
+    def unpack(self):
+        ''' Boolean land mask (nz,ny,nx)'''
+        return np.unpackbits(self.bits, count=int(np.prod(self.shape))).astype(bool).reshape(self.shape)
+    
+    def columns(self, jj, ii):
+        ''' Land mask of the water columns (jj,ii), i.e. mask[:,jj,ii], read straight from the bits.'''
+        nz, ny, nx = self.shape
+        flat = (np.arange(nz)[:,None]*ny + np.asarray(jj)[None,:])*nx + np.asarray(ii)[None,:]
+        return ((self.bits[flat >> 3] >> (7 - (flat & 7))) & 1).astype(bool)
+
+class WetIndex:
+    ''' Wet cells (hFac > 0) of a 3D grid as runs of levels per water column: the wet cells of column (j,i) are the
+    levels top[j,i] to bottom[j,i]-1, plus the runs in extra for the few columns with more than one run (e.g. under
+    an overhang). That is 2 bytes per column for nz < 256, less than a PackedMask. Metrics given a WetIndex instead of
+    a land mask only visit wet cells.
+    :hFac : open cell fraction (nz,ny,nx), e.g. HFacC'''
+    
+    def __init__(self, hFac):
+        wet = np.asarray(hFac) > 0
+        self.shape = wet.shape
+        nz, ny, nx = wet.shape
+        edges = np.diff(np.concatenate([np.zeros((1,ny,nx), np.int8), wet.astype(np.int8), np.zeros((1,ny,nx), np.int8)]),
+                        axis=0)
+        runs = []
+        for edge in (1, -1): # starts and ends of the runs, sorted by column and level so that they pair up
+            kk, jj, ii = np.nonzero(edges == edge)
+            col = jj*nx + ii
+            order = np.lexsort((kk, col))
+            runs.append((col[order], kk[order]))
+        (col, start), (col, stop) = runs
+        first = np.ones(len(col), dtype=bool)
+        first[1:] = col[1:] != col[:-1]
+        dtype = np.uint8 if nz < 2**8 else np.int16 if nz < 2**15 else np.int32
+        self.top = np.zeros((ny,nx), dtype)
+        self.bottom = np.zeros((ny,nx), dtype)
+        self.top.flat[col[first]] = start[first]
+        self.bottom.flat[col[first]] = stop[first]
+        self.extra = np.stack([col[~first], start[~first], stop[~first]], axis=1).astype(np.int64)
+    
+    def _wet(self, k, top, bottom, cols):
+        ''' Wet cells of the levels k (column vector) in the columns with flat indices cols, whose runs are top:bottom'''
+        wet = (k >= top) & (k < bottom)
+        for col, start, stop in self.extra:
+            wet |= (k >= start) & (k < stop) & (cols == col)
+        return wet
+    
+    def unpack(self):
+        ''' Boolean land mask (nz,ny,nx)'''
+        nz, ny, nx = self.shape
+        cols = np.arange(ny*nx).reshape(ny, nx)
+        return ~self._wet(np.arange(nz)[:,None,None], self.top, self.bottom, cols)
+    
+    def columns(self, jj, ii):
+        ''' Land mask of the water columns (jj,ii), i.e. mask[:,jj,ii]'''
+        nz, ny, nx = self.shape
+        jj, ii = np.asarray(jj), np.asarray(ii)
+        return ~self._wet(np.arange(nz)[:,None], self.top[jj,ii], self.bottom[jj,ii], jj*nx + ii)
+    
+    def cells(self, box):
+        ''' Indices (kk,jj,ii) of the wet cells inside box, a tuple of three slices (k,j,i)'''
+        nz, ny, nx = self.shape
+        (k1, k2, ks), (j1, j2, js), (i1, i2, iss) = [sl.indices(n) for sl, n in zip(box, self.shape)]
+        cols = np.arange(j1, j2)[:,None]*nx + np.arange(i1, i2)[None,:]
+        wet = self._wet(np.arange(k1, k2)[:,None,None], self.top[j1:j2,i1:i2], self.bottom[j1:j2,i1:i2], cols)
+        kk, jj, ii = np.nonzero(wet)
+        return (kk+k1, jj+j1, ii+i1)
+
+def landMask(Mask, shape=None):
+    ''' Boolean land mask from the output of getMask, a PackedMask or a WetIndex. shape is used to expand a scalar mask
+    (np.ma.nomask when there is no land).'''
+    if hasattr(Mask, 'unpack'):
+        return Mask.unpack()
+    Mask = np.asarray(Mask, dtype=bool)
+    if shape is not None:
+        Mask = np.broadcast_to(Mask, shape)
+    return Mask
+
+def maskColumns(Mask, jj, ii):
+    ''' Land mask of the water columns (jj,ii), Mask[:,jj,ii], for a boolean mask, a PackedMask or a WetIndex'''
+    if hasattr(Mask, 'columns'):
+        return Mask.columns(jj, ii)
+    return np.asarray(Mask, dtype=bool)[:,jj,ii]
+
+def wetCells(Mask, box, shape):
+    ''' Indices (kk,jj,ii) of the wet cells inside box, a tuple of three slices (k,j,i), for a boolean mask, a PackedMask 
+    or a WetIndex. shape is the (nz,ny,nx) shape of the grid.'''
+    if isinstance(Mask, WetIndex):
+        return Mask.cells(box)
+    kk, jj, ii = np.nonzero(~landMask(Mask, shape)[box])
+    offsets = [sl.indices(n)[0] for sl, n in zip(box, shape)]
+    return (kk+offsets[0], jj+offsets[1], ii+offsets[2])
+
 def calc_sigmaHor(RhoRef,T,S, At = 2.0E-4, Bs = 7.4E-4):
     '''Calculate sigma as sigma = sigma0 + (RhoRef[Bs(S-S0) - At(T-T0)]) with sigma0 = 0, T0 = 0 and S0 = 0.
        RhoRef: Reference salinity at model layer nz, matching z of T and S.
@@ -101,3 +294,20 @@ def calc_sigmaVer(RhoRef,T,S, At = 2.0E-4, Bs = 7.4E-4):
     sigma = RhoRef*(Bs*S - At*T)
     return sigma
     
+def isLazy(fld):
+    ''' True if fld is a chunked (dask) array or an xarray DataArray backed by one, i.e. the output
+    of getDatasets(...,lazy=True). Metrics given lazy arrays build a task graph instead of loading data.
+    Other chunked objects (h5py datasets, netCDF4 variables) are not lazy. dask is not imported here: if it was
+    never imported, fld cannot be a dask array.'''
+    if 'dask.array' not in sys.modules:
+        return False
+    data = getattr(fld, 'data', fld) if hasattr(fld, 'dims') else fld # DataArray; h5py datasets also have dims
+    return isinstance(data, sys.modules['dask.array'].Array)
+
+def asDask(fld):
+    ''' Return the dask array behind fld. fld can be a dask array or a chunked xarray DataArray.
+    Positional indexing is used everywhere in canyon_tools, so the xarray coordinates are dropped here.'''
+    if hasattr(fld, 'dims'):
+        return fld.data
+    return fld
+    
@@ -0,0 +1,336 @@
+# SectionTools - Transport through arbitrary sections (polylines of grid cells) of MITgcm output.
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+import canyon_tools.grid_tools as gt
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _staircase(i0,j0,i1,j1):
+    '''Unit steps (di,dj) of the staircase of cells that follows the straight line from cell (i0,j0) to cell (i1,j1)
+    most closely. There are abs(i1-i0)+abs(j1-j0) steps.'''
+    di = i1-i0
+    dj = j1-j0
+    si = int(np.sign(di))
+    sj = int(np.sign(dj))
+
+    steps = []
+    ii, jj = i0, j0
+    while (ii,jj) != (i1,j1):
+        errX = abs((ii+si-i0)*dj - (jj-j0)*di) # distance to the line (times its length) after a step in x
+        errY = abs((ii-i0)*dj - (jj+sj-j0)*di) # same after a step in y
+        if ii != i1 and (jj == j1 or errX <= errY):
+            steps.append((si,0))
+            ii = ii+si
+        else:
+            steps.append((0,sj))
+            jj = jj+sj
+    return steps
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+class Section:
+    '''Section through the grid defined by a polyline of cell-center indices. The polyline is turned into a staircase of
+    cells and the face of every step is precomputed once: along-x steps use the meridional flux (VTRAC) and along-y steps
+    the zonal flux (UTRAC), both at cell centers like the output of get_TRAC, and face areas are computed as in slice_area.
+    A step from cell a to cell b uses the cell with the smaller index of the two, so the section [(i1,j),(i2,j)] gives
+    the same cells as slice_TRAC(field,i1,i2,j,j,...).
+
+    Transport is positive to the left of the direction of travel: northward flow is positive across a section drawn
+    towards +x, eastward flow across a section drawn towards -y. A closed polyline drawn counter-clockwise gives
+    positive transport into the enclosed area.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    ii, jj : x and y indices of the polyline vertices (sequences of integers, same length, at least 2 points)
+    dx     : x cell separation (dxF or dxG, 2D), used for faces of along-x steps
+    dy     : y cell separation (dyF or dyG, 2D), used for faces of along-y steps
+    drF    : distance between cell faces (1D)
+    hFacC  : fraction of open cell (nz,ny,nx)
+    k1, k2 : vertical levels k1:k2 of the section. Default is the whole water column.
+
+    ATTRIBUTES
+    i, j   : x and y indices of the cells of every face along the section (nface)
+    isU    : True for faces that use the zonal component, False for the meridional component (nface)
+    sign   : +1 or -1, orientation of every face (nface)
+    area   : area of every face, hFacC*dx*drF (nz,nface) with nz = k2-k1
+    wet    : True for faces with hFacC > 0 (nz,nface)
+    '''
+
+    def __init__(self,ii,jj,dx,dy,drF,hFacC,k1=0,k2=None):
+        if k2 is None:
+            k2 = np.shape(hFacC)[0]
+        if len(ii) != len(jj) or len(ii) < 2:
+            raise ValueError('ii and jj must have the same length and at least 2 vertices')
+
+        faceI = []
+        faceJ = []
+        isU = []
+        sign = []
+        for n in range(len(ii)-1):
+            i0, j0 = int(ii[n]), int(jj[n])
+            for di, dj in _staircase(i0,j0,int(ii[n+1]),int(jj[n+1])):
+                faceI.append(min(i0,i0+di))
+                faceJ.append(min(j0,j0+dj))
+                isU.append(di == 0)
+                sign.append(di if dj == 0 else -dj)
+                i0, j0 = i0+di, j0+dj
+
+        self.i = np.array(faceI,dtype=int)
+        self.j = np.array(faceJ,dtype=int)
+        self.isU = np.array(isU,dtype=bool)
+        self.sign = np.array(sign,dtype=float)
+        self.k1 = k1
+        self.k2 = k2
+
+        hfac = np.asarray(hFacC)[k1:k2,self.j,self.i]
+        width = np.where(self.isU,np.asarray(dy)[self.j,self.i],np.asarray(dx)[self.j,self.i])
+        self.area = hfac*width[None,:]*np.asarray(drF)[k1:k2,None]
+        self.wet = hfac > 0
+
+    def bounds(self):
+        '''Bounding box (i1,i2,j1,j2) of the section cells, to read only that part of a field: field[...,j1:j2,i1:i2].'''
+        return (self.i.min(),self.i.max()+1,self.j.min(),self.j.max()+1)
+
+    def faceFlux(self,UTRAC,VTRAC,weight=True,i0=0,j0=0):
+        '''Signed flux through every face of the section for all times, in one gather per component.
+        UTRAC, VTRAC : zonal and meridional fluxes at cell centers (nt,nz,ny,nx), e.g. output of get_TRAC
+        weight       : If True, multiply fluxes by face area (fluxes per unit area such as velocity or UTRAC from
+                       get_TRAC). If False, fluxes are already transports through the cell face and land is only masked.
+        i0, j0       : x and y indices of UTRAC[...,0,0], when the fields are a subdomain of the grid.
+        OUTPUT : array (nt,nz,nface)
+        '''
+        nt = np.shape(UTRAC)[0]
+        flux = np.empty((nt,self.k2-self.k1,len(self.i)))
+
+        uu = self.isU
+        vv = ~self.isU
+        flux[...,uu] = np.asarray(UTRAC[:,self.k1:self.k2])[:,:,self.j[uu]-j0,self.i[uu]-i0]
+        flux[...,vv] = np.asarray(VTRAC[:,self.k1:self.k2])[:,:,self.j[vv]-j0,self.i[vv]-i0]
+
+        if weight:
+            return flux*(self.sign*self.area)[None,...]
+        return flux*(self.sign*self.wet)[None,...]
+
+    def transport(self,UTRAC,VTRAC,weight=True,i0=0,j0=0):
+        '''Transport time series through the section (nt). Arguments are the same as in faceFlux.'''
+        return np.sum(self.faceFlux(UTRAC,VTRAC,weight=weight,i0=i0,j0=j0),axis=(1,2))
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def sectionFromCoords(xs,ys,XC,YC,dx,dy,drF,hFacC,k1=0,k2=None):
+    '''Build a Section from a polyline in physical coordinates. Every vertex goes to the cell with the nearest center.
+    xs, ys : x and y coordinates of the polyline vertices (same units as XC and YC)
+    XC, YC : cell center coordinates from the MITgcm grid (2D), or a GridIndex from grid_tools in XC (YC is then ignored)
+    Other arguments as in Section.
+    '''
+    if isinstance(XC,gt.GridIndex):
+        index = XC
+    else:
+        index = gt.GridIndex(XC,YC)
+    ii, jj = index.xyToIndex(xs,ys)
+    return Section(ii,jj,dx,dy,drF,hFacC,k1=k1,k2=k2)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _readTRAC(fluxFile,keyU,keyV,i1,i2,j1,j2,k1,k2):
+    '''Read the staggered fluxes keyU and keyV over [k1:k2,j1:j2,i1:i2] only and unstagger them to cell centers like
+    get_TRAC. Levels above k1 are zero-padded so that the fields can be indexed with absolute k.'''
+    FluxOut = Dataset(fluxFile)
+    UT = FluxOut.variables[keyU][:,k1:k2,j1:j2,i1:i2+1]
+    VT = FluxOut.variables[keyV][:,k1:k2,j1:j2+1,i1:i2]
+    FluxOut.close()
+
+    UTRAC = np.ma.filled(np.add(UT[...,:-1],UT[...,1:])/2,0)
+    VTRAC = np.ma.filled(np.add(VT[...,:-1,:],VT[...,1:,:])/2,0)
+
+    UTRAC = np.concatenate([np.zeros((UTRAC.shape[0],k1)+UTRAC.shape[2:]),UTRAC],axis=1)
+    VTRAC = np.concatenate([np.zeros((VTRAC.shape[0],k1)+VTRAC.shape[2:]),VTRAC],axis=1)
+    return (UTRAC,VTRAC)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def sectionTransportFile(sections,fluxFile,keyU,keyV,weight=True,perFace=False):
+    '''Transport through one or several sections, read directly from a flux file. The staggered fields keyU and keyV are
+    read once, only over the bounding box of all sections, and unstaggered to cell centers like get_TRAC.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    sections : Section or list of Sections
+    fluxFile : string with /path/to/flux file
+    keyU     : name of zonal flux variable (staggered in x)
+    keyV     : name of meridional flux variable (staggered in y)
+    weight   : as in Section.faceFlux
+    perFace  : If True, return face fluxes (nt,nz,nface) instead of transport time series (nt)
+
+    OUTPUT
+    One array per section (a list if sections is a list)
+    '''
+    single = isinstance(sections,Section)
+    if single:
+        sections = [sections]
+
+    box = np.array([sec.bounds() for sec in sections])
+    i1, i2 = box[:,0].min(), box[:,1].max()
+    j1, j2 = box[:,2].min(), box[:,3].max()
+    k1 = min(sec.k1 for sec in sections)
+    k2 = max(sec.k2 for sec in sections)
+
+    UTRAC, VTRAC = _readTRAC(fluxFile,keyU,keyV,i1,i2,j1,j2,k1,k2)
+
+    out = []
+    for sec in sections:
+        if perFace:
+            out.append(sec.faceFlux(UTRAC,VTRAC,weight=weight,i0=i1,j0=j1))
+        else:
+            out.append(sec.transport(UTRAC,VTRAC,weight=weight,i0=i1,j0=j1))
+
+    if single:
+        return out[0]
+    return out
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+class BoxBudget:
+    '''Control-volume tracer budget for a box such as the canyon box of howMuchWaterShwHole: the cells xh1:xh2, yh1:yh2,
+    k1:k2. The fluxes are taken at the faces of the box on the staggered grid, where MITgcm computes them, so that the
+    transports through the faces account for every change of the tracer in the box: zonal fluxes at the u points xh1
+    (west wall) and xh2 (east wall) with areas hFacW*dyG*drF, meridional fluxes at the v points yh1 (south wall) and yh2
+    (north wall) with areas hFacS*dxG*drF, and vertical fluxes at the top of cells k2 (bottom face) and k1 (top face)
+    with area rA where the cell below the face is wet. All areas are precomputed once.
+    The whole shelf (y >= yin) is the box 0:nx, yin:ny.
+
+    A top face at k1 = 0 is the sea surface. It is closed by default (rigid lid), so WTRAC at k = 0 is left out of the
+    budget. With a linear free surface MITgcm puts the tracer carried by the surface volume flux in WTRAC at k = 0; give
+    surface=True to count it, otherwise the budget of a box at the surface does not close by that flux.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    xh1, xh2 : x indices of the box walls (cells xh1 to xh2-1 are inside)
+    yh1, yh2 : y indices of the box walls (cells yh1 to yh2-1 are inside)
+    k1, k2   : vertical levels of the box (cells k1 to k2-1 are inside, e.g. 0, zfin)
+    dxG, dyG : cell face lengths at v points (ny+1,nx) and u points (ny,nx+1)
+    drF      : distance between cell faces (1D)
+    rA       : area of cell faces at C points (2D)
+    hFacC, hFacW, hFacS : fraction of open cell at C, u and v points
+    surface  : If True, the top face of a box with k1 = 0 is open (linear free surface). Default False, closed.
+
+    ATTRIBUTES
+    areas    : dictionary with the face areas of 'west' and 'east' (nz,ny of the box), 'south' and 'north' (nz,nx of the
+               box), 'bottom' and 'top' (ny,nx of the box)
+    volume   : cell volumes inside the box (nz,ny,nx of the box)
+    '''
+
+    def __init__(self,xh1,xh2,yh1,yh2,k1,k2,dxG,dyG,drF,rA,hFacC,hFacW,hFacS,surface=False):
+        self.xh1, self.xh2, self.yh1, self.yh2 = xh1, xh2, yh1, yh2
+        self.k1, self.k2 = k1, k2
+
+        jj = slice(yh1,yh2)
+        ii = slice(xh1,xh2)
+        kk = slice(k1,k2)
+        drF = np.asarray(drF)
+        dxG = np.asarray(dxG)
+        dyG = np.asarray(dyG)
+        hFacW = np.asarray(hFacW)
+        hFacS = np.asarray(hFacS)
+        hfac = np.asarray(hFacC)
+        area = np.asarray(rA)[jj,ii]
+
+        self.areas = {'west':hFacW[kk,jj,xh1]*dyG[jj,xh1]*drF[kk,None],
+                      'east':hFacW[kk,jj,xh2]*dyG[jj,xh2]*drF[kk,None],
+                      'south':hFacS[kk,yh1,ii]*dxG[yh1,ii]*drF[kk,None],
+                      'north':hFacS[kk,yh2,ii]*dxG[yh2,ii]*drF[kk,None]}
+        if k2 < hfac.shape[0]:
+            self.areas['bottom'] = area*(hfac[k2,jj,ii] > 0)
+        else:
+            self.areas['bottom'] = np.zeros(area.shape)
+        self.areas['top'] = area*(hfac[k1,jj,ii] > 0)*(k1 > 0 or surface)
+        self.volume = hfac[kk,jj,ii]*drF[kk,None,None]*area[None,...]
+
+    def bounds(self):
+        '''Bounding box (i1,i2,j1,j2) of the cells of the box. The staggered fields are needed at i1:i2+1 (u points) and
+        j1:j2+1 (v points), and the vertical flux at levels k1:k2+1.'''
+        return (self.xh1,self.xh2,self.yh1,self.yh2)
+
+    def budget(self,UTRAC,VTRAC,WTRAC,Tr,dt,weight=True,i0=0,j0=0):
+        '''Tracer budget of the box for all time outputs.
+        UTRAC        : zonal flux at u points (nt,nz,ny,nx+1), e.g. UTRAC01 of the flux file, not unstaggered
+        VTRAC        : meridional flux at v points (nt,nz,ny+1,nx), e.g. VTRAC01
+        WTRAC        : vertical flux at the top of each cell, positive upwards (nt,nz,ny,nx)
+        Tr           : tracer concentration (nt,nz,ny,nx)
+        dt           : time between outputs (s), scalar or array (nt-1)
+        weight       : If True, multiply fluxes by face area (fluxes per unit area such as velocity times tracer). If
+                       False, fluxes are already transports through the faces (like the MITgcm flux diagnostics) and
+                       closed faces are only masked.
+        i0, j0       : x and y indices of the [...,0,0] element of the fields, if they are a subdomain of the grid
+        
+        OUTPUT
+        Flux   : dictionary with the transport into the box through 'south', 'east', 'north', 'west', 'bottom' and 
+                 'top' faces (nt)
+        Net    : net advective transport into the box (nt)
+        Mass   : tracer in the box, sum of Tr*volume ([C] m^3, no litre conversion, to match the transports) (nt)
+        dMdt   : storage change, diff(Mass)/dt (nt-1). It equals Net when Net is the transport over each output interval.
+        '''
+        jj = slice(self.yh1-j0,self.yh2-j0)
+        ii = slice(self.xh1-i0,self.xh2-i0)
+        kk = slice(self.k1,self.k2)
+        faces = {'west':(1,np.ma.filled(UTRAC[:,kk,jj,self.xh1-i0],0)),
+                 'east':(-1,np.ma.filled(UTRAC[:,kk,jj,self.xh2-i0],0)),
+                 'south':(1,np.ma.filled(VTRAC[:,kk,self.yh1-j0,ii],0)),
+                 'north':(-1,np.ma.filled(VTRAC[:,kk,self.yh2-j0,ii],0)),
+                 'top':(-1,np.ma.filled(WTRAC[:,self.k1,jj,ii],0))}
+        if self.k2 < np.shape(WTRAC)[1]:
+            faces['bottom'] = (1,np.ma.filled(WTRAC[:,self.k2,jj,ii],0))
+        else:
+            faces['bottom'] = (1,np.zeros(faces['top'][1].shape))
+
+        Flux = {}
+        for name, (sign, flux) in faces.items():
+            area = self.areas[name] if weight else (self.areas[name] > 0)
+            Flux[name] = sign*np.sum(flux*area[None,...],axis=(1,2))
+
+        Net = Flux['south']+Flux['east']+Flux['north']+Flux['west']+Flux['bottom']+Flux['top']
+
+        Mass = np.einsum('tkji,kji->t',np.ma.filled(Tr[:,kk,jj,ii],0),self.volume)
+        dMdt = np.diff(Mass)/dt
+
+        return (Flux,Net,Mass,dMdt)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def boxBudgetFile(box,fluxFile,keyW,keyV,keyU,ptracersFile,keyTr,dt=None,weight=True):
+    '''Tracer budget of a BoxBudget read directly from the run output. Every variable is read once, only over the 
+    faces and cells of the box, on its own (staggered) grid.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    box              : BoxBudget
+    fluxFile         : string with /path/to/flux file
+    keyW, keyV, keyU : names of vertical, meridional and zonal flux variables (same as get_TRAC)
+    ptracersFile     : string with /path/to/ptracersGlob.nc
+    keyTr            : name of tracer variable, e.g. 'Tr1'
+    dt               : time between outputs (s). Default is computed from the time variable 'T' of ptracersFile.
+    weight           : as in BoxBudget.budget
+    
+    OUTPUT : same as BoxBudget.budget
+    '''
+    i1, i2, j1, j2 = box.bounds()
+    k1, k2 = box.k1, box.k2
+
+    FluxOut = Dataset(fluxFile)
+    nz = FluxOut.variables[keyW].shape[1]
+    nt = FluxOut.variables[keyW].shape[0]
+    UTRAC = np.zeros((nt,k2,j2-j1,i2-i1+1))
+    VTRAC = np.zeros((nt,k2,j2-j1+1,i2-i1))
+    WTRAC = np.zeros((nt,min(k2+1,nz),j2-j1,i2-i1))
+    UTRAC[:,k1:] = np.ma.filled(FluxOut.variables[keyU][:,k1:k2,j1:j2,i1:i2+1],0)
+    VTRAC[:,k1:] = np.ma.filled(FluxOut.variables[keyV][:,k1:k2,j1:j2+1,i1:i2],0)
+    WTRAC[:,k1:] = np.ma.filled(FluxOut.variables[keyW][:,k1:k2+1,j1:j2,i1:i2],0)
+    FluxOut.close()
+
+    PtracersOut = Dataset(ptracersFile)
+    Tr = np.zeros((nt,k2,j2-j1,i2-i1))
+    Tr[:,k1:] = np.ma.filled(PtracersOut.variables[keyTr][:,k1:k2,j1:j2,i1:i2],0)
+    if dt is None:
+        dt = np.diff(PtracersOut.variables['T'][:])
+    PtracersOut.close()
+
+    return box.budget(UTRAC,VTRAC,WTRAC,Tr,dt,weight=weight,i0=i1,j0=j1)
@@ -0,0 +1,157 @@
+# SharedTools - Grid geometry and masks placed once in shared memory (or memory-mapped scratch files) so that
+# multiprocessing workers attach to them without copies instead of every worker reading gridGlob.nc.
+#
+# Usage:
+#   with SharedGrid.create(GridFile) as grid:                 # parent process, owns the memory
+#       with multiprocessing.Pool(8, initializer=initWorker, initargs=(grid.spec,)) as pool:
+#           results = pool.map(work, range(nt))
+#
+#   def work(tt):                                             # worker: workerGrid() is attached once per process
+#       grid = workerGrid()
+#       return mtt.calc_HCW(Tr[tt:tt+1], grid.MaskC, grid.rA, grid.hFacC, grid.drF, ...)
+
+import os
+
+import numpy as np
+
+from netCDF4 import Dataset
+
+from multiprocessing import shared_memory
+
+# Variables of gridGlob.nc placed in shared memory by default, with the names used by metrics_tools
+GRIDFIELDS = {'HFacC':'hFacC', 'HFacW':'hFacW', 'HFacS':'hFacS', 'rA':'rA', 'drF':'drF', 'dxF':'dxF', 'dyF':'dyF',
+              'dxG':'dxG', 'dyG':'dyG', 'XC':'XC', 'YC':'YC', 'RC':'RC'}
+
+_worker = {}
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+class SharedGrid:
+    '''Read-only numpy arrays in shared memory, available as attributes (grid.hFacC) or items (grid['hFacC']).
+    They are plain ndarrays, so they can be given to any metrics_tools or shelfbreak_tools function.
+    Create it in the parent process with SharedGrid.create and pass grid.spec (a small picklable dictionary) to the
+    workers, which attach with SharedGrid.attach(spec). The creator frees the memory with unlink() (or a with block).
+    '''
+
+    def __init__(self,spec,owner=False,blocks=None):
+        self.spec = spec
+        self.owner = owner
+        self._owned = dict(blocks or {}) # the creator's own (tracked) handles, by block name, freed by unlink()
+        self._blocks = []
+        self.arrays = {}
+        for name, (where, shape, dtype) in spec.items():
+            if where.endswith('.npy'):
+                arr = np.load(where,mmap_mode='r')
+            else:
+                shm = self._owned[where] if where in self._owned else _openBlock(where)
+                self._blocks.append(shm)
+                arr = np.ndarray(shape,dtype=np.dtype(dtype),buffer=shm.buf)
+                arr.flags.writeable = False
+            self.arrays[name] = arr
+
+    @classmethod
+    def create(cls,GridFile,fields=None,arrays=None,scratchDir=None):
+        '''Put the grid in shared memory.
+        GridFile   : string with /path/to/gridGlob.nc
+        fields     : dictionary {netCDF name: attribute name}, default GRIDFIELDS (those in the file)
+        arrays     : dictionary {name: array} with other arrays to share, e.g. {'SBxx':SBxx}
+        scratchDir : if given, arrays are written to .npy files in this folder and memory-mapped instead (for systems
+                     with a small /dev/shm). The files are removed by unlink().
+        Also adds 'MaskC', the land mask of HFacC as getMask, and 'CellVol', the cell volumes hFacC*drF*rA.
+        '''
+        if fields is None:
+            fields = GRIDFIELDS
+        data = {}
+        GridOut = Dataset(GridFile)
+        for ncName, name in fields.items():
+            if ncName in GridOut.variables:
+                data[name] = np.ma.getdata(GridOut.variables[ncName][:])
+        GridOut.close()
+        if 'hFacC' in data:
+            data['MaskC'] = data['hFacC'] == 0
+            if 'rA' in data and 'drF' in data:
+                data['CellVol'] = data['hFacC']*data['drF'][:,None,None]*data['rA']
+        data.update(arrays or {})
+
+        spec = {}
+        blocks = []
+        for name, arr in data.items():
+            arr = np.ascontiguousarray(arr)
+            if scratchDir is not None:
+                where = os.path.join(scratchDir,'shared_%d_%s.npy' % (os.getpid(),name))
+                np.save(where,arr)
+            else:
+                shm = shared_memory.SharedMemory(create=True,size=max(arr.nbytes,1))
+                np.ndarray(arr.shape,dtype=arr.dtype,buffer=shm.buf)[...] = arr
+                blocks.append(shm)
+                where = shm.name
+            spec[name] = (where,arr.shape,arr.dtype.str)
+        return cls(spec,owner=True,blocks={shm.name:shm for shm in blocks})
+
+    @classmethod
+    def attach(cls,spec):
+        '''Attach to a SharedGrid created by another process, without copying the arrays.'''
+        return cls(spec)
+
+    def __getattr__(self,name):
+        arrays = self.__dict__.get('arrays',{})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    def __getitem__(self,name):
+        return self.arrays[name]
+
+    def __contains__(self,name):
+        return name in self.arrays
+
+    def close(self):
+        '''Detach this process from the arrays.'''
+        self.arrays = {}
+        for shm in self._blocks:
+            shm.close()
+        self._blocks = []
+
+    def unlink(self):
+        '''Free the shared memory (or remove the scratch files). Only the process that created the grid should call it.'''
+        self.close()
+        for where, shape, dtype in self.spec.values():
+            if where.endswith('.npy'):
+                if os.path.exists(where):
+                    os.remove(where)
+            elif where in self._owned: # unlink also unregisters the block from the resource tracker
+                self._owned.pop(where).unlink()
+            else:
+                shm = _openBlock(where)
+                shm.close()
+                shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
+
+
+def _openBlock(name):
+    '''Attach to an existing shared memory block created by another process (a worker attaching to the grid). Python
+    >= 3.13 can skip the resource tracker for attached blocks; the creator keeps its tracked handles instead, so that
+    unlink() unregisters them.'''
+    try:
+        return shared_memory.SharedMemory(name=name,track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def initWorker(spec):
+    '''Pool initializer: attach the worker process to a SharedGrid once. Use workerGrid() in the tasks.'''
+    _worker['grid'] = SharedGrid.attach(spec)
+
+
+def workerGrid():
+    '''The SharedGrid attached by initWorker in this process.'''
+    return _worker['grid']
@@ -1,12 +1,21 @@
 # ShelfBreakTools - Find the shelf break indices; Get shelf break wall fields and plot those fields.
 
-import matplotlib.pyplot as plt
+import collections
 
 import numpy as np
 
-import scipy as spy
+import canyon_tools.kernel_tools as kt
 
-import pylab as pl
+import canyon_tools.readout_tools as rout
+
+# The plots of shelf break fields moved to plot_tools, which is imported only when one of them is used.
+_PLOTS = ('contourfFluxSB','pcolorFluxSB')
+
+def __getattr__(name):
+    if name in _PLOTS:
+        import canyon_tools.plot_tools as plot_tools
+        return getattr(plot_tools,name)
+    raise AttributeError("module %r has no attribute %r" % (__name__,name))
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def findShelfBreak(zlev,hfac):
@@ -31,13 +40,11 @@ def findShelfBreak(zlev,hfac):
     
     #SBIndx = np.empty(nx+2) # I have to add 2 extra points that the algorithm cannot find
     #SBIndy = np.empty(nx+2)  
-    SBIndx = np.empty(nx) # No need to add them anymore
-    SBIndy = np.empty(nx)
-
-    for kk in range(nx):
-        #SBIndy[kk] = np.argmax(hfac[zlev,:,kk]!=1) # use this for old grid
-        SBIndy[kk] = np.argmax(hfac[zlev,:,kk] < 0.96)  # use this for quad grid
-        SBIndx[kk] = kk
+    #SBIndy[kk] = np.argmax(hfac[zlev,:,kk]!=1) # use this for old grid
+    SBIndy = kt.firstBelow(np.asarray(hfac[zlev,:,:]),0.96)  # Numba kernel, if available
+    if SBIndy is None:
+        SBIndy = np.argmax(np.asarray(hfac[zlev,:,:]) < 0.96, axis=0)  # use this for quad grid. First cell in every column kk.
+    SBIndx = np.arange(nx)
 
     #SBIndy[kk+1] = 216    # Since I changed the condition, I don't need these extra points anymore
     #SBIndy[kk+2] = 216
@@ -59,6 +66,28 @@ def findShelfBreak(zlev,hfac):
     
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
+def _lazyFieldSB(SBxx,SByy,time,field,Mask,unstag=None):
+    '''Task graph for field[time,:,SByy,SBxx] masked with Mask[:,SByy,SBxx], for lazy (dask/xarray) fields. 
+    unstag='y' or 'x' averages with the next cell in that direction, like the unstaggering in MerFluxSB and ZonFluxSB. 
+    Only the shelf break columns are read when the result is computed.
+    '''
+    import dask.array as da
+    
+    fld = rout.asDask(field)[time]
+    kk = np.arange(fld.shape[0])[:,None]
+    jj = np.asarray(SByy)[None,:]
+    ii = np.asarray(SBxx)[None,:]
+    
+    wall = fld.vindex[kk,jj,ii]
+    if unstag == 'y':
+        wall = (wall + fld.vindex[kk,jj+1,ii]) / 2
+    elif unstag == 'x':
+        wall = (wall + fld.vindex[kk,jj,ii+1]) / 2
+    
+    return(da.ma.masked_array(wall,mask=rout.maskColumns(Mask,SByy,SBxx)))
+    
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
 def MerFluxSB(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
     '''Flux across shelf break - This function uses findShelfBreak to get the indices of the cells along the shelf break 
     (with or without canyon) and returns a (nz,nx) array with the flux across those cells from bottom to surface. The flux 
@@ -72,6 +101,7 @@ def MerFluxSB(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
             z - 1D array with z-level depth data
             x - alongshore coordinates (2D)
             hfac - open cell fraction that works as mask
+            Mask - land mask (boolean mask, PackedMask or WetIndex from readout_tools)
             zlev - vertical level at which to get the shelf break indices
     OUTPUT : array [nz,nx] with flux values across shelfbreak
     ----------------------------------------------------------------------------------------------------------------------
@@ -79,6 +109,9 @@ def MerFluxSB(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
     
     SBxx, SByy = findShelfBreak(zlev,hfac)
 
+    if rout.isLazy(Flux):
+        return(_lazyFieldSB(SBxx,SByy,time,Flux,Mask,unstag='y'))
+    
     sizeX = np.shape(SBxx)
     sizes = np.shape(hfac)
     
@@ -86,15 +119,14 @@ def MerFluxSB(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
     nz = sizes[0]
     
     FluxY = np.empty((nz,nx))
-    MaskY = np.empty((nz,nx))
+    MaskY = rout.maskColumns(Mask,SByy,SBxx)
 
-    unstagFlux = np.add(Flux[..., :-1, :], Flux[..., 1:, :]) / 2
+    unstagFlux = rout.Unstaggered(Flux, axis=-2) # only the shelf break columns are unstaggered
     
     kk = 0
     for index in zip(SBxx,SByy):
         #print(index)
         FluxY[:,kk] = unstagFlux[time,:,index[1],index[0]] 
-        MaskY[:,kk] = Mask[:,index[1],index[0]]
         kk = kk+1
 
     FluxYmask = np.ma.array(FluxY,mask=MaskY)
@@ -114,10 +146,14 @@ def ZonFluxSB(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
             z - 1D array with z-level depth data
             x - alongshore coordinates (2D)
             hfac - open cell fraction that works as mask
+            Mask - land mask (boolean mask, PackedMask or WetIndex from readout_tools)
             zlev - vertical level at which to get the shelf break indices
     OUTPUT : array [nz,nx] with flux values across shelfbreak
     -----------------------------------------------------------------------------------------------------------------------------
     '''
+    if rout.isLazy(Flux):
+        return(_lazyFieldSB(SBxx,SByy,time,Flux,Mask,unstag='x'))
+    
     sizeX = np.shape(SBxx)
     sizes = np.shape(hfac)
     
@@ -125,15 +161,14 @@ def ZonFluxSB(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
     nz = sizes[0]
     
     FluxX = np.empty((nz,nx))
-    MaskX = np.empty((nz,nx))
+    MaskX = rout.maskColumns(Mask,SByy,SBxx)
 
-    unstagFlux = np.add(Flux[..., :, :-1], Flux[..., :, 1:]) / 2
+    unstagFlux = rout.Unstaggered(Flux, axis=-1) # only the shelf break columns are unstaggered
     
     kk = 0
     for index in zip(SBxx,SByy):
         #print(index)
         FluxX[:,kk] = unstagFlux[time,:,index[1],index[0]] 
-        MaskX[:,kk] = Mask[:,index[1],index[0]]
         kk = kk+1
 
     FluxXmask = np.ma.array(FluxX,mask=MaskX)
@@ -153,6 +188,7 @@ def MerFluxSBNoUnstag(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
             z - 1D array with z-level depth data
             x - alongshore coordinates (2D)
             hfac - open cell fraction that works as mask
+            Mask - land mask (boolean mask, PackedMask or WetIndex from readout_tools)
             zlev - vertical level at which to get the shelf break indices
     OUTPUT : array [nz,nx] with flux values across shelfbreak
     ----------------------------------------------------------------------------------------------------------------------
@@ -160,6 +196,9 @@ def MerFluxSBNoUnstag(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
     
     SBxx, SByy = findShelfBreak(zlev,hfac)
 
+    if rout.isLazy(Flux):
+        return(_lazyFieldSB(SBxx,SByy,time,Flux,Mask))
+    
     sizeX = np.shape(SBxx)
     sizes = np.shape(hfac)
     
@@ -167,13 +206,12 @@ def MerFluxSBNoUnstag(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
     nz = sizes[0]
     
     FluxY = np.empty((nz,nx))
-    MaskY = np.empty((nz,nx))
+    MaskY = rout.maskColumns(Mask,SByy,SBxx)
 
     kk = 0
     for index in zip(SBxx,SByy):
         #print(index)
         FluxY[:,kk] = Flux[time,:,index[1],index[0]] 
-        MaskY[:,kk] = Mask[:,index[1],index[0]]
         kk = kk+1
 
     FluxYmask = np.ma.array(FluxY,mask=MaskY)
@@ -193,10 +231,14 @@ def ZonFluxSBNoUnstag(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
             z - 1D array with z-level depth data
             x - alongshore coordinates (2D)
             hfac - open cell fraction that works as mask
+            Mask - land mask (boolean mask, PackedMask or WetIndex from readout_tools)
             zlev - vertical level at which to get the shelf break indices
     OUTPUT : array [nz,nx] with flux values across shelfbreak
     -----------------------------------------------------------------------------------------------------------------------------
     '''
+    if rout.isLazy(Flux):
+        return(_lazyFieldSB(SBxx,SByy,time,Flux,Mask))
+    
     sizeX = np.shape(SBxx)
     sizes = np.shape(hfac)
     
@@ -204,14 +246,13 @@ def ZonFluxSBNoUnstag(SBxx,SByy,time,Flux,z,x,zlev,hfac,Mask):
     nz = sizes[0]
     
     FluxX = np.empty((nz,nx))
-    MaskX = np.empty((nz,nx))
+    MaskX = rout.maskColumns(Mask,SByy,SBxx)
 
     
     kk = 0
     for index in zip(SBxx,SByy):
         #print(index)
         FluxX[:,kk] = Flux[time,:,index[1],index[0]] 
-        MaskX[:,kk] = Mask[:,index[1],index[0]]
         kk = kk+1
 
     FluxXmask = np.ma.array(FluxX,mask=MaskX)
@@ -227,12 +268,16 @@ def fieldSB(time,field,z,x,zlev,hfac,Mask):
             z - 1D array with z-level depth data
             x - alongshore coordinates (2D)
             hfac - open cell fraction that works as mask
+            Mask - land mask (boolean mask, PackedMask or WetIndex from readout_tools)
             zlev - vertical level at which to get the shelf break indices
     OUTPUT : array [nz,nx] with field values across shelfbreak
     ----------------------------------------------------------------------------------------------------------------------
     '''
     SBxx, SByy = findShelfBreak(zlev,hfac)
 
+    if rout.isLazy(field):
+        return(_lazyFieldSB(SBxx,SByy,time,field,Mask))
+    
     sizeX = np.shape(SBxx)
     sizes = np.shape(hfac)
     
@@ -240,12 +285,11 @@ def fieldSB(time,field,z,x,zlev,hfac,Mask):
     nz = sizes[0]
     
     fieldY = np.empty((nz,nx))
-    MaskY = np.empty((nz,nx))
+    MaskY = rout.maskColumns(Mask,SByy,SBxx)
 
     kk = 0
     for index in zip(SBxx,SByy):
         fieldY[:,kk] = field[time,:,index[1],index[0]] 
-        MaskY[:,kk] = Mask[:,index[1],index[0]]
         kk = kk+1
 
     fieldYmask = np.ma.array(fieldY,mask=MaskY)
@@ -254,98 +298,6 @@ def fieldSB(time,field,z,x,zlev,hfac,Mask):
     
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
-def contourfFluxSB(time,numCols,numRows,FluxPlot,z,x,units, nzmin,nzmax,kk,zlev):
-    ''' Contourf plot of flux across shelf break wall' 
-     -------------------------------------------------------------------------------------------------------------------
-     INPUT:  time - timeslice at what we want to plot (integer, usually between 0 and 18)
-            numCols, numRows - integers indicating, respectively, the number of columns and rows to arrange the subplots into.
-             Flux - array with across shelf break flux data (nz,nx)
-                z - 1D array with z-level depth data
-                x - alongshore coordinates (2D)
-            nzmin - integer indicating index of lower depth (z) to plot. Remember z goes form 0 to -2000 m. 
-            nzmax - integer indicating index of upper depth (z) to plot. Remember z goes form 0 to -2000 m. 
-            units - string with units for colorbar. E.g. units = '$molC\ m^{-1}\cdot m^3s^{-1}$' 
-               kk - Integer inidcating the number of subplot 
-             zlev - vertical level at which to get the shelf break indices
-    OUTPUT : Nice contourf subplot
-    ----------------------------------------------------------------------------------------------------------------------
-    '''
-    sizes = np.shape(FluxPlot)
-    nx = sizes[1]
-    
-    plt.subplot(numRows,numCols,kk)
-    ax = plt.gca()
-
-    ax.set_axis_bgcolor((205/255.0, 201/255.0, 201/255.0))
-    plt.contourf(x[1,4:360-5],z[nzmin:nzmax],FluxPlot[nzmin:nzmax,:],cmap = "RdYlBu_r")
-    
-
-    if abs(np.max(FluxPlot)) >= abs(np.min(FluxPlot)):
-        pl.clim([-np.max(FluxPlot),np.max(FluxPlot)])
-    else:
-        pl.clim([np.min(FluxPlot),-np.min(FluxPlot)])
-    
-    
-    plt.axvline(x=x[1,120],linestyle='-', color='0.75')
-    plt.axvline(x=x[1,240],linestyle='-', color='0.75')
-    
-    plt.xlabel('Along-shelfbreak index')
-        
-    plt.ylabel('m')
-
-    cb = plt.colorbar()
-
-    cb.set_label(units,position=(1, 0),rotation=0)
-
-    plt.title(" %1.1f days " % ((time/2.)+0.5))
-
-# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-    
-def pcolorFluxSB(time,numCols,numRows,FluxPlot,z,x,units, nzmin,nzmax,kk,zlev):
-    ''' pcolor plot of flux across shelf break wall' 
-     -------------------------------------------------------------------------------------------------------------------
-    INPUT:  time - timeslice at what we want to plot (integer, usually between 0 and 18)
-            numCols, numRows - integers indicating, respectively, the number of columns and rows to arrange the subplots into.
-             Flux - array with across shelf break flux data (nz,nx)
-                z - 1D array with z-level depth data
-                x - alongshore coordinates (2D)
-            nzmin - integer indicating index of lower depth (z) to plot. Remember z goes form 0 to -2000 m. 
-            nzmax - integer indicating index of upper depth (z) to plot. Remember z goes form 0 to -2000 m. 
-            units - string with units for colorbar. E.g. units = '$molC\ m^{-1}\cdot m^3s^{-1}$' 
-               kk - Integer inidcating the number of subplot 
-             zlev - vertical level at which to get the shelf break indices
-    OUTPUT : Nice pcolor subplot
-    ----------------------------------------------------------------------------------------------------------------------
-    '''
-    sizes = np.shape(FluxPlot)
-    nx = sizes[1]
-    
-    plt.subplot(numRows,numCols,kk)
-    ax = plt.gca()
-
-    ax.set_axis_bgcolor((205/255.0, 201/255.0, 201/255.0))
-    plt.pcolor(x[1,4:360-5],z[nzmin:nzmax],FluxPlot[nzmin:nzmax,:],cmap = "RdYlBu_r")
-
-    if abs(np.max(FluxPlot)) >= abs(np.min(FluxPlot)):
-        pl.clim([-np.max(FluxPlot),np.max(FluxPlot)])
-    else:
-        pl.clim([np.min(FluxPlot),-np.min(FluxPlot)])
-    
-    plt.axvline(x=x[1,120],linestyle='-', color='0.75')
-    plt.axvline(x=x[1,240],linestyle='-', color='0.75')
-    
-   
-    plt.ylabel('m')
-
-    cb = plt.colorbar()
-
-    cb.set_label(units,position=(1, 0),rotation=0)
-
-    plt.title(" %1.1f days " % ((tt/2.)+0.5))
-
- 
- # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-
 def AreaXface(hfac,dr,dx,zlev):
     '''Calculate area of Shelf break wall across x axis - perpendicular to y component of vel.
     -----------------------------------------------------------------------------------
@@ -368,10 +320,7 @@ def AreaXface(hfac,dr,dx,zlev):
     ny = sizes[1]
     nz = sizes[0]
     
-    area = np.empty((nz,nx))
-    
-    for ii in range(nx):
-        area[:,ii] = hfac[:,SByy[ii],SBxx[ii]] * dr[:] * dx[SByy[ii],SBxx[ii]]
+    area = hfac[:,SByy,SBxx] * dr[:,None] * dx[SByy,SBxx][None,:]
    
     return(area)
 
@@ -399,10 +348,7 @@ def AreaYface(hfac,dr,dy,zlev):
     ny = sizes[1]
     nz = sizes[0]
     
-    area = np.empty((nz,nx))
-    
-    for ii in range(nx):
-        area[:,ii] = hfac[:,SByy[ii],SBxx[ii]] * dr[:] * dy[SByy[ii],SBxx[ii]]
+    area = hfac[:,SByy,SBxx] * dr[:,None] * dy[SByy,SBxx][None,:]
    
     return(area)
    
@@ -433,36 +379,188 @@ def findSlope(x,y,SBx,SBy):
   
   return(slope, theta)
 
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+_SBCache = collections.OrderedDict()
+
+_SBCACHESIZE = 8
+
+def _cached(key,arrays,compute):
+    '''Result of compute(), cached under key and the identity (id, shape and dtype) of the grid arrays it depends on.
+    The arrays are kept with the cache entry, so their ids cannot be reused by other arrays while it is cached; arrays
+    changed in place are not detected. Only the _SBCACHESIZE most recently used entries are kept.'''
+    key = key+tuple((id(arr),np.shape(arr),str(getattr(arr,'dtype',''))) for arr in arrays)
+    if key in _SBCache:
+        _SBCache.move_to_end(key)
+        return _SBCache[key][1]
+    value = compute()
+    _SBCache[key] = (arrays,value)
+    while len(_SBCache) > _SBCACHESIZE:
+        _SBCache.popitem(last=False)
+    return value
+
+
+def SBWallArea(hfac,dr,dx,zlev):
+    '''Shelf break indices and area of the shelf break wall across x axis (same as findShelfBreak and AreaXface), cached
+    for the most recently used grid arrays and shelf break levels. Pass dy instead of dx to get the area across y axis
+    (AreaYface). The output can be given to SBTransport (wall) to skip the cache lookup in loops over time records.
+    -----------------------------------------------------------------------------------
+    INPUT
+    hfac : Fraction of open cell at cell center (hFacC)     
+    dr : r cell face separation (drf)
+    dx : x cell center separation (dxf)
+    zlev : vertical level to find shelf break indices
     
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
+    OUTPUT
+    SBxx, SByy : x and y indices of shelf break
+    area : np 2D array size z,x 
+    '''
+    def compute():
+        SBxx, SByy = findShelfBreak(zlev,hfac)
+        area = np.asarray(hfac)[:,SByy,SBxx] * np.asarray(dr)[:,None] * np.asarray(dx)[SByy,SBxx][None,:]
+        return (SBxx,SByy,area)
+    return _cached(('wall',zlev),(hfac,dr,dx),compute)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def SBTransport(Flux,hfac,dr,dx,zlev,Mask=None,unstag=True,wall=None):
+    '''Transport across the shelf break wall for all times in one vectorized call. The meridional flux at the shelf break
+    cells (unstaggered as in MerFluxSB) is multiplied by the cached wall area from SBWallArea.
+     -------------------------------------------------------------------------------------------------------------------
+     INPUT: 
+            Flux - array with meridional flux (or velocity) data from MITgcm model. The shape should be (nt,nz,ny,nx)
+                   with ny the size of the staggered y dimension if unstag is True.
+            hfac - open cell fraction at cell center (hFacC)
+            dr - r cell face separation (drf)
+            dx - x cell center separation (dxf)
+            zlev - vertical level at which to get the shelf break indices
+            Mask - land mask at cell centers (nz,ny,nx), optional. Cells with zero area are always excluded.
+            unstag - if True, average Flux at j and j+1 to get the flux at the cell center, like MerFluxSB.
+            wall - (SBxx, SByy, area) from SBWallArea(hfac,dr,dx,zlev), optional. Give it when calling SBTransport for
+                   one time record at a time.
+     OUTPUT : 
+            Total - transport across the shelf break (nt). With lazy (dask) Flux the outputs are lazy too (see isLazy).
+            PerDepth - transport across the shelf break at each level (nt,nz)
+            PerX - transport across the shelf break at each alongshore position (nt,nx)
+    ----------------------------------------------------------------------------------------------------------------------
+    '''
+    if wall is None:
+        wall = SBWallArea(hfac,dr,dx,zlev)
+    SBxx, SByy, area = wall
+
+    if rout.isLazy(Flux):
+        fld = rout.asDask(Flux)
+        kk = np.arange(fld.shape[1])[:,None]
+        fluxSB = np.moveaxis(fld.vindex[:,kk,SByy[None,:],SBxx[None,:]],-1,0) # lazy gather, (nt,nz,nx)
+        if unstag:
+            fluxSB = (fluxSB + np.moveaxis(fld.vindex[:,kk,SByy[None,:]+1,SBxx[None,:]],-1,0)) / 2
+    else:
+        fluxSB = np.ma.filled(Flux[:,:,SByy,SBxx],0)
+        if unstag:
+            fluxSB = (fluxSB + np.ma.filled(Flux[:,:,SByy+1,SBxx],0)) / 2
+
+    wallArea = area
+    if Mask is not None:
+        wallArea = np.where(rout.maskColumns(Mask,SByy,SBxx),0,area)
+
+    Transport = fluxSB*wallArea[None,:,:]
+    PerDepth = np.sum(Transport,axis=2)
+    PerX = np.sum(Transport,axis=1)
+    Total = np.sum(PerDepth,axis=1)
+
+    return(Total,PerDepth,PerX)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def SBGeometry(hfac,dr,dx,dy,zlev):
+    '''Faces and areas of the shelf break staircase used by SBNormalTransport, cached as in SBWallArea. The wall runs
+    through the centres of the shelf break cells: every cell has its meridional face (the wall of SBWallArea), and where
+    the shelf break jumps from row j1 in column n to row j2 in column n+1 the wall goes along the zonal faces between
+    the two columns from the centre of row j1 to the centre of row j2 (half cells at the ends).
+    -----------------------------------------------------------------------------------
+    INPUT
+    hfac : Fraction of open cell at cell center (hFacC)
+    dr : r cell face separation (drf)
+    dx, dy : x and y cell center separation (dxF, dyF)
+    zlev : vertical level to find shelf break indices
+
+    OUTPUT
+    SBxx, SByy : x and y indices of shelf break
+    area : area of the meridional faces, np 2D array size z,x (as SBWallArea)
+    col : shelf break cell (position along SBxx) every side wall face belongs to
+    rows, ii : y index and x index (west cell) of the side wall faces, the face is between columns ii and ii+1
+    sideArea : area of the side wall faces times the onshore sign (+1 if onshore is +x), np 2D array size z,len(col)
+    '''
+    def compute():
+        SBxx, SByy, area = SBWallArea(hfac,dr,dx,zlev)
+        jumps = np.flatnonzero(SByy[1:] != SByy[:-1])
+        j1, j2 = SByy[jumps], SByy[jumps+1]
+        nface = np.abs(j2-j1)+1
+        start = np.cumsum(nface)-nface
+        col = np.repeat(jumps,nface)
+        rows = np.repeat(np.minimum(j1,j2),nface)+np.arange(nface.sum())-np.repeat(start,nface)
+        ii = SBxx[col]
+        weight = np.ones(len(col))
+        weight[start] = 0.5
+        weight[start+nface-1] = 0.5
+        weight = weight*np.repeat(-np.sign(j2-j1),nface) # onshore is towards the column with the shallower break row
+        hfac3 = np.asarray(hfac)
+        sideArea = (np.minimum(hfac3[:,rows,ii],hfac3[:,rows,ii+1]) * np.asarray(dr)[:,None] *
+                    (np.asarray(dy)[rows,ii]*weight)[None,:])
+        return (SBxx,SByy,area,col,rows,ii,sideArea)
+    return _cached(('geometry',zlev),(hfac,dr,dx,dy),compute)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def SBNormalTransport(FluxU,FluxV,hfac,dr,dx,dy,zlev,Mask=None,unstag=True,geometry=None):
+    '''Cross-isobath transport across the shelf break for all times in one vectorized call, summing the face fluxes
+    along the staircase of shelf break cells (see SBGeometry): every cell contributes its meridional flux times
+    hfac*dr*dx, as in SBTransport, and where the shelf break jumps between columns (e.g. at the canyon walls) the zonal
+    flux through the faces between the columns is added. Unlike SBTransport, the side walls of the canyon are included.
+    On a straight shelf break it is SBTransport. Positive transport is onshore.
+     -------------------------------------------------------------------------------------------------------------------
+     INPUT: 
+            FluxU, FluxV - arrays with zonal and meridional flux (or velocity) data from MITgcm model (nt,nz,ny,nx),
+                   with nx (ny) the size of the staggered dimension if unstag is True.
+            hfac - open cell fraction at cell center (hFacC)
+            dr - r cell face separation (drf)
+            dx, dy - x and y cell center separation (dxF, dyF)
+            zlev - vertical level at which to get the shelf break indices
+            Mask - land mask at cell centers (nz,ny,nx), optional.
+            unstag - if True, the fluxes are on the staggered grid: FluxV is averaged with the next cell to get it at
+                     cell centers (as MerFluxSB) and FluxU is used at the face between columns. If False, the fluxes
+                     are at cell centers and FluxU is averaged between columns.
+            geometry - output of SBGeometry(hfac,dr,dx,dy,zlev), optional. Give it when calling SBNormalTransport for
+                   one time record at a time.
+     OUTPUT : 
+            Total - transport across the shelf break (nt)
+            PerDepth - transport across the shelf break at each level (nt,nz)
+            PerX - transport across the shelf break at each shelf break cell, including the side wall to the next
+                   column (nt,nx)
+    ----------------------------------------------------------------------------------------------------------------------
+    '''
+    if geometry is None:
+        geometry = SBGeometry(hfac,dr,dx,dy,zlev)
+    SBxx, SByy, area, col, rows, ii, sideArea = geometry
+
+    wallV = np.ma.filled(FluxV[:,:,SByy,SBxx],0)
+    if unstag:
+        wallV = (wallV + np.ma.filled(FluxV[:,:,SByy+1,SBxx],0)) / 2
+    if Mask is not None:
+        area = np.where(rout.maskColumns(Mask,SByy,SBxx),0,area)
+    Transport = wallV*area[None,:,:]
+
+    if len(col):
+        if unstag:
+            wallU = np.ma.filled(FluxU[:,:,rows,ii+1],0)
+        else:
+            wallU = (np.ma.filled(FluxU[:,:,rows,ii],0) + np.ma.filled(FluxU[:,:,rows,ii+1],0)) / 2
+        if Mask is not None:
+            sideArea = np.where(rout.maskColumns(Mask,rows,ii) | rout.maskColumns(Mask,rows,ii+1),0,sideArea)
+        np.add.at(Transport,(slice(None),slice(None),col),wallU*sideArea[None,:,:])
+
+    PerDepth = np.sum(Transport,axis=2)
+    PerX = np.sum(Transport,axis=1)
+    Total = np.sum(PerDepth,axis=1)
+
+    return(Total,PerDepth,PerX)
@@ -0,0 +1,195 @@
+# StoreTools - Write metrics time series of many runs to a single netCDF4 file and read them back by metric.
+#
+# Layout of a store file:
+#   /<experiment>             one group per experiment
+#       run(run)              run names, e.g. 'run01'
+#       <metric key>(run,<metric key>_time) one 2D variable per metric and parameters, NaN where a run has fewer time
+#                             outputs. Each metric has its own time dimension.
+#       <metric key>_length(run) number of time outputs written for every run, 0 for runs without this metric. Values
+#                             past it are NaN when read, whatever the file holds there.
+# All dimensions are unlimited, so new runs and longer runs are appended in place.
+
+import json
+
+import os
+
+import hashlib
+
+import re
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _plain(value):
+    '''Python value of NumPy scalars and arrays, so that e.g. np.int64(29) and 29 are the same parameter.'''
+    if isinstance(value,(np.generic,np.ndarray)):
+        return value.tolist()
+    return repr(value)
+
+
+def _canonical(params):
+    '''Canonical text of a parameter dictionary, stored as the params attribute of the metric variables.'''
+    return json.dumps(params or {},sort_keys=True,default=_plain)
+
+
+def metricKey(metric,params=None):
+    '''Variable name of a metric with parameters, e.g. metricKey('HCW',{'nzlim':29,'yin':227}) = 'HCW__nzlim29_yin227_'
+    followed by a short hash of the parameters, so that parameter sets that look the same once made a valid name
+    (e.g. {'a':1.5} and {'a':'1-5'}) get different keys. The parameters themselves are stored as attributes.
+    metric : string with the metric name
+    params : dictionary with the parameters of the metric, optional'''
+    if not params:
+        return metric
+    plain = json.loads(_canonical(params))
+    tags = ['%s%s' % (name,plain[name]) for name in sorted(plain)]
+    digest = hashlib.sha1(_canonical(params).encode()).hexdigest()[:8]
+    return re.sub(r'[^A-Za-z0-9_]','-',metric+'__'+'_'.join(tags))+'_'+digest
+
+
+def _metricVariables(grp):
+    '''Metric variables of an experiment group (not the run names or the lengths).'''
+    return {key:var for key, var in grp.variables.items() if 'metric' in var.ncattrs()}
+
+
+def _findKey(grp,metric,params):
+    '''Key of the variable of metric with params in grp, from the stored attributes (also for keys made by older
+    versions of metricKey). KeyError if there is none.'''
+    key = metricKey(metric,params)
+    if key in grp.variables:
+        return key
+    for name, var in _metricVariables(grp).items():
+        if var.metric == metric and json.loads(var.params) == json.loads(_canonical(params)):
+            return name
+    raise KeyError('no metric %s with parameters %s' % (metric,_canonical(params)))
+
+
+def _group(StoreOut,experiment):
+    '''Group of an experiment, created with its dimensions and run names if it does not exist.'''
+    if experiment in StoreOut.groups:
+        return StoreOut.groups[experiment]
+    grp = StoreOut.createGroup(experiment)
+    grp.createDimension('run',None)
+    grp.createVariable('run',str,('run',))
+    return grp
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def writeMetrics(storeFile,experiment,metric,runs,values,params=None,units=None):
+    '''Bulk append (or overwrite) the time series of one metric for many runs.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    storeFile  : string with /path/to/store.nc (created if it does not exist)
+    experiment : string with the experiment name, e.g. 'BARKLEY'
+    metric     : string with the metric name, e.g. 'HCW', 'TrMass', 'SBTransport'
+    runs       : list of run names, e.g. ['run01','run02']
+    values     : time series of every run, a 2D array (nrun,nt) or a list of 1D arrays of any length
+    params     : dictionary with the parameters of the metric (see metricKey), optional
+    units      : string with units, optional
+
+    OUTPUT
+    key : name of the variable written
+    '''
+    runs = list(runs)
+    series = [np.ma.filled(np.ma.asarray(val,dtype=float),np.nan).ravel() for val in values]
+    if len(series) != len(runs):
+        raise ValueError('values must have one time series per run')
+    key = metricKey(metric,params)
+
+    StoreOut = Dataset(storeFile,'a' if os.path.exists(storeFile) else 'w')
+    grp = _group(StoreOut,experiment)
+
+    runVar = grp.variables['run']
+    names = list(runVar[:]) if len(grp.dimensions['run']) > 0 else []
+    nold = len(names)
+    rows = []
+    for run in runs:
+        if run not in names:
+            runVar[len(names)] = run
+            names.append(run)
+        rows.append(names.index(run))
+    if len(names) > nold: # new runs have no time outputs of the metrics written before
+        for other in _metricVariables(grp):
+            if other+'_length' in grp.variables:
+                grp.variables[other+'_length'][nold:len(names)] = 0
+
+    if key in grp.variables:
+        if grp.variables[key].params != _canonical(params):
+            raise ValueError('metric key %s is already used by parameters %s' % (key,grp.variables[key].params))
+    else:
+        grp.createDimension(key+'_time',None)
+        var = grp.createVariable(key,'f8',('run',key+'_time'),zlib=True,chunksizes=(16,256),fill_value=np.nan)
+        var.metric = metric
+        var.params = _canonical(params)
+        if units is not None:
+            var.units = units
+        lengths = grp.createVariable(key+'_length','i4',('run',))
+        lengths[:len(names)] = np.zeros(len(names),dtype=np.int32)
+    var = grp.variables[key]
+    lengths = grp.variables[key+'_length']
+
+    nt = max(max(len(ser) for ser in series),len(grp.dimensions[key+'_time']))
+    block = np.full((len(runs),nt),np.nan)
+    for row, ser in enumerate(series):
+        block[row,:len(ser)] = ser
+
+    order = np.argsort(rows)
+    rows = np.asarray(rows)[order]
+    if np.all(np.diff(rows) == 1):
+        var[rows[0]:rows[-1]+1,:nt] = block[order]
+    else:
+        for row, data in zip(rows,block[order]):
+            var[row,:nt] = data
+    for row, ser in zip(rows,np.asarray([len(ser) for ser in series])[order]):
+        lengths[row] = ser
+    StoreOut.close()
+
+    return key
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def readMetric(storeFile,experiment,metric,params=None,runs=None):
+    '''Read one metric for all (or some) runs of an experiment in a single read.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    storeFile  : string with /path/to/store.nc
+    experiment : string with the experiment name
+    metric     : string with the metric name
+    params     : dictionary with the parameters of the metric, as given to writeMetrics
+    runs       : list of run names to read, optional. Default is all runs.
+
+    OUTPUT
+    runNames : list of run names (rows of values)
+    values   : array (nrun,nt), NaN after the last time output of shorter runs and for runs without this metric
+    '''
+    StoreOut = Dataset(storeFile)
+    grp = StoreOut.groups[experiment]
+    names = list(grp.variables['run'][:])
+    key = _findKey(grp,metric,params)
+    var = grp.variables[key]
+    values = np.array(np.ma.filled(var[:],np.nan),dtype=float)
+    if key+'_length' in grp.variables:
+        lengths = np.ma.filled(grp.variables[key+'_length'][:],0)
+        values[np.arange(values.shape[1])[None,:] >= lengths[:values.shape[0],None]] = np.nan
+    if runs is None:
+        runNames = names
+    else:
+        rows = [names.index(run) for run in runs]
+        values = values[rows]
+        runNames = list(runs)
+    StoreOut.close()
+
+    return (runNames,values)
+
+
+def listMetrics(storeFile,experiment):
+    '''Metrics stored for an experiment. Returns a dictionary {key:(metric,params)}.'''
+    StoreOut = Dataset(storeFile)
+    grp = StoreOut.groups[experiment]
+    keys = {}
+    for key, var in _metricVariables(grp).items():
+        keys[key] = (var.metric,json.loads(var.params))
+    StoreOut.close()
+    return keys
@@ -0,0 +1,445 @@
+# StreamTools - Statistics of MITgcm output computed one time record at a time, so that memory use is a few 3D fields
+# instead of the whole 4D variable.
+
+import contextlib
+
+import io
+
+import queue
+
+import threading
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+import canyon_tools.metrics_tools as mtt
+
+import canyon_tools.readout_tools as rout
+
+import canyon_tools.shelfbreak_tools as sbt
+
+# libnetcdf and HDF5 are not thread-safe, not even on different files: every netCDF call of this module (prefetch
+# threads and the writer of anomalyStats alike) holds this lock. Records are read and written one at a time, so the
+# lock is held for one read or write.
+NCLOCK = threading.RLock()
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+class RunningStats:
+    '''Running mean, variance, minimum and maximum of a sequence of fields of the same shape (Welford's algorithm).
+    Only five arrays of the field shape are kept: mean, sum of squared deviations, min, max and a work buffer.
+    Masked values (e.g. land in masked output) are NaN in the results.
+
+    stats = RunningStats()
+    for t in range(nt):
+        stats.update(Tr[t])
+    mean, var, fmin, fmax = stats.result()
+    '''
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.M2 = None
+        self.min = None
+        self.max = None
+        self._delta = None
+
+    def update(self,fld):
+        '''Add one field to the statistics.'''
+        x = np.ma.filled(np.ma.asarray(fld,dtype=float),np.nan)
+        self.n = self.n+1
+        if self.mean is None:
+            self.mean = x.copy()
+            self.M2 = np.zeros_like(x)
+            self.min = x.copy()
+            self.max = x.copy()
+            self._delta = np.empty_like(x)
+            return
+        delta = self._delta
+        np.subtract(x,self.mean,out=delta)
+        self.mean += delta/self.n
+        delta *= x-self.mean
+        self.M2 += delta
+        np.fmin(self.min,x,out=self.min)
+        np.fmax(self.max,x,out=self.max)
+
+    def merge(self,other):
+        '''Add the statistics of other (e.g. computed by another process over other time records) to these.'''
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.__dict__.update({key:np.copy(val) for key, val in other.__dict__.items() if key != 'n'})
+            self.n = other.n
+            return
+        n = self.n+other.n
+        delta = other.mean-self.mean
+        self.mean += delta*other.n/n
+        self.M2 += other.M2+delta**2*self.n*other.n/n
+        np.fmin(self.min,other.min,out=self.min)
+        np.fmax(self.max,other.max,out=self.max)
+        self.n = n
+
+    def result(self,ddof=0):
+        '''Returns (mean, var, fmin, fmax). ddof as in np.var. Raises ValueError before the first update.'''
+        if self.n == 0:
+            raise ValueError('RunningStats.result: no fields were added')
+        return (self.mean,self.M2/(self.n-ddof),self.min,self.max)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _records(ncFile,fieldname,region=None,sbWall=None,t1=0,t2=None):
+    '''Generator of the time records t1:t2 of ncFile[fieldname], one at a time, restricted to region or to the shelf
+    break wall (see timeStats). Every read holds NCLOCK; the lock is released before the record is yielded.'''
+    with NCLOCK:
+        FileOut = Dataset(ncFile)
+        var = FileOut.variables[fieldname]
+        if t2 is None:
+            t2 = var.shape[0]
+    try:
+        for tt in range(t1,t2):
+            with NCLOCK:
+                if sbWall is not None:
+                    SBxx, SByy = sbWall
+                    j1, j2 = np.min(SByy), np.max(SByy)+1
+                    fld = var[tt,...,j1:j2,:][...,SByy-j1,SBxx]
+                elif region is not None:
+                    fld = var[(tt,)+tuple(region)]
+                else:
+                    fld = var[tt]
+            yield fld
+    finally:
+        with NCLOCK:
+            FileOut.close()
+
+
+def _zipRecords(*records):
+    '''Generator of the tuples of the items of the generators records (e.g. from _records), which it owns: all of them
+    are closed, and their files with them, when it is closed or exhausted. zip does not close them.'''
+    try:
+        yield from zip(*records)
+    finally:
+        for rec in records:
+            rec.close()
+
+
+class _Done:
+    '''End of the items of a prefetch thread, with the exception raised by the reader, if any.'''
+    def __init__(self,error=None):
+        self.error = error
+
+
+def prefetch(records,depth=2):
+    '''Iterate over records (any iterator, e.g. a generator reading time records from netCDF) reading up to depth
+    items ahead in a background thread, so that reading record t+1 overlaps the computations on record t. depth=0
+    iterates in the calling thread. The iterator must not share an open netCDF file with other threads.
+    Memory use is depth+1 items; depth=2 (double buffering after the current record) is usually enough.'''
+    if depth <= 0:
+        yield from records
+        return
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for item in records:
+                while not stop.is_set():
+                    try:
+                        buffer.put(item,timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    break
+            done = _Done()
+        except BaseException as error:
+            done = _Done(error)
+        finally:
+            if hasattr(records,'close'):
+                records.close()
+        while not stop.is_set():
+            try:
+                buffer.put(done,timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+    thread = threading.Thread(target=reader,daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item,_Done):
+                if item.error is not None:
+                    raise item.error
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def timeRecords(ncFile,fieldname,region=None,sbWall=None,t1=0,t2=None,depth=2):
+    '''Iterator over the time records t1:t2 of ncFile[fieldname] (like getField, one record at a time), read ahead in
+    a background thread. region and sbWall as in timeStats, depth as in prefetch.'''
+    return prefetch(_records(ncFile,fieldname,region=region,sbWall=sbWall,t1=t1,t2=t2),depth=depth)
+
+
+def timeStats(ncFile,fieldname,region=None,sbWall=None,t1=0,t2=None,ddof=0,depth=2):
+    '''Time mean, variance, minimum and maximum of a 4D (or 3D) variable, reading one time record at a time.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    ncFile    : string with /path/to/stateGlob.nc, ptracersGlob.nc, etc.
+    fieldname : string with the variable name as written on the netCDF file ('Tr1', 'Temp', 'V', etc.)
+    region    : tuple of slices of the dimensions after time, e.g. (slice(0,30),slice(227,None),slice(120,240)) for the
+                shelf above level 30. Only that part of every record is read.
+    sbWall    : (SBxx,SByy) shelf break indices from findShelfBreak. If given, statistics are on the shelf break wall
+                (nz,len(SBxx)) instead of region.
+    t1, t2    : time records to use, default is all
+    ddof      : as in np.var
+    depth     : records read ahead in a background thread (see prefetch)
+
+    OUTPUT
+    mean, var, fmin, fmax : arrays with the shape of one (restricted) time record
+    '''
+    stats = RunningStats()
+    for fld in timeRecords(ncFile,fieldname,region=region,sbWall=sbWall,t1=t1,t2=t2,depth=depth):
+        stats.update(fld)
+    return stats.result(ddof=ddof)
+
+
+def anomalies(ncFile,fieldname,mean,region=None,sbWall=None,t1=0,t2=None,depth=2):
+    '''Generator of the anomalies fld[t]-mean of every time record, one at a time. mean is usually the output of
+    timeStats with the same region or sbWall.'''
+    for fld in timeRecords(ncFile,fieldname,region=region,sbWall=sbWall,t1=t1,t2=t2,depth=depth):
+        yield np.ma.filled(np.ma.asarray(fld,dtype=float),np.nan)-mean
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _regionVolume(MaskC,rA,hFacC,drF,region):
+    '''Volumes of the cells of region (tuple of slices of (nz,ny,nx)), zero on land.'''
+    hFacC = np.asarray(hFacC)
+    CellVol = hFacC*np.asarray(drF)[:,None,None]*np.asarray(rA)[None,:,:]
+    CellVol[rout.landMask(MaskC,hFacC.shape)] = 0
+    return CellVol[tuple(region)] if region is not None else CellVol
+
+
+def _census(records,CellVol,bins):
+    '''Volume histogram of every group of fields yielded by records. bins is a list with the bin edges of every field;
+    cells outside the bins or with NaN (masked) values are not counted. One bincount per time record.'''
+    wet = CellVol > 0
+    vol = CellVol[wet]
+    nbins = [len(edges)-1 for edges in bins]
+    census = []
+    for flds in records:
+        flat = np.zeros(vol.shape,dtype=np.int64)
+        valid = np.ones(vol.shape,dtype=bool)
+        for fld, edges, nb in zip(flds,bins,nbins):
+            val = np.ma.filled(np.ma.asarray(fld,dtype=float),np.nan)[wet]
+            idx = np.searchsorted(edges,val,side='right')-1
+            idx[val == edges[-1]] = nb-1 # the last bin includes its right edge, as np.histogram
+            valid &= (idx >= 0) & (idx < nb)
+            flat = flat*nb+idx
+        census.append(np.bincount(flat[valid],weights=vol[valid],minlength=int(np.prod(nbins))).reshape(nbins))
+    return np.array(census)
+
+
+def tsCensus(stateFile,MaskC,rA,hFacC,drF,Tbins,Sbins,region=None,keyT='Temp',keyS='S',t1=0,t2=None,depth=2):
+    '''Temperature-salinity volume census: volume of water in every T-S class at every time output, reading one time
+    record at a time from the state file.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    stateFile      : string with /path/to/stateGlob.nc
+    MaskC          : land mask (boolean mask, PackedMask or WetIndex from readout_tools)
+    rA, hFacC, drF : grid, as in calc_HCW
+    Tbins, Sbins   : bin edges of temperature and salinity (as np.histogram2d)
+    region         : tuple of slices of (nz,ny,nx), e.g. (slice(0,29),slice(227,None),slice(None)) for the shelf.
+                     Default is the whole domain.
+    keyT, keyS     : names of temperature and salinity on stateFile
+    t1, t2         : time records to use, default is all
+    depth          : records read ahead in a background thread (see prefetch)
+
+    OUTPUT
+    census : array (nt,len(Tbins)-1,len(Sbins)-1) with the volume (m^3) in every T-S class
+    '''
+    CellVol = _regionVolume(MaskC,rA,hFacC,drF,region)
+    records = _zipRecords(_records(stateFile,keyT,region=region,t1=t1,t2=t2),
+                          _records(stateFile,keyS,region=region,t1=t1,t2=t2))
+    return _census(prefetch(records,depth=depth),CellVol,[np.asarray(Tbins,dtype=float),np.asarray(Sbins,dtype=float)])
+
+
+def sigmaCensus(stateFile,MaskC,rA,hFacC,drF,sigmaBins,RhoRef,region=None,keyT='Temp',keyS='S',t1=0,t2=None,
+                At=2.0E-4,Bs=7.4E-4,depth=2):
+    '''Density volume census: volume of water in every sigma class at every time output, with sigma as in
+    calc_sigmaHor, computed for the whole 3D record at once.
+    sigmaBins : bin edges of sigma
+    RhoRef    : reference density, scalar or profile (nz) on the model levels
+    At, Bs    : as in calc_sigmaHor
+    Other arguments as in tsCensus.
+    OUTPUT : array (nt,len(sigmaBins)-1) with the volume (m^3) in every sigma class
+    '''
+    CellVol = _regionVolume(MaskC,rA,hFacC,drF,region)
+    RhoRef = np.asarray(RhoRef,dtype=float)
+    if RhoRef.ndim == 1:
+        RhoRef = RhoRef[:,None,None][tuple(region)[:1]] if region is not None else RhoRef[:,None,None]
+    pairs = _zipRecords(_records(stateFile,keyT,region=region,t1=t1,t2=t2),
+                        _records(stateFile,keyS,region=region,t1=t1,t2=t2))
+    records = ((rout.calc_sigmaHor(RhoRef,T,S,At=At,Bs=Bs),) for T, S in prefetch(pairs,depth=depth))
+    return _census(records,CellVol,[np.asarray(sigmaBins,dtype=float)])
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Paired runs: a canyon run and its control run without canyon (e.g. on make_flat_shelf), read time record by time record.
+
+def _ntime(ncFile,fieldname):
+    with NCLOCK:
+        FileOut = Dataset(ncFile)
+        nt = FileOut.variables[fieldname].shape[0]
+        FileOut.close()
+    return nt
+
+
+def _grid(GridFile):
+    '''Grid of a run: dictionary with hFacC, rA, drF, dxF and MaskC (WetIndex).'''
+    with NCLOCK:
+        GridOut = Dataset(GridFile)
+        grid = {name:np.ma.getdata(GridOut.variables[ncName][:]) for name, ncName in
+                [('hFacC','HFacC'),('rA','rA'),('drF','drF'),('dxF','dxF')]}
+        GridOut.close()
+    grid['MaskC'] = rout.WetIndex(grid['hFacC'])
+    return grid
+
+
+def _restrict(fld,region=None,sbWall=None):
+    '''Part of a 3D array (e.g. a land mask) that _records reads with region or sbWall.'''
+    if sbWall is not None:
+        SBxx, SByy = sbWall
+        return fld[...,SByy,SBxx]
+    if region is not None:
+        return fld[tuple(region)]
+    return fld
+
+
+def pairedRecords(ncFile,ctlFile,fieldname,region=None,sbWall=None,t1=0,t2=None,depth=2):
+    '''Iterator over the pairs (fld, ctl) of matching time records t1:t2 of ncFile[fieldname] (canyon run) and
+    ctlFile[fieldname] (control run), read ahead together in a background thread. region, sbWall and depth as in
+    timeStats. t2 defaults to the number of records of the shorter run.'''
+    if t2 is None:
+        t2 = min(_ntime(ncFile,fieldname),_ntime(ctlFile,fieldname))
+    pairs = _zipRecords(_records(ncFile,fieldname,region=region,sbWall=sbWall,t1=t1,t2=t2),
+                        _records(ctlFile,fieldname,region=region,sbWall=sbWall,t1=t1,t2=t2))
+    return prefetch(pairs,depth=depth)
+
+
+def anomalyRecords(ncFile,ctlFile,fieldname,region=None,sbWall=None,Mask=None,ctlMask=None,t1=0,t2=None,depth=2):
+    '''Generator of the canyon minus control anomalies fld[t]-ctl[t], one time record at a time.
+    Mask, ctlMask : land masks of the canyon and control grids (boolean mask, PackedMask or WetIndex), optional. Cells
+                    that are land in either run, or masked in the output, are NaN.
+    Other arguments as in pairedRecords.'''
+    land = None
+    for mask in (Mask,ctlMask):
+        if mask is not None and (hasattr(mask,'unpack') or np.ndim(mask) == 3):
+            mask = _restrict(rout.landMask(mask),region=region,sbWall=sbWall)
+            land = mask if land is None else land | mask
+    for fld, ctl in pairedRecords(ncFile,ctlFile,fieldname,region=region,sbWall=sbWall,t1=t1,t2=t2,depth=depth):
+        anom = np.ma.filled(np.ma.asarray(fld,dtype=float),np.nan)-np.ma.filled(np.ma.asarray(ctl,dtype=float),np.nan)
+        if land is not None:
+            anom[land] = np.nan
+        yield anom
+
+
+def anomalyStats(ncFile,ctlFile,fieldname,region=None,sbWall=None,Mask=None,ctlMask=None,t1=0,t2=None,ddof=0,depth=2,
+                 outFile=None):
+    '''Time mean, variance, minimum and maximum of the canyon minus control anomaly of a variable, reading one time
+    record of each run at a time.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    ncFile, ctlFile : strings with /path/to/ file of the canyon run and of the control run (e.g. both ptracersGlob.nc)
+    fieldname       : string with the variable name ('Tr1', 'Temp', 'V', etc.)
+    region, sbWall  : part of every record to use, as in timeStats
+    Mask, ctlMask   : land masks of the two grids, as in anomalyRecords
+    t1, t2          : time records to use, default is all the records of the shorter run
+    ddof            : as in np.var
+    depth           : records read ahead in a background thread (see prefetch)
+    outFile         : string with /path/to/file to also write the anomaly to (variable fieldname, (T,...)), in the
+                      same pass. The file is zlib-compressed and chunked by time record and level, like cache_tools.
+                      Writes hold NCLOCK, like the reads of the prefetch thread.
+
+    OUTPUT
+    mean, var, fmin, fmax : arrays with the shape of one (restricted) time record
+    '''
+    stats = RunningStats()
+    def records():
+        for anom in anomalyRecords(ncFile,ctlFile,fieldname,region=region,sbWall=sbWall,Mask=Mask,ctlMask=ctlMask,
+                                   t1=t1,t2=t2,depth=depth):
+            stats.update(anom)
+            yield (anom,)
+    if outFile is None:
+        for anom in records():
+            pass
+    else:
+        import canyon_tools.cache_tools as ct
+        ct._write(outFile,[fieldname],records(),4,lock=NCLOCK)
+    return stats.result(ddof=ddof)
+
+
+def anomalyHCW(ncFile,ctlFile,GridFile,ctlGridFile,tracer='Tr1',nzlim=29,yin=227,xin=120,xfin=359,zfin=29,xi=180,
+               yi=50,trlim=None,t1=0,t2=None,depth=2):
+    '''HCW (calc_HCW) and tracer mass on shelf (calc_TrMassonShelf) of the canyon run minus those of the control run,
+    computed from one time record of each run at a time, each run on its own grid.
+    -------------------------------------------------------------------------------------------------------------------
+    INPUT
+    ncFile, ctlFile         : strings with /path/to/ptracersGlob.nc of the canyon run and of the control run
+    GridFile, ctlGridFile   : strings with /path/to/gridGlob.nc of the two runs
+    tracer                  : tracer name, e.g. 'Tr1'
+    nzlim, yin, xin, xfin, zfin, xi, yi : as in calc_HCW
+    trlim                   : threshold concentration of both runs. Default is the canyon run at [0,nzlim,yi,xi].
+    t1, t2, depth           : as in pairedRecords
+
+    OUTPUT
+    HCW, TrMass : arrays (nt,3) with the anomaly, the canyon run and the control run at every time output
+    '''
+    grids = [_grid(GridFile),_grid(ctlGridFile)]
+    for grid in grids: # wet cells and volumes of every grid, found once
+        grid['cellsHCW'] = mtt.wetVolume(grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],zfin,slice(yin,None),
+                                         slice(xin,xfin))
+        grid['cellsShelf'] = mtt.wetVolume(grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],zfin,slice(yin,None))
+    if trlim is None: # first time output, also when t1 > 0
+        with NCLOCK:
+            FileOut = Dataset(ncFile)
+            trlim = FileOut.variables[tracer][0,nzlim,yi,xi]
+            FileOut.close()
+    print('tracer limit concentration is: ',trlim)
+
+    HCW, TrMass = [], []
+    for pair in pairedRecords(ncFile,ctlFile,tracer,t1=t1,t2=t2,depth=depth):
+        with contextlib.redirect_stdout(io.StringIO()): # trlim is printed once above, not for every record
+            vol = [mtt.calc_HCW(Tr[None],grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],nzlim=nzlim,yin=yin,
+                                xin=xin,xfin=xfin,zfin=zfin,xi=xi,yi=yi,trlim=trlim,cells=grid['cellsHCW'])[0]
+                   for Tr, grid in zip(pair,grids)]
+        tot = [mtt.calc_TrMassonShelf(Tr[None],grid['MaskC'],grid['rA'],grid['hFacC'],grid['drF'],yin=yin,zfin=zfin,
+                                      cells=grid['cellsShelf'])[0]
+               for Tr, grid in zip(pair,grids)]
+        HCW.append((vol[0]-vol[1],vol[0],vol[1]))
+        TrMass.append((tot[0]-tot[1],tot[0],tot[1]))
+    return (np.array(HCW),np.array(TrMass))
+
+
+def anomalySBTransport(stateFile,ctlStateFile,GridFile,ctlGridFile,zlev=29,fieldname='V',t1=0,t2=None,depth=2):
+    '''Transport across the shelf break (SBTransport) of the canyon run minus that of the control run, computed from
+    one time record of each run at a time. Each run uses the shelf break of its own grid at level zlev.
+    stateFile, ctlStateFile : strings with /path/to/stateGlob.nc (or flux file) of the two runs
+    GridFile, ctlGridFile   : strings with /path/to/gridGlob.nc of the two runs
+    fieldname               : meridional flux or velocity at v points, e.g. 'V' or 'VTRAC01'
+    OUTPUT : Total (nt), PerDepth (nt,nz) and PerX (nt,nx) anomalies, as in SBTransport'''
+    grids = [_grid(GridFile),_grid(ctlGridFile)]
+    for grid in grids: # shelf break of every grid, found once
+        grid['SBWall'] = sbt.SBWallArea(grid['hFacC'],grid['drF'],grid['dxF'],zlev)
+    Total, PerDepth, PerX = [], [], []
+    for pair in pairedRecords(stateFile,ctlStateFile,fieldname,t1=t1,t2=t2,depth=depth):
+        out = [sbt.SBTransport(Flux[None],grid['hFacC'],grid['drF'],grid['dxF'],zlev,Mask=grid['MaskC'],
+                               wall=grid['SBWall'])
+               for Flux, grid in zip(pair,grids)]
+        Total.append(out[0][0][0]-out[1][0][0])
+        PerDepth.append(out[0][1][0]-out[1][1][0])
+        PerX.append(out[0][2][0]-out[1][2][0])
+    return (np.array(Total),np.array(PerDepth),np.array(PerX))
@@ -8,11 +8,18 @@ setup(
     author='Karina Ramos Musalem',
     author_email='kramosmu@eos.ubc.ca',
     install_requires=[
-        "matplotlib",
-        "scipy",
+        "numpy",
         "netCDF4",
     ],
+    extras_require={
+        "lazy": ["xarray", "dask"],
+        "plot": ["matplotlib"],
+        "curvilinear": ["scipy"],
+    },
     packages=['canyon_tools'],
+    entry_points={
+        "console_scripts": ["canyon-metrics = canyon_tools.pipeline_tools:main"],
+    },
 )
 
  
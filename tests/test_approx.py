@@ -0,0 +1,59 @@
+# Approximate HCW and tracer mass from stratified samples of the wet cells: the full sample is the exact metric and
+# the error bound covers the exact value at about its nominal rate.
+
+import contextlib
+
+import io
+
+import numpy as np
+
+from netCDF4 import Dataset
+
+import canyon_tools.metrics_tools as mtt
+
+KW = {'nzlim':4, 'yin':8, 'xin':2, 'xfin':20, 'zfin':6, 'xi':2, 'yi':2}
+
+
+def _syntheticRun(nt=4,seed=0):
+    '''Shelf grid with partial cells and a noisy tracer that increases with depth.'''
+    rng = np.random.default_rng(seed)
+    nz, ny, nx = 10, 24, 24
+    hFacC = np.ones((nz,ny,nx))
+    hFacC[6:,12:,:] = 0 # shelf
+    hFacC[5,12:,:] = 0.5
+    drF = np.full(nz,10.0)
+    rA = np.full((ny,nx),1.0e6)
+    Tr = np.arange(nz)[None,:,None,None]+rng.normal(size=(nt,nz,ny,nx))
+    return Tr, hFacC == 0, rA, hFacC, drF
+
+
+def test_full_sample_is_exact(tmp_path):
+    Tr, MaskC, rA, hFacC, drF = _syntheticRun()
+    path = str(tmp_path/'ptracers.nc')
+    TrOut = Dataset(path,'w')
+    for name, size in zip(('T','Z','Y','X'),Tr.shape):
+        TrOut.createDimension(name,size)
+    TrOut.createVariable('Tr1','f8',('T','Z','Y','X'))[:] = Tr
+    TrOut.close()
+    with contextlib.redirect_stdout(io.StringIO()):
+        exact = mtt.calc_HCW(Tr,MaskC,rA,hFacC,drF,**KW)
+        inMemory = list(mtt.refine_HCW(Tr,MaskC,rA,hFacC,drF,stratum=16,seed=3,**KW))
+        TrIn = Dataset(path)
+        onDisk = list(mtt.refine_HCW(TrIn.variables['Tr1'],MaskC,rA,hFacC,drF,stratum=16,seed=3,**KW))
+        TrIn.close()
+    assert np.allclose(inMemory[-1][1],exact) and np.allclose(inMemory[-1][2],0)
+    for mem, disk in zip(inMemory,onDisk): # one read per record gives the same refinements
+        assert np.allclose(mem[1],disk[1]) and np.allclose(mem[2],disk[2])
+    mass = list(mtt.refine_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=KW['yin'],zfin=KW['zfin'],seed=3))
+    assert np.allclose(mass[-1][1],mtt.calc_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=KW['yin'],zfin=KW['zfin']))
+
+
+def test_bound_covers_exact_value():
+    Tr, MaskC, rA, hFacC, drF = _syntheticRun()
+    exact = mtt.calc_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=KW['yin'],zfin=KW['zfin'])
+    covered = []
+    for seed in range(200):
+        times, est, bound = mtt.approx_TrMassonShelf(Tr,MaskC,rA,hFacC,drF,yin=KW['yin'],zfin=KW['zfin'],fraction=0.1,
+                                                     stratum=64,seed=seed)
+        covered.append(np.abs(est-exact) <= bound)
+    assert 0.9 <= np.mean(covered) <= 0.99 # nominal 95%
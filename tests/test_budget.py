@@ -0,0 +1,64 @@
+# Closure of the BoxBudget tracer budget on a synthetic grid: the storage change of a box equals the net transport
+# through its faces when the tracer only changes by the convergence of the face fluxes.
+
+import numpy as np
+
+import canyon_tools.bathy_tools as bt
+
+import canyon_tools.section_tools as sct
+
+
+def _syntheticRun(nt=4,dt=60.0,seed=0,freeSurface=False):
+    '''Grid from a sloping topography and tracer fields stepped forward with random face transports. With freeSurface,
+    there is also a tracer flux through the sea surface (WTRAC at k = 0), as under a linear free surface.'''
+    rng = np.random.default_rng(seed)
+    nz, ny, nx = 8, 12, 10
+    drF = np.full(nz,10.0)
+    topo = -(80.0-5.0*np.arange(ny))[None,:]+np.zeros((nx,1)) # (nx,ny), shallower towards +y
+    hFacC, hFacW, hFacS = bt.hFacFromTopo(topo,drF,hFacMin=0.2,periodicX=False)
+    dxG = np.full((ny+1,nx),1000.0)
+    dyG = np.full((ny,nx+1),1000.0)
+    rA = np.full((ny,nx),1.0e6)
+    wet = hFacC > 0
+
+    UTRAC = rng.normal(size=(nt,nz,ny,nx+1))*(hFacW > 0)
+    VTRAC = rng.normal(size=(nt,nz,ny+1,nx))*(hFacS > 0)
+    WTRAC = rng.normal(size=(nt,nz,ny,nx))
+    if not freeSurface:
+        WTRAC[:,0] = 0 # rigid lid
+    WTRAC[:,1:] *= wet[1:] & wet[:-1]
+
+    vol = hFacC*drF[:,None,None]*rA
+    mass = np.zeros((nt,nz,ny,nx))
+    mass[0] = 1.0e4*vol
+    for tt in range(nt-1):
+        conv = UTRAC[tt,...,:-1]-UTRAC[tt,...,1:]+VTRAC[tt,:,:-1,:]-VTRAC[tt,:,1:,:]-WTRAC[tt]
+        conv[:-1] += WTRAC[tt,1:]
+        mass[tt+1] = mass[tt]+dt*conv
+    Tr = np.where(wet,mass/np.where(wet,vol,1),0)
+    return (UTRAC,VTRAC,WTRAC,Tr,dt,dxG,dyG,drF,rA,hFacC,hFacW,hFacS)
+
+
+def test_box_budget_closes():
+    UTRAC, VTRAC, WTRAC, Tr, dt, dxG, dyG, drF, rA, hFacC, hFacW, hFacS = _syntheticRun()
+    for box in [(2,7,3,9,0,5),(0,10,0,12,0,8),(1,6,4,12,2,6)]:
+        budget = sct.BoxBudget(*box,dxG,dyG,drF,rA,hFacC,hFacW,hFacS)
+        Flux, Net, Mass, dMdt = budget.budget(UTRAC,VTRAC,WTRAC,Tr,dt,weight=False)
+        assert np.allclose(dMdt,Net[:-1],rtol=1e-9,atol=1e-6*np.abs(Mass).max()/dt)
+
+
+def test_whole_domain_is_closed():
+    UTRAC, VTRAC, WTRAC, Tr, dt, dxG, dyG, drF, rA, hFacC, hFacW, hFacS = _syntheticRun()
+    budget = sct.BoxBudget(0,10,0,12,0,8,dxG,dyG,drF,rA,hFacC,hFacW,hFacS)
+    Flux, Net, Mass, dMdt = budget.budget(UTRAC,VTRAC,WTRAC,Tr,dt,weight=False)
+    assert np.allclose(Flux['west'],0) and np.allclose(Flux['south'],0) and np.allclose(Flux['bottom'],0)
+
+
+def test_surface_flux_with_linear_free_surface():
+    UTRAC, VTRAC, WTRAC, Tr, dt, dxG, dyG, drF, rA, hFacC, hFacW, hFacS = _syntheticRun(freeSurface=True)
+    closed = sct.BoxBudget(2,7,3,9,0,5,dxG,dyG,drF,rA,hFacC,hFacW,hFacS)
+    budget = sct.BoxBudget(2,7,3,9,0,5,dxG,dyG,drF,rA,hFacC,hFacW,hFacS,surface=True)
+    Flux, Net, Mass, dMdt = budget.budget(UTRAC,VTRAC,WTRAC,Tr,dt,weight=False)
+    assert np.allclose(dMdt,Net[:-1],rtol=1e-9,atol=1e-6*np.abs(Mass).max()/dt)
+    assert np.allclose(Flux['top'],-WTRAC[:,0,3:9,2:7].sum(axis=(1,2)))
+    assert np.allclose(closed.budget(UTRAC,VTRAC,WTRAC,Tr,dt,weight=False)[0]['top'],0)
@@ -0,0 +1,47 @@
+# Cached derived fields: static fields without time dimension, and no cache file when there is nothing to cache.
+
+import os
+
+import numpy as np
+
+import pytest
+
+from netCDF4 import Dataset
+
+import canyon_tools.cache_tools as ct
+
+
+def _writeGrid(path,hFacC):
+    GridOut = Dataset(path,'w')
+    for name, size in zip(('Z','Y','X'),hFacC.shape):
+        GridOut.createDimension(name,size)
+    GridOut.createVariable('HFacC','f8',('Z','Y','X'))[:] = hFacC
+    GridOut.close()
+
+
+def test_static_mask_has_no_time_dimension(tmp_path):
+    hFacC = np.ones((3,4,5))
+    hFacC[1:,2:,:] = 0
+    hFacC[2,0,0] = 0.3
+    path = str(tmp_path/'gridGlob.nc')
+    _writeGrid(path,hFacC)
+    Mask = ct.cachedMask(path)
+    assert Mask.shape == hFacC.shape and Mask.dtype == bool
+    assert np.array_equal(Mask[...],hFacC == 0)
+    CacheIn = Dataset(Mask.path)
+    assert 'T' not in CacheIn.variables['Mask'].dimensions
+    CacheIn.close()
+    assert np.array_equal(ct.cachedMask(path)[1],hFacC[1] == 0) # second call reads the cache
+    Mask4 = ct.cachedMask(path,nt=2)
+    assert Mask4.shape == (2,)+hFacC.shape and np.array_equal(Mask4[1],hFacC == 0)
+
+
+def test_no_records_leaves_no_cache_file(tmp_path):
+    source = str(tmp_path/'gridGlob.nc')
+    _writeGrid(source,np.ones((2,3,4)))
+    with pytest.raises(ValueError):
+        ct.cachedFields('empty',[source],['fld'],lambda: iter(()),cacheDir=str(tmp_path/'cache'))
+    assert os.listdir(str(tmp_path/'cache')) == []
+    fld, = ct.cachedFields('empty',[source],['fld'],lambda: ((np.arange(3.0),) for tt in range(2)),
+                           cacheDir=str(tmp_path/'cache'))
+    assert fld.shape == (2,3)
@@ -0,0 +1,75 @@
+# Incremental metric updates: only new records are computed, and stored results are computed again when the
+# parameters, the grid or the source file change.
+
+import numpy as np
+
+from netCDF4 import Dataset
+
+import canyon_tools.incremental_tools as itt
+
+
+def _writeTracer(path,Tr):
+    TrOut = Dataset(path,'w')
+    TrOut.createDimension('T',None)
+    for name, size in zip(('Z','Y','X'),Tr.shape[1:]):
+        TrOut.createDimension(name,size)
+    TrOut.createVariable('Tr1','f8',('T','Z','Y','X'))[:len(Tr)] = Tr
+    TrOut.close()
+
+
+def _grid():
+    nz, ny, nx = 4, 6, 5
+    hFacC = np.ones((nz,ny,nx))
+    hFacC[2:,3:,:] = 0
+    return (hFacC == 0, np.full((ny,nx),1.0e6), hFacC, np.full(nz,10.0))
+
+
+def _counting(calls):
+    def func(Tr):
+        calls.append(len(Tr))
+        return np.asarray(Tr).reshape(len(Tr),-1).sum(axis=1)
+    return func
+
+
+def test_growing_file(tmp_path):
+    Tr = np.random.default_rng(0).normal(size=(5,4,6,5))
+    path, state = str(tmp_path/'ptracers.nc'), str(tmp_path/'state.npz')
+    calls = []
+    _writeTracer(path,Tr[:2])
+    assert np.allclose(itt.updateMetric(state,'S',path,'Tr1',_counting(calls)),Tr[:2].sum(axis=(1,2,3)))
+    _writeTracer(path,Tr)
+    assert np.allclose(itt.updateMetric(state,'S',path,'Tr1',_counting(calls)),Tr.sum(axis=(1,2,3)))
+    assert np.allclose(itt.updateMetric(state,'S',path,'Tr1',_counting(calls)),Tr.sum(axis=(1,2,3)))
+    assert calls == [2,3] # only the new records, nothing when there are none
+
+
+def test_changed_params_and_grid(tmp_path):
+    Tr = np.random.default_rng(1).normal(size=(3,4,6,5))+5
+    path, state = str(tmp_path/'ptracers.nc'), str(tmp_path/'state.npz')
+    _writeTracer(path,Tr)
+    MaskC, rA, hFacC, drF = _grid()
+    first = itt.updateTrMassonShelf(state,path,'Tr1',MaskC,rA,hFacC,drF,yin=3,zfin=2)
+    other = itt.updateTrMassonShelf(state,path,'Tr1',MaskC,rA,hFacC,drF,yin=1,zfin=2) # new params
+    assert not np.allclose(first,other)
+    hFacC2 = hFacC.copy()
+    hFacC2[:,4,:] = 0.5 # same shapes, other grid
+    regrid = itt.updateTrMassonShelf(state,path,'Tr1',hFacC2 == 0,rA,hFacC2,drF,yin=1,zfin=2)
+    assert not np.allclose(other,regrid)
+
+
+def test_replaced_and_truncated_source(tmp_path):
+    Tr = np.random.default_rng(2).normal(size=(4,4,6,5))
+    path, state = str(tmp_path/'ptracers.nc'), str(tmp_path/'state.npz')
+    func = lambda Tr: np.asarray(Tr).reshape(len(Tr),-1).sum(axis=1)
+    _writeTracer(path,Tr)
+    itt.updateMetric(state,'S',path,'Tr1',func)
+    _writeTracer(path,2*Tr) # same number of records, other run
+    assert np.allclose(itt.updateMetric(state,'S',path,'Tr1',func),2*Tr.sum(axis=(1,2,3)))
+    _writeTracer(path,Tr[:2]) # fewer records than processed
+    assert np.allclose(itt.updateMetric(state,'S',path,'Tr1',func),Tr[:2].sum(axis=(1,2,3)))
+
+
+def test_no_records_and_no_state(tmp_path):
+    path = str(tmp_path/'ptracers.nc')
+    _writeTracer(path,np.zeros((0,4,6,5)))
+    assert len(itt.updateMetric(str(tmp_path/'state.npz'),'S',path,'Tr1',lambda Tr: Tr)) == 0
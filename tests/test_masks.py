@@ -0,0 +1,54 @@
+# Compact land masks (PackedMask, WetIndex) give back the boolean mask hFacC == 0.
+
+import numpy as np
+
+import canyon_tools.readout_tools as rout
+
+
+def _hFacC():
+    '''Slope with partial bottom cells, an all-dry column, an all-wet column and an overhang (two runs in a column).'''
+    nz, ny, nx = 7, 5, 6
+    rng = np.random.default_rng(0)
+    hFacC = np.zeros((nz,ny,nx))
+    depth = rng.integers(0,nz+1,size=(ny,nx))
+    for j in range(ny):
+        for i in range(nx):
+            hFacC[:depth[j,i],j,i] = 1
+            if 0 < depth[j,i] < nz:
+                hFacC[depth[j,i]-1,j,i] = rng.uniform(0.1,1) # partial bottom cell
+    hFacC[:,0,0] = 0       # all dry
+    hFacC[:,0,1] = 1       # all wet
+    hFacC[:,1,1] = [1,0.4,0,0,1,1,0.2] # wet, land, wet again
+    return hFacC
+
+
+def test_packed_mask_round_trip():
+    hFacC = _hFacC()
+    Mask = rout.PackedMask(hFacC == 0)
+    assert np.array_equal(Mask.unpack(),hFacC == 0)
+    jj, ii = np.array([0,0,1,4]), np.array([0,1,1,5])
+    assert np.array_equal(Mask.columns(jj,ii),(hFacC == 0)[:,jj,ii])
+
+
+def test_wet_index_round_trip():
+    hFacC = _hFacC()
+    Mask = rout.WetIndex(hFacC)
+    assert np.array_equal(Mask.unpack(),hFacC == 0)
+    assert np.array_equal(rout.landMask(Mask),hFacC == 0)
+    jj, ii = np.array([0,0,1,4]), np.array([0,1,1,5])
+    assert np.array_equal(Mask.columns(jj,ii),(hFacC == 0)[:,jj,ii])
+    for box in [(slice(None),)*3,(slice(1,6),slice(0,3),slice(1,None)),(slice(0,2),slice(1,2),slice(1,2))]:
+        kk, jj, ii = Mask.cells(box)
+        wet = np.zeros(hFacC.shape,dtype=bool)
+        wet[kk,jj,ii] = True
+        expected = np.zeros(hFacC.shape,dtype=bool)
+        expected[box] = hFacC[box] > 0
+        assert np.array_equal(wet,expected)
+        assert all(np.array_equal(a,b) for a, b in zip(rout.wetCells(hFacC == 0,box,hFacC.shape),(kk,jj,ii)))
+
+
+def test_all_dry():
+    hFacC = np.zeros((3,2,2))
+    assert rout.PackedMask(hFacC == 0).unpack().all()
+    Mask = rout.WetIndex(hFacC)
+    assert Mask.unpack().all() and len(Mask.cells((slice(None),)*3)[0]) == 0
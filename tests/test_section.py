@@ -0,0 +1,57 @@
+# Transport through Sections: straight sections against direct sums of the face fluxes, and a diagonal staircase
+# against the transport of a uniform flow across the straight line between its ends.
+
+import numpy as np
+
+import canyon_tools.section_tools as sct
+
+
+def _grid(seed=0):
+    '''Uneven grid with partial and land cells, and random fluxes at cell centers (nt,nz,ny,nx), as from get_TRAC.'''
+    rng = np.random.default_rng(seed)
+    nt, nz, ny, nx = 3, 5, 9, 11
+    drF = rng.uniform(5,15,size=nz)
+    dx = rng.uniform(800,1200,size=(ny,nx))
+    dy = rng.uniform(800,1200,size=(ny,nx))
+    hFacC = rng.uniform(0.2,1,size=(nz,ny,nx))*(rng.random((nz,ny,nx)) > 0.2)
+    UTRAC = rng.normal(size=(nt,nz,ny,nx))
+    VTRAC = rng.normal(size=(nt,nz,ny,nx))
+    return (UTRAC,VTRAC,dx,dy,drF,hFacC)
+
+
+def test_zonal_section():
+    UTRAC, VTRAC, dx, dy, drF, hFacC = _grid()
+    j, i1, i2 = 4, 2, 9
+    area = hFacC[:,j,i1:i2]*dx[j,i1:i2]*drF[:,None]
+    section = sct.Section([i1,i2],[j,j],dx,dy,drF,hFacC)
+    assert np.allclose(section.transport(UTRAC,VTRAC),np.sum(VTRAC[:,:,j,i1:i2]*area,axis=(1,2)))
+    backwards = sct.Section([i2,i1],[j,j],dx,dy,drF,hFacC) # drawn towards -x: southward flow is positive
+    assert np.allclose(backwards.transport(UTRAC,VTRAC),-section.transport(UTRAC,VTRAC))
+    wet = sct.Section([i1,i2],[j,j],dx,dy,drF,hFacC,k1=1,k2=4).transport(UTRAC,VTRAC,weight=False)
+    assert np.allclose(wet,np.sum((VTRAC*(hFacC > 0))[:,1:4,j,i1:i2],axis=(1,2)))
+
+
+def test_meridional_section():
+    UTRAC, VTRAC, dx, dy, drF, hFacC = _grid(1)
+    i, j1, j2 = 6, 1, 8
+    area = hFacC[:,j1:j2,i]*dy[j1:j2,i]*drF[:,None]
+    section = sct.Section([i,i],[j1,j2],dx,dy,drF,hFacC) # drawn towards +y: westward flow is positive
+    assert np.allclose(section.transport(UTRAC,VTRAC),-np.sum(UTRAC[:,:,j1:j2,i]*area,axis=(1,2)))
+
+
+def test_diagonal_staircase():
+    nz, ny, nx = 4, 12, 12
+    u0, v0, width, drF = 0.3, -0.7, 500.0, np.full(nz,10.0)
+    dx = dy = np.full((ny,nx),width)
+    hFacC = np.ones((nz,ny,nx))
+    UTRAC = np.full((1,nz,ny,nx),u0)
+    VTRAC = np.full((1,nz,ny,nx),v0)
+    for (i0,j0), (i1,j1) in [((1,2),(8,7)),((9,1),(2,10)),((3,3),(3,3+5)),((2,9),(10,4))]:
+        section = sct.Section([i0,i1],[j0,j1],dx,dy,drF,hFacC)
+        assert len(section.i) == abs(i1-i0)+abs(j1-j0)
+        # uniform flow: the transport across the staircase is the transport across the straight line (v0*Dx-u0*Dy)*depth
+        assert np.allclose(section.transport(UTRAC,VTRAC),(v0*(i1-i0)-u0*(j1-j0))*width*drF.sum())
+        # the staircase stays within a cell of the line
+        cells = np.stack([section.i-i0,section.j-j0],axis=1)
+        dist = np.abs(cells[:,0]*(j1-j0)-cells[:,1]*(i1-i0))/np.hypot(i1-i0,j1-j0)
+        assert dist.max() <= 1.5
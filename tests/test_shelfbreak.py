@@ -0,0 +1,51 @@
+# Cross-shelf-break transports on synthetic grids with and without a canyon.
+
+import numpy as np
+
+import canyon_tools.shelfbreak_tools as sbt
+
+
+def _grid(canyon):
+    nz, ny, nx = 6, 20, 16
+    hFacC = np.ones((nz,ny,nx))
+    hFacC[3:,10:,:] = 0 # shelf at y >= 10 below level 3
+    if canyon:
+        hFacC[3:,10:14,6:10] = 1 # canyon cut into the shelf
+    dr = np.full(nz,10.0)
+    dx = np.full((ny,nx),100.0)
+    dy = np.full((ny,nx),200.0)
+    return (hFacC,dr,dx,dy)
+
+
+def test_normal_transport_is_SBTransport_on_straight_break():
+    hFacC, dr, dx, dy = _grid(canyon=False)
+    rng = np.random.default_rng(1)
+    nz, ny, nx = hFacC.shape
+    U = rng.normal(size=(3,nz,ny,nx+1))
+    V = rng.normal(size=(3,nz,ny+1,nx))
+    Total, PerDepth, PerX = sbt.SBNormalTransport(U,V,hFacC,dr,dx,dy,3)
+    ref = sbt.SBTransport(V,hFacC,dr,dx,3)
+    assert np.allclose(Total,ref[0]) and np.allclose(PerDepth,ref[1]) and np.allclose(PerX,ref[2])
+
+
+def test_alongshore_flow_does_not_cross_canyon_break():
+    hFacC, dr, dx, dy = _grid(canyon=True)
+    nz, ny, nx = hFacC.shape
+    U = np.ones((2,nz,ny,nx+1)) # uniform alongshore flow goes in and out of the canyon through its side walls
+    V = np.zeros((2,nz,ny+1,nx))
+    Total, PerDepth, PerX = sbt.SBNormalTransport(U,V,hFacC,dr,dx,dy,3)
+    assert np.allclose(Total,0)
+    assert not np.allclose(PerX,0)
+
+
+def test_staircase_geometry_is_cached():
+    hFacC, dr, dx, dy = _grid(canyon=True)
+    nz, ny, nx = hFacC.shape
+    geometry = sbt.SBGeometry(hFacC,dr,dx,dy,3)
+    assert sbt.SBGeometry(hFacC,dr,dx,dy,3) is geometry
+    rng = np.random.default_rng(2)
+    U = rng.normal(size=(2,nz,ny,nx+1))
+    V = rng.normal(size=(2,nz,ny+1,nx))
+    out = sbt.SBNormalTransport(U,V,hFacC,dr,dx,dy,3,geometry=geometry)
+    ref = sbt.SBNormalTransport(U,V,hFacC,dr,dx,dy,3)
+    assert all(np.allclose(a,b) for a, b in zip(out,ref))
@@ -0,0 +1,52 @@
+# Round trips through the metrics store: runs appended over several writes, overwritten with shorter series or never
+# written for a metric, and metrics told apart by their parameters.
+
+import numpy as np
+
+import pytest
+
+import canyon_tools.store_tools as stt
+
+
+def test_append_runs_and_never_written(tmp_path):
+    store = str(tmp_path/'store.nc')
+    stt.writeMetrics(store,'EXP','HCW',['r1','r2','r3'],[np.arange(4.0)]*3)
+    stt.writeMetrics(store,'EXP','TrMass',['r1'],[np.arange(4.0)])
+    stt.writeMetrics(store,'EXP','HCW',['r4'],[np.arange(6.0)]) # new run, longer series
+
+    runs, HCW = stt.readMetric(store,'EXP','HCW')
+    assert runs == ['r1','r2','r3','r4']
+    assert np.array_equal(HCW[:3,:4],np.tile(np.arange(4.0),(3,1))) and np.all(np.isnan(HCW[:3,4:]))
+    assert np.array_equal(HCW[3],np.arange(6.0))
+
+    runs, TrMass = stt.readMetric(store,'EXP','TrMass')
+    assert np.array_equal(TrMass[0],np.arange(4.0))
+    assert np.all(np.isnan(TrMass[1:])) # r2-r4 never written for TrMass
+
+
+def test_overwrite_with_shorter_series(tmp_path):
+    store = str(tmp_path/'store.nc')
+    stt.writeMetrics(store,'EXP','HCW',['r1','r2'],[np.arange(5.0),np.arange(5.0)])
+    stt.writeMetrics(store,'EXP','HCW',['r2'],[[7.0,8.0]])
+    runs, HCW = stt.readMetric(store,'EXP','HCW',runs=['r2','r1'])
+    assert np.array_equal(HCW[0,:2],[7.0,8.0]) and np.all(np.isnan(HCW[0,2:]))
+    assert np.array_equal(HCW[1],np.arange(5.0))
+
+
+def test_params_keys(tmp_path):
+    store = str(tmp_path/'store.nc')
+    keyA = stt.writeMetrics(store,'EXP','HCW',['r1'],[[1.0]],params={'a':1.5})
+    keyB = stt.writeMetrics(store,'EXP','HCW',['r1'],[[2.0]],params={'a':'1-5'})
+    assert keyA != keyB # same text once made a variable name
+    assert stt.readMetric(store,'EXP','HCW',params={'a':1.5})[1][0,0] == 1.0
+    assert stt.readMetric(store,'EXP','HCW',params={'a':'1-5'})[1][0,0] == 2.0
+
+    # NumPy scalars are the same parameters as Python numbers
+    keyC = stt.writeMetrics(store,'EXP','HCW',['r1'],[[3.0]],params={'nzlim':np.int64(29),'trlim':np.float32(0.5)})
+    assert keyC == stt.metricKey('HCW',{'nzlim':29,'trlim':0.5})
+    assert stt.readMetric(store,'EXP','HCW',params={'nzlim':29,'trlim':0.5})[1][0,0] == 3.0
+
+    metrics = stt.listMetrics(store,'EXP')
+    assert metrics[keyA] == ('HCW',{'a':1.5}) and metrics[keyC] == ('HCW',{'nzlim':29,'trlim':0.5})
+    with pytest.raises(KeyError):
+        stt.readMetric(store,'EXP','HCW',params={'a':2})
@@ -0,0 +1,51 @@
+# Streaming statistics of sequences of fields.
+
+import numpy as np
+
+import pytest
+
+import canyon_tools.stream_tools as stt
+
+
+def test_running_stats_match_numpy():
+    Tr = np.random.default_rng(0).normal(size=(6,3,4))
+    stats, other = stt.RunningStats(), stt.RunningStats()
+    for t in range(4):
+        stats.update(Tr[t])
+    for t in range(4,6):
+        other.update(Tr[t])
+    stats.merge(other)
+    stats.merge(stt.RunningStats())
+    mean, var, fmin, fmax = stats.result(ddof=1)
+    assert np.allclose(mean,Tr.mean(axis=0)) and np.allclose(var,Tr.var(axis=0,ddof=1))
+    assert np.array_equal(fmin,Tr.min(axis=0)) and np.array_equal(fmax,Tr.max(axis=0))
+
+
+def test_running_stats_empty():
+    with pytest.raises(ValueError):
+        stt.RunningStats().result()
+
+
+def _writeTracer(path,Tr):
+    TrOut = stt.Dataset(path,'w')
+    TrOut.createDimension('T',None)
+    for name, size in zip(('Z','Y','X'),Tr.shape[1:]):
+        TrOut.createDimension(name,size)
+    TrOut.createVariable('Tr1','f8',('T','Z','Y','X'))[:len(Tr)] = Tr
+    TrOut.close()
+
+
+def test_paired_records_close_both_files(tmp_path,monkeypatch):
+    Tr = np.random.default_rng(1).normal(size=(6,2,3,4))
+    _writeTracer(str(tmp_path/'run.nc'),Tr)
+    _writeTracer(str(tmp_path/'ctl.nc'),-Tr)
+    opened, Dataset = [], stt.Dataset
+    def tracked(*args,**kwargs):
+        opened.append(Dataset(*args,**kwargs))
+        return opened[-1]
+    monkeypatch.setattr(stt,'Dataset',tracked)
+    pairs = stt.pairedRecords(str(tmp_path/'run.nc'),str(tmp_path/'ctl.nc'),'Tr1',depth=2)
+    fld, ctl = next(pairs)
+    assert np.allclose(fld,Tr[0]) and np.allclose(ctl,-Tr[0])
+    pairs.close() # stop early, with records read ahead
+    assert len(opened) >= 2 and not any(ds.isopen() for ds in opened)